@@ -0,0 +1,326 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import re
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from motor import (
+    MotorDescargas, AgregadorProgreso, IndiceBiblioteca, IndiceBusqueda, TrabajoDescarga, LimitadorAncho,
+    cargar_yt_dlp, ESTADO_COMPLETADO, ESTADO_FALLIDO,
+)
+
+# Offline benchmark suite. A local HTTP server stands in for a media site
+# (progressive files plus HLS and DASH fragment sets reached through yt-dlp's
+# generic extractor), and synthetic folders stand in for large libraries.
+# Results are written as JSON so runs can be compared:
+#
+#     python benchmark.py -o resultados.json
+#     python benchmark.py --bibliotecas 1000,10000 --sin-descargas
+
+MIB = 1 << 20
+
+class ServidorMedios:
+    # In-memory HTTP server with Range support serving synthetic media
+    def __init__(self, tamaño_progresivo: int = 32 * MIB, segmentos: int = 40, tamaño_segmento: int = MIB):
+        self.archivos = {}
+        datos = os.urandom(tamaño_progresivo)
+        self.archivos['/video.mp4'] = (datos, 'video/mp4')
+        segmento = os.urandom(tamaño_segmento)
+
+        # HLS: one media playlist with `segmentos` MPEG-TS segments
+        lineas = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:4", "#EXT-X-MEDIA-SEQUENCE:0"]
+        for i in range(segmentos):
+            lineas += ["#EXTINF:4.0,", f"seg{i}.ts"]
+            self.archivos[f'/hls/seg{i}.ts'] = (segmento, 'video/mp2t')
+        lineas.append("#EXT-X-ENDLIST")
+        self.archivos['/hls/video.m3u8'] = ("\n".join(lineas).encode(), 'application/vnd.apple.mpegurl')
+
+        # DASH: a single muxed representation split into `segmentos` segments
+        urls = "".join(f'<SegmentURL media="seg{i}.m4s"/>' for i in range(segmentos))
+        for i in range(segmentos):
+            self.archivos[f'/dash/seg{i}.m4s'] = (segmento, 'video/iso.segment')
+        self.archivos['/dash/init.mp4'] = (os.urandom(1024), 'video/mp4')
+        self.archivos['/dash/video.mpd'] = (f"""<?xml version="1.0" encoding="UTF-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" minBufferTime="PT2S"
+     mediaPresentationDuration="PT{segmentos * 4}S" profiles="urn:mpeg:dash:profile:isoff-main:2011">
+  <Period>
+    <AdaptationSet mimeType="video/mp4" codecs="avc1.4d401f,mp4a.40.2">
+      <Representation id="muxed" bandwidth="2000000" width="1280" height="720">
+        <SegmentList timescale="1" duration="4">
+          <Initialization sourceURL="init.mp4"/>{urls}
+        </SegmentList>
+      </Representation>
+    </AdaptationSet>
+  </Period>
+</MPD>""".encode(), 'application/dash+xml')
+
+        archivos = self.archivos
+
+        class Manejador(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_HEAD(self):
+                self.responder(cuerpo=False)
+
+            def do_GET(self):
+                self.responder(cuerpo=True)
+
+            def responder(self, cuerpo: bool):
+                entrada = archivos.get(self.path.split("?")[0])
+                if entrada is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                datos, tipo = entrada
+                inicio, fin = 0, len(datos) - 1
+                rango = re.match(r"bytes=(\d*)-(\d*)", self.headers.get("Range", ""))
+                if rango and (rango.group(1) or rango.group(2)):
+                    if rango.group(1):
+                        inicio = int(rango.group(1))
+                        fin = min(int(rango.group(2)), fin) if rango.group(2) else fin
+                    else:
+                        inicio = max(len(datos) - int(rango.group(2)), 0)
+                    if inicio >= len(datos):
+                        # Resuming a .part that is already complete
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{len(datos)}")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {inicio}-{fin}/{len(datos)}")
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Type", tipo)
+                self.send_header("Content-Length", str(fin - inicio + 1))
+                self.send_header("Accept-Ranges", "bytes")
+                self.end_headers()
+                if cuerpo:
+                    try:
+                        self.wfile.write(memoryview(datos)[inicio:fin + 1])
+                    except (BrokenPipeError, ConnectionResetError):
+                        # yt-dlp's generic extractor only sniffs the first bytes
+                        self.close_connection = True
+
+        self.servidor = ThreadingHTTPServer(("127.0.0.1", 0), Manejador)
+        self.servidor.daemon_threads = True
+        self.base = f"http://127.0.0.1:{self.servidor.server_address[1]}"
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+
+    def url(self, ruta: str, n: int = 0) -> str:
+        # The query string keeps the metadata cache from serving repeated jobs
+        return f"{self.base}{ruta}?n={n}"
+
+    def cerrar(self):
+        self.servidor.shutdown()
+
+class MotorBenchmark(MotorDescargas):
+    def opciones_yt_dlp(self, ruta_salida: Path) -> dict:
+        opciones = super().opciones_yt_dlp(ruta_salida)
+        # The synthetic media is random bytes; ffmpeg fixups would reject it
+        opciones['fixup'] = 'never'
+        return opciones
+
+def medir_descargas(servidor: ServidorMedios, carpeta: Path, ruta: str, trabajos: int, trabajadores: int) -> dict:
+    terminados = {}
+    # Fresh data folder per scenario: the tuning state (ajuste_descargas.json)
+    # would otherwise carry over and make results depend on run order
+    escenario = carpeta / f"descargas-{len(list(carpeta.iterdir()))}"
+    motor = MotorBenchmark(
+        escenario / "videos",
+        carpeta_datos=escenario,
+        trabajadores=trabajadores,
+        on_cambio=lambda t: t.estado in (ESTADO_COMPLETADO, ESTADO_FALLIDO) and terminados.setdefault(t.id, time.perf_counter()),
+        diario=False,
+        biblioteca=False,
+        miniaturas=False
+    )
+    motor.cola.max_reintentos = 0
+    try:
+        inicio = time.perf_counter()
+        lote = [motor.agregar(servidor.url(ruta, i), f"trabajo{i}") for i in range(trabajos)]
+        motor.cola.esperar()
+        total = time.perf_counter() - inicio
+    finally:
+        # Workers, session pool and folder watcher; the stats stay readable
+        motor.cerrar()
+    completados = [t for t in lote if t.estado == ESTADO_COMPLETADO]
+    bytes_totales = sum(os.path.getsize(a) for t in completados for a in t.archivos if os.path.exists(a))
+    duraciones = [terminados[t.id] - inicio for t in completados]
+    return {
+        'trabajos': trabajos,
+        'trabajadores': trabajadores,
+        'completados': len(completados),
+        'errores': [str(t.error) for t in lote if t.estado == ESTADO_FALLIDO][:3],
+        'segundos': round(total, 4),
+        'bytes': bytes_totales,
+        'mib_por_segundo': round(bytes_totales / MIB / total, 2) if total else None,
+        'primer_trabajo_segundos': round(min(duraciones), 4) if duraciones else None,
+        'ajuste': motor.ajuste.parametros(),
+        'sesiones': {'creadas': motor.sesiones.creadas, 'reutilizadas': motor.sesiones.reutilizadas},
+    }
+
+def medir_progreso(llamadas: int = 200_000) -> dict:
+    # Cost of one yt-dlp progress hook through MotorDescargas.progreso_descarga
+    # into the coalescing aggregator the UI uses
+    renderizadas = []
+    agregador = AgregadorProgreso(renderizadas.append, lambda: None, hz=10)
+    motor = MotorDescargas.__new__(MotorDescargas)
+    motor.on_cambio = lambda t: agregador.marcar(t.id, t)
+    motor.ancho = LimitadorAncho()  # No limit, as by default
+    trabajos = [TrabajoDescarga(f"http://x/{i}", f"t{i}") for i in range(4)]
+    hook = {
+        'status': 'downloading', '_percent_str': ' 42.0%', '_speed_str': '5.00MiB/s', '_eta_str': '00:10',
+        'speed': 5 * MIB, 'eta': 10, 'downloaded_bytes': 1 << 24, 'total_bytes': 1 << 25,
+    }
+    inicio = time.perf_counter()
+    for i in range(llamadas):
+        motor.progreso_descarga(hook, trabajos[i & 3])
+    total = time.perf_counter() - inicio
+    time.sleep(0.3)
+    return {
+        'llamadas': llamadas,
+        'microsegundos_por_llamada': round(total / llamadas * 1e6, 3),
+        'renderizadas': len(renderizadas),
+        'agrupadas': agregador.agrupadas,
+    }
+
+def crear_biblioteca(carpeta: Path, archivos: int):
+    carpeta.mkdir(parents=True)
+    palabras = ["canción", "tutorial", "python", "concierto", "noticias", "fútbol", "receta", "viaje"]
+    for i in range(archivos):
+        nombre = f"{palabras[i % 8]} {palabras[(i // 8) % 8]} {i}.mp4"
+        (carpeta / nombre).write_bytes(b"")
+
+def cronometrar(funcion, repeticiones: int = 5) -> dict:
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return {'mediana_ms': round(statistics.median(tiempos) * 1000, 3), 'max_ms': round(max(tiempos) * 1000, 3)}
+
+class PaginaSinVentana:
+    # Headless stand-in for ft.Page with just what VideoDownloader touches
+    class Almacen(dict):
+        def set(self, clave, valor):
+            self[clave] = valor
+
+    def __init__(self):
+        self.client_storage = self.Almacen()
+        self.navigation_bar = None
+        self.theme_mode = None
+        self.updates = 0
+
+    def update(self, *controles):
+        self.updates += 1
+
+    def add(self, *controles):
+        pass
+
+    def run_thread(self, funcion, *args):
+        funcion(*args)
+
+    def run_task(self, corrutina, *args):
+        # No event loop: the coroutine runs right away on the calling thread
+        futuro = Future()
+        futuro.set_result(asyncio.run(corrutina(*args)))
+        return futuro
+
+def medir_biblioteca(carpeta: Path, archivos: int) -> dict:
+    videos = carpeta / f"biblioteca-{archivos}"
+    inicio = time.perf_counter()
+    crear_biblioteca(videos, archivos)
+    resultado = {'archivos': archivos, 'crear_segundos': round(time.perf_counter() - inicio, 3)}
+
+    # listar_videos: reconcile the index with the folder, then serve a sorted page
+    indice = IndiceBiblioteca(carpeta / f"indice-{archivos}.db", videos)
+    resultado['reconciliar_inicial'] = cronometrar(lambda: indice.reconciliar(forzar=True), 1)
+    resultado['reconciliar_sin_cambios'] = cronometrar(lambda: indice.reconciliar())
+    resultado['reconciliar_forzado'] = cronometrar(lambda: indice.reconciliar(forzar=True), 3)
+    resultado['listar_videos_pagina'] = cronometrar(lambda: indice.consultar("", 100, 0))
+
+    # filtrar_videos: in-memory search index
+    busqueda = IndiceBusqueda()
+    resultado['indice_busqueda_carga'] = cronometrar(lambda: busqueda.cargar(indice.todos), 1)
+    for consulta in ["cancion", "futbol viaje", "12", "zzz"]:
+        resultado[f'filtrar_videos[{consulta}]'] = cronometrar(lambda: busqueda.buscar(consulta))
+
+    # actualizar_lista_videos: first render and an unchanged (diffed) refresh
+    try:
+        import main
+    except ImportError as ex:
+        resultado['actualizar_lista_videos'] = f"omitido: {ex}"
+        return resultado
+    downloader = main.VideoDownloader(PaginaSinVentana(), carpeta_descargas=videos, carpeta_datos=carpeta)
+    try:
+        downloader.miniaturas = None
+        downloader.videos_filtrados = indice.consultar("", main.TAMAÑO_PAGINA, 0)
+        resultado['actualizar_lista_videos_inicial'] = cronometrar(
+            lambda: (downloader.cards_videos.clear(), downloader.actualizar_lista_videos()))
+        resultado['actualizar_lista_videos_sin_cambios'] = cronometrar(downloader.actualizar_lista_videos)
+    finally:
+        downloader.cerrar()
+    return resultado
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks sin red del motor de descargas y la biblioteca")
+    parser.add_argument("-o", "--salida", help="Archivo JSON de resultados (por defecto, stdout)")
+    parser.add_argument("--bibliotecas", default="1000,10000,100000",
+                        help="Tamaños de biblioteca sintética, separados por comas")
+    parser.add_argument("--trabajos", type=int, default=8, help="Trabajos en el benchmark multi-descarga")
+    parser.add_argument("--trabajadores", type=int, default=4, help="Trabajadores en el benchmark multi-descarga")
+    parser.add_argument("--sin-descargas", action="store_true", help="Omitir los benchmarks de descarga")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format='[%(levelname)s] %(message)s', stream=sys.stderr)
+
+    resultados = {
+        'entorno': {
+            'instante': time.time(),
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+    }
+    with tempfile.TemporaryDirectory(prefix="bench-ydexplorer-") as temporal:
+        carpeta = Path(temporal)
+        if not args.sin_descargas:
+            resultados['entorno']['yt_dlp'] = cargar_yt_dlp().version.__version__
+            servidor = ServidorMedios()
+            try:
+                resultados['descargas'] = {
+                    'progresivo_1': medir_descargas(servidor, carpeta, '/video.mp4', 1, 1),
+                    'progresivo_multi': medir_descargas(servidor, carpeta, '/video.mp4', args.trabajos, args.trabajadores),
+                    'hls_1': medir_descargas(servidor, carpeta, '/hls/video.m3u8', 1, 1),
+                    'hls_multi': medir_descargas(servidor, carpeta, '/hls/video.m3u8', args.trabajos, args.trabajadores),
+                    'dash_1': medir_descargas(servidor, carpeta, '/dash/video.mpd', 1, 1),
+                }
+            finally:
+                servidor.cerrar()
+        resultados['progreso'] = medir_progreso()
+        resultados['biblioteca'] = {
+            str(n): medir_biblioteca(carpeta, int(n)) for n in args.bibliotecas.split(",") if n.strip()
+        }
+
+    texto = json.dumps(resultados, indent=2, ensure_ascii=False)
+    if args.salida:
+        Path(args.salida).write_text(texto + "\n", encoding="utf-8")
+    else:
+        print(texto)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
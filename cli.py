@@ -0,0 +1,168 @@
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+from pathlib import Path
+from motor import (
+    MotorDescargas, AgregadorProgreso, TrabajoDescarga, obtener_carpeta_descargas,
+    ESTADO_COMPLETADO, ESTADO_FALLIDO, ESTADO_CANCELADO, ESTADOS_TERMINADOS, TRABAJADORES_POR_DEFECTO, CODECS_VIDEO, CONTENEDORES, PRIORIDADES,
+)
+
+TIEMPO_CIERRE = 5  # Seconds to wait for running downloads to stop on Ctrl+C
+
+# Headless batch downloader. Reads one URL per line (optionally followed by a
+# tab and a file name) from a file or stdin and runs them through the same
+# engine as the desktop app, printing JSON lines for each progress update and
+# result. It never imports flet.
+
+class SalidaJSON:
+    def __init__(self, flujo=sys.stdout):
+        self.flujo = flujo
+        self._lock = threading.Lock()
+
+    def emitir(self, evento: str, **datos):
+        linea = json.dumps({'evento': evento, 'instante': round(time.time(), 3), **datos}, ensure_ascii=False)
+        with self._lock:
+            self.flujo.write(linea + "\n")
+
+    def vaciar(self):
+        with self._lock:
+            self.flujo.flush()
+
+def leer_entradas(flujo):
+    # "URL" or "URL<TAB>name"; blank lines and # comments are skipped
+    for linea in flujo:
+        linea = linea.strip()
+        if not linea or linea.startswith("#"):
+            continue
+        url, _, nombre = linea.partition("\t")
+        yield url.strip(), nombre.strip() or None
+
+def leer_franja(texto: str):
+    # "22-6" (no limit from 22:00 to 06:00) or "9-18:1.5" (1.5 MB/s from 09:00 to 18:00)
+    horas, _, limite = texto.partition(":")
+    desde, _, hasta = horas.partition("-")
+    try:
+        desde, hasta = int(desde), int(hasta)
+        limite = int(float(limite) * (1 << 20)) if limite else None
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Franja no válida: {texto}")
+    if not (0 <= desde < 24 and 0 <= hasta <= 24) or desde == hasta:
+        raise argparse.ArgumentTypeError(f"Franja no válida: {texto}")
+    return desde, hasta, limite
+
+def describir(trabajo: TrabajoDescarga) -> dict:
+    return {
+        'id': trabajo.id,
+        'url': trabajo.url,
+        'estado': trabajo.estado,
+        'progreso': round(trabajo.progreso, 4),
+        'velocidad': trabajo.velocidad,
+        'eta': trabajo.eta,
+        'reintentos': trabajo.reintentos,
+    }
+
+def ejecutar(args) -> int:
+    salida = SalidaJSON()
+    agregador = AgregadorProgreso(
+        lambda trabajo: salida.emitir('progreso', **describir(trabajo)),
+        salida.vaciar,
+        hz=args.hz
+    )
+
+    def on_cambio(trabajo: TrabajoDescarga):
+        if trabajo.estado in ESTADOS_TERMINADOS:
+            # Results are never coalesced
+            agregador.descartar([trabajo.id])
+            datos = describir(trabajo)
+            if trabajo.estado == ESTADO_COMPLETADO:
+                datos['archivos'] = trabajo.archivos
+                if trabajo.duplicado:
+                    # Not downloaded: the video, or another one with its name, was already there
+                    datos['omitido'] = 'nombre_en_uso' if trabajo.conflicto_nombre else 'ya_descargado'
+            elif trabajo.estado == ESTADO_FALLIDO:
+                datos['error'] = str(trabajo.error)
+            if trabajo.metricas:
+                datos['metricas'] = trabajo.metricas
+            salida.emitir('resultado', **datos)
+            salida.vaciar()
+        else:
+            agregador.marcar(trabajo.id, trabajo)
+
+    motor = MotorDescargas(
+        Path(args.salida) if args.salida else obtener_carpeta_descargas(),
+        trabajadores=args.trabajadores,
+        on_cambio=on_cambio,
+        diario=False,
+        biblioteca=False,
+        miniaturas=False
+    )
+    motor.cola.max_reintentos = args.reintentos
+    if args.metricas:
+        motor.telemetria.ruta_prometheus = Path(args.metricas)
+    motor.selector.configurar({
+        'altura_maxima': args.altura_maxima,
+        'codec': args.codec,
+        'contenedor': args.contenedor,
+        'tiempo_maximo': args.tiempo_maximo and args.tiempo_maximo * 60,
+        'tamaño_maximo': args.tamano_maximo and args.tamano_maximo << 20,
+    })
+    motor.ancho.configurar({
+        'limite': args.limite and int(args.limite * (1 << 20)),
+        'franjas': args.franja or [],
+    })
+
+    entrada = open(args.archivo, encoding="utf-8") if args.archivo not in (None, "-") else sys.stdin
+    trabajos = {}  # id -> job; a URL repeated in the list shares the first job
+    try:
+        with entrada:
+            # Jobs start while the list is still being read
+            for url, nombre in leer_entradas(entrada):
+                trabajo = motor.agregar(url, nombre, prioridad=args.prioridad)
+                trabajos.setdefault(trabajo.id, trabajo)
+        motor.cola.esperar()
+    except KeyboardInterrupt:
+        # Running downloads keep their .part files for a later run
+        motor.cerrar(TIEMPO_CIERRE)
+        pendientes = sum(1 for t in trabajos.values() if t.estado not in ESTADOS_TERMINADOS)
+        salida.emitir('interrumpido', total=len(trabajos), pendientes=pendientes)
+        salida.vaciar()
+        return 130
+
+    conteo = {estado: sum(1 for t in trabajos.values() if t.estado == estado) for estado in ESTADOS_TERMINADOS}
+    salida.emitir('resumen', total=len(trabajos), completados=conteo[ESTADO_COMPLETADO],
+                  fallidos=conteo[ESTADO_FALLIDO], cancelados=conteo[ESTADO_CANCELADO])
+    salida.vaciar()
+    return 1 if conteo[ESTADO_FALLIDO] or conteo[ESTADO_CANCELADO] else 0
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Descarga por lotes sin interfaz gráfica (salida JSON lines)")
+    parser.add_argument("archivo", nargs="?", help="Archivo con una URL por línea (por defecto, stdin)")
+    parser.add_argument("-o", "--salida", help="Carpeta de descargas")
+    parser.add_argument("-j", "--trabajadores", type=int, default=TRABAJADORES_POR_DEFECTO,
+                        help="Descargas simultáneas")
+    parser.add_argument("--reintentos", type=int, default=2, help="Reintentos por descarga")
+    parser.add_argument("--metricas", help="Archivo de métricas Prometheus (textfile collector)")
+    parser.add_argument("--altura-maxima", type=int, help="Resolución vertical máxima (p. ej. 1080)")
+    parser.add_argument("--codec", choices=list(CODECS_VIDEO), help="Códec de video")
+    parser.add_argument("--contenedor", choices=list(CONTENEDORES), help="Contenedor de salida")
+    parser.add_argument("--tiempo-maximo", type=int, help="Minutos que puede tardar cada descarga")
+    parser.add_argument("--tamano-maximo", type=int, help="MB que puede ocupar cada descarga")
+    parser.add_argument("--limite", type=float, help="Ancho de banda total en MB/s, repartido entre las descargas")
+    parser.add_argument("--franja", type=leer_franja, action="append",
+                        help="Límite por horario, p. ej. 9-18:1.5 (MB/s) o 22-6 (sin límite); se puede repetir")
+    parser.add_argument("--prioridad", choices=list(PRIORIDADES), default="normal",
+                        help="Prioridad de las descargas del lote")
+    parser.add_argument("--hz", type=int, default=2, help="Eventos de progreso por segundo")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Mostrar el registro en stderr")
+    args = parser.parse_args(argv)
+
+    # stdout is reserved for JSON lines
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='[%(levelname)s] %(message)s', stream=sys.stderr)
+    return ejecutar(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
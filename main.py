@@ -1,28 +1,159 @@
+import time
+INICIO_PROCESO = time.perf_counter()
 import flet as ft
 import logging
 from pathlib import Path
-from yt_dlp import YoutubeDL
-from yt_dlp.utils import DownloadError
 import os
-import asyncio
-import time
 import subprocess
 import platform # Import platform to detect OS
+import re
+import threading
+from motor import (
+    MotorDescargas, TrabajoDescarga, ListaDescarga, AgregadorProgreso, IndiceBusqueda, VideoIndexado, PerfilArranque,
+    Planificador, obtener_carpeta_datos, obtener_carpeta_descargas, cargar_yt_dlp, precargar_yt_dlp, es_error_descarga,
+    ESTADO_EN_COLA, ESTADO_DESCARGANDO, ESTADO_PROCESANDO, ESTADO_PAUSADO, ESTADO_COMPLETADO, ESTADO_FALLIDO,
+    ESTADO_CANCELADO, ESTADOS, ESTADOS_TERMINADOS,
+    TRABAJADORES_POR_DEFECTO, MAX_TRABAJADORES, FRECUENCIA_POR_DEFECTO, FRECUENCIAS_DISPONIBLES,
+    TAMAÑO_PAGINA, ALTURAS_MAXIMAS, CODECS_VIDEO, CONTENEDORES, TIEMPOS_MAXIMOS, TAMAÑOS_MAXIMOS, resumir_eleccion,
+    PRIORIDAD_ALTA, PRIORIDAD_NORMAL, PRIORIDAD_BAJA, LIMITES_ANCHO,
+)
 
 logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
 
+ALTURA_CARD = 120  # Fixed row height lets the ListView virtualize the library
+RETARDO_BUSQUEDA = 0.25  # Seconds of typing pause before a search runs
+RETARDO_PREFETCH = 0.4
+TIEMPO_CIERRE = 5  # Seconds the window waits for downloads to stop on close
+
+NOMBRES_PRIORIDAD = {PRIORIDAD_ALTA: "Alta", PRIORIDAD_NORMAL: "Normal", PRIORIDAD_BAJA: "Baja"}
+ICONOS_PRIORIDAD = {PRIORIDAD_ALTA: ft.Icons.KEYBOARD_DOUBLE_ARROW_UP, PRIORIDAD_NORMAL: ft.Icons.REMOVE,
+                    PRIORIDAD_BAJA: ft.Icons.KEYBOARD_DOUBLE_ARROW_DOWN}
+
+# Startup timing report; the first view is built before yt-dlp is loaded
+perfil_arranque = PerfilArranque(
+    ["importaciones", "inicio_flet", "vista_inicial", "carga_biblioteca", "yt_dlp"],
+    inicio=INICIO_PROCESO
+)
+perfil_arranque.ruta = obtener_carpeta_datos() / "arranque.jsonl"
+
+# Engines shared by every session of the process, by download and data folder.
+# Served as a web app, Flet gives each browser tab its own page.
+_motores = {}
+_lock_motores = threading.Lock()
+
+class MotorCompartido:
+    # One engine (library index, download queue, caches) and one in-memory
+    # search index for all the sessions using the same folders; sessions only
+    # keep their own controls and subscribe to the engine's changes
+    def __init__(self, motor: MotorDescargas):
+        self.motor = motor
+        self.indice_busqueda = IndiceBusqueda()
+        motor.indice.suscribir(self.indice_busqueda.actualizar)
+        self.sesiones = 0
+
+    @staticmethod
+    def obtener(carpeta_descargas: Path, carpeta_datos: Path, crear):
+        # `crear()` builds the engine when this is the first session
+        clave = (carpeta_descargas, carpeta_datos)
+        with _lock_motores:
+            compartido = _motores.get(clave)
+            if compartido is None:
+                compartido = _motores[clave] = MotorCompartido(crear())
+            compartido.sesiones += 1
+        return compartido
+
+    def soltar(self, detener: bool, timeout: float = None) -> bool:
+        # With `detener` the engine is closed and dropped; otherwise its
+        # downloads keep running for the other sessions and the next one
+        with _lock_motores:
+            self.sesiones -= 1
+            if not detener:
+                return True
+            for clave in [clave for clave, compartido in _motores.items() if compartido is self]:
+                del _motores[clave]
+        return self.motor.cerrar(timeout)
+
 class VideoDownloader:
-    def __init__(self, page: ft.Page):
+    def __init__(self, page: ft.Page, carpeta_descargas: Path = None, carpeta_datos: Path = None):
         self.page = page
-        self.carpeta_descargas = self.obtener_carpeta_descargas()
-        self.videos_cache = None
-        self.archivos_cache = []
+        self.carpeta_descargas = carpeta_descargas or obtener_carpeta_descargas()
+        self.carpeta_datos = carpeta_datos
         self.videos_filtrados = []
         self.search_query = ""
+        self.total_videos = 0
+        self.cards_videos = {}  # ruta -> (VideoIndexado, ft.Card) currently in the list
+        self.cargando_videos = False
+        self.filas_trabajos = {}
+        self.filas_listas = {}
+        # Finished jobs this session removed from its view; they stay in the
+        # shared queue for the other sessions
+        self.ocultos = set()
+        
+        # Library refreshes, searches and metadata lookups; see Planificador
+        self.planificador = Planificador()
+        
+        # Download engine (queue, journal, caches, library index), shared with
+        # the other sessions of this process; see motor.py and MotorCompartido
+        self.compartido = MotorCompartido.obtener(self.carpeta_descargas, carpeta_datos, self.crear_motor)
+        self.motor = self.compartido.motor
+        self.cola = self.motor.cola
+        self.indice = self.motor.indice
+        self.cache_metadatos = self.motor.cache_metadatos
+        self.miniaturas = self.motor.miniaturas
+        self.ajuste = self.motor.ajuste
+        self.selector = self.motor.selector
+        self.ancho = self.motor.ancho
+        # The view edits a single time-of-day window: [from hour, to hour, limit]
+        self.franja = list(self.ancho.franjas[0]) if self.ancho.franjas else [None, None, None]
+        self.telemetria = self.motor.telemetria
+        self.version_telemetria = -1
+        
+        # In-memory search index, loaded once and kept in sync with the library index
+        self.indice_busqueda = self.compartido.indice_busqueda
+        # The loaded library rows, for changes seen by the folder watcher or made by downloads
+        self.indice.suscribir(self.al_cambiar_biblioteca)
+        self.resultados_busqueda = None
+        self.generacion_busqueda = 0
         
         # Main components
         self.setup_components()
         
+        # Progress is rendered at a fixed frame rate instead of once per yt-dlp
+        # hook; each frame runs on the UI event loop
+        self.agregador = AgregadorProgreso(
+            self.renderizar_fila,
+            self.publicar_progreso,
+            hz=self.leer_frecuencia(),
+            ejecutar=self.ejecutar_frame
+        )
+        
+        # Thumbnails are applied to the cards in batched frames
+        self.agregador_miniaturas = AgregadorProgreso(self.renderizar_miniatura, self.page.update,
+                                                      ejecutar=self.ejecutar_frame)
+        
+        # Every job and listing of the shared queue gets a row: those already
+        # there (including jobs resumed from the journal), then later changes
+        self.suscripcion = self.motor.suscribir(self.actualizar_fila_trabajo, self.actualizar_fila_lista)
+        for trabajo in list(self.cola.trabajos):
+            self.actualizar_fila_trabajo(trabajo)
+        for lista in list(self.motor.listas):
+            self.actualizar_fila_lista(lista)
+
+    def crear_motor(self) -> MotorDescargas:
+        # First session only: its saved settings configure the shared engine
+        motor = MotorDescargas(
+            self.carpeta_descargas,
+            carpeta_datos=self.carpeta_datos,
+            trabajadores=self.leer_trabajadores()
+        )
+        self.leer_formato_automatico(motor.selector)
+        self.leer_limite_ancho(motor.ancho)
+        # extract_info results are prefetched as soon as a URL is pasted
+        if self.leer_cache_disco():
+            motor.cache_metadatos.activar_disco(motor.carpeta_datos / "metadatos.db")
+        motor.reanudar_trabajos()
+        return motor
+
     def setup_components(self):
         # Top bar with logo and theme button
         self.theme_button = ft.IconButton(
@@ -40,6 +171,7 @@ class VideoDownloader:
             label="URL del video",
             hint_text="Pega aquí el enlace del video...",
             prefix_icon=ft.Icons.LINK,
+            on_change=self.prefetch_metadatos,
             expand=True,
             filled=True,
             border_radius=12,
@@ -56,10 +188,49 @@ class VideoDownloader:
             content_padding=ft.Padding(15, 15, 15, 15)
         )
         
+        # Playlist/channel mode: entries are queued while the listing is read
+        self.modo_lista = ft.Switch(
+            label="Lista o canal completo",
+            value=False,
+            on_change=self.cambiar_modo_lista
+        )
+        
+        self.rango_field = ft.TextField(
+            label="Elementos",
+            hint_text="Ej: 1-50,60 (vacío = todos)",
+            prefix_icon=ft.Icons.FORMAT_LIST_NUMBERED,
+            visible=False,
+            expand=True,
+            filled=True,
+            border_radius=12,
+            content_padding=ft.Padding(15, 15, 15, 15)
+        )
+        
+        self.filtro_field = ft.TextField(
+            label="Filtro",
+            hint_text="Ej: duration > 60 & title ~= (?i)tutorial",
+            prefix_icon=ft.Icons.FILTER_LIST,
+            visible=False,
+            expand=True,
+            filled=True,
+            border_radius=12,
+            content_padding=ft.Padding(15, 15, 15, 15)
+        )
+        
+        # Queued in priority order; also weights the job's share of the bandwidth limit
+        self.prioridad_field = ft.Dropdown(
+            label="Prioridad",
+            value=PRIORIDAD_NORMAL,
+            options=[ft.dropdown.Option(p, nombre) for p, nombre in NOMBRES_PRIORIDAD.items()],
+            width=150,
+            filled=True,
+            border_radius=12
+        )
+        
         # Modern action buttons
         self.download_button = ft.ElevatedButton(
-            "Descargar Video",
-            icon=ft.Icons.DOWNLOAD,
+            "Agregar a la cola",
+            icon=ft.Icons.PLAYLIST_ADD,
             on_click=self.iniciar_descarga,
             style=ft.ButtonStyle(
                 bgcolor=ft.Colors.RED_600,
@@ -80,15 +251,32 @@ class VideoDownloader:
             )
         )
         
-        # Modern progress bar
-        self.progress_bar = ft.ProgressBar(
-            width=None,
-            height=6,
-            visible=False,
-            color=ft.Colors.RED_500,
-            bgcolor=ft.Colors.RED_100,
-            border_radius=3
-        )
+        # One row per queued download
+        self.lista_trabajos = ft.Column(spacing=10)
+        
+        self.resumen_cola_text = ft.Text(size=14, color=ft.Colors.GREY_600)
+        
+        self.ancho_cola_text = ft.Text(size=14, color=ft.Colors.GREY_600)
+        
+        self.estadisticas_ui_text = ft.Text(size=14)
+        
+        self.estadisticas_cache_text = ft.Text(size=14)
+        
+        self.ajuste_text = ft.Text(size=14)
+        
+        self.formato_automatico_text = ft.Text(size=14)
+        
+        self.limite_ancho_text = ft.Text(size=14)
+        
+        self.arranque_text = ft.Text(size=14)
+        
+        # Per-site averages and the latest attempts from the download telemetry
+        self.telemetria_text = ft.Text(size=14)
+        self.historial_telemetria = ft.Column(spacing=4)
+        
+        # Groups of identical files in the download folder
+        self.duplicados_text = ft.Text("Archivos con el mismo contenido en la carpeta de descargas", size=14)
+        self.lista_duplicados = ft.Column(spacing=4)
         
         self.status_text = ft.Text(
             size=14,
@@ -107,10 +295,11 @@ class VideoDownloader:
         )
         
         # Scrollable video list
-        self.lista_videos = ft.Column(
-            spacing=8,
-            scroll=ft.ScrollMode.AUTO,
-            expand=True
+        self.lista_videos = ft.ListView(
+            item_extent=ALTURA_CARD,
+            expand=True,
+            on_scroll=self.scroll_lista_videos,
+            on_scroll_interval=100
         )
         
         # Bottom navigation
@@ -139,30 +328,46 @@ class VideoDownloader:
             animation_duration=300
         )
 
-    def obtener_carpeta_descargas(self) -> Path:
-        carpeta = Path.home() / "Videos"
-        if not carpeta.exists():
-            carpeta = Path.home() / "Downloads"
-        carpeta.mkdir(parents=True, exist_ok=True)
-        return carpeta
-
-    def listar_videos(self):
-        return sorted([f for f in self.carpeta_descargas.glob("*.*") 
-                      if f.suffix.lower() in ['.mp4', '.mkv', '.webm', '.mov', '.avi', '.flv']], 
-                     key=lambda x: x.stat().st_mtime, reverse=True)
+    def listar_videos(self, desplazamiento: int = 0, limite: int = TAMAÑO_PAGINA):
+        # Page of ranked search results, or of the whole library sorted newest first
+        if self.resultados_busqueda is not None:
+            return self.resultados_busqueda[desplazamiento:desplazamiento + limite]
+        return self.indice.consultar("", limite, desplazamiento)
 
     def buscar_videos(self, e):
-        # If the search field is empty, show all videos
-        if not e.control.value.strip():
-            self.search_query = ""
+        # Debounced: only the last query typed within RETARDO_BUSQUEDA runs
+        self.search_query = e.control.value.strip()
+        self.generacion_busqueda += 1
+        generacion = self.generacion_busqueda
+        self.planificador.cancelar("pagina")
+        self.planificador.programar(lambda tarea: self.cargar_resultados(generacion),
+                                    carril="biblioteca", clave="busqueda", retardo=RETARDO_BUSQUEDA)
+
+    def cargar_resultados(self, generacion: int, cargados: int = TAMAÑO_PAGINA):
+        # Runs on the library lane; the controls are only touched on the UI loop
+        if not self.indice_busqueda.cargado:
+            self.indice_busqueda.cargar(self.indice.todos)
+        consulta = self.search_query
+        if consulta:
+            resultados = self.indice_busqueda.buscar(consulta)
+            total = len(resultados)
+            videos = resultados[:cargados]
         else:
-            self.search_query = e.control.value.lower()
-        self.actualizar_videos_async()
+            resultados = None
+            total = self.indice.contar()
+            videos = self.indice.consultar("", cargados, 0)
+        self.en_ui(self.mostrar_resultados, generacion, resultados, total, videos)
 
-    def filtrar_videos(self, videos):
-        if not self.search_query:
-            return videos
-        return [v for v in videos if self.search_query in v.name.lower()]
+    def mostrar_resultados(self, generacion: int, resultados, total: int, videos):
+        # A newer query was typed meanwhile; drop these results
+        if generacion != self.generacion_busqueda:
+            return
+        self.resultados_busqueda = resultados
+        self.total_videos = total
+        self.videos_filtrados = videos
+        # A page load superseded by this one never reports back
+        self.cargando_videos = False
+        self.actualizar_lista_videos()
 
     def toggle_theme(self, e):
         if self.page.theme_mode == ft.ThemeMode.DARK:
@@ -194,34 +399,51 @@ class VideoDownloader:
             border_radius=ft.BorderRadius(0, 0, 12, 12)
         )
 
-    def crear_card_video(self, archivo: Path):
-        # Get file information
-        stats = archivo.stat()
-        tamaño = self.formatear_tamaño(stats.st_size)
-        fecha = time.strftime('%d/%m/%Y', time.localtime(stats.st_mtime))
+    def crear_card_video(self, video: VideoIndexado):
+        # File information comes from the library index, no stat() needed
+        archivo = Path(video.ruta)
+        tamaño = self.formatear_tamaño(video.tamaño)
+        fecha = time.strftime('%d/%m/%Y', time.localtime(video.mtime))
+        detalles = [
+            ft.Text(f"Tamaño: {tamaño}", size=12, color=ft.Colors.GREY_600),
+            ft.Text(f"Fecha: {fecha}", size=12, color=ft.Colors.GREY_600)
+        ]
+        if video.duracion or video.resolucion:
+            partes = []
+            if video.duracion:
+                partes.append(f"Duración: {self.formatear_duracion(video.duracion)}")
+            if video.resolucion:
+                partes.append(f"Resolución: {video.resolucion}")
+            detalles.append(ft.Text(" • ".join(partes), size=12, color=ft.Colors.GREY_600))
+        
+        # Generic icon until the thumbnail is ready
+        miniatura = ft.Container(
+            content=ft.Icon(ft.Icons.PLAY_CIRCLE_FILL, size=40, color=ft.Colors.RED_500), # Icon for playing video
+            width=60,
+            height=60,
+            border_radius=8,
+            bgcolor=ft.Colors.RED_50,
+            alignment=ft.alignment.center,
+            clip_behavior=ft.ClipBehavior.ANTI_ALIAS
+        )
+        if self.miniaturas:
+            self.miniaturas.solicitar(
+                video.ruta, video.mtime,
+                lambda datos: datos and self.agregador_miniaturas.marcar(id(miniatura), (miniatura, datos))
+            )
         
         return ft.Card(
             content=ft.Container(
                 content=ft.ListTile(
-                    leading=ft.Container(
-                        content=ft.Icon(ft.Icons.PLAY_CIRCLE_FILL, size=40, color=ft.Colors.RED_500), # Icon for playing video
-                        width=60,
-                        height=60,
-                        border_radius=8,
-                        bgcolor=ft.Colors.RED_50,
-                        alignment=ft.alignment.center
-                    ),
+                    leading=miniatura,
                     title=ft.Text(
-                        archivo.stem,
+                        video.titulo or video.nombre,
                         size=16,
                         weight=ft.FontWeight.W_500,
                         max_lines=2,
                         overflow=ft.TextOverflow.ELLIPSIS
                     ),
-                    subtitle=ft.Column([
-                        ft.Text(f"Tamaño: {tamaño}", size=12, color=ft.Colors.GREY_600),
-                        ft.Text(f"Fecha: {fecha}", size=12, color=ft.Colors.GREY_600)
-                    ], spacing=2),
+                    subtitle=ft.Column(detalles, spacing=2),
                     trailing=ft.PopupMenuButton(
                         items=[
                             ft.PopupMenuItem(
@@ -244,6 +466,10 @@ class VideoDownloader:
             margin=ft.Margin(0, 4, 0, 4)
         )
 
+    def renderizar_miniatura(self, pendiente):
+        contenedor, datos = pendiente
+        contenedor.content = ft.Image(src_base64=datos, width=60, height=60, fit=ft.ImageFit.COVER)
+
     def formatear_tamaño(self, bytes):
         for unit in ['B', 'KB', 'MB', 'GB']:
             if bytes < 1024.0:
@@ -251,6 +477,11 @@ class VideoDownloader:
             bytes /= 1024.0
         return f"{bytes:.1f} TB"
 
+    def formatear_duracion(self, segundos):
+        minutos, segundos = divmod(int(segundos), 60)
+        horas, minutos = divmod(minutos, 60)
+        return f"{horas}:{minutos:02d}:{segundos:02d}" if horas else f"{minutos}:{segundos:02d}"
+
     def abrir_carpeta(self, archivo: Path):
         # Open the folder containing the file
         if platform.system() == "Windows":
@@ -291,24 +522,41 @@ class VideoDownloader:
                     ft.Container(
                         content=ft.Column([
                             self.url_field,
+                            self.modo_lista,
                             self.name_field,
+                            ft.Row([self.rango_field, self.filtro_field], spacing=15),
                             ft.Row([
                                 self.download_button,
-                                self.clear_button
+                                self.clear_button,
+                                ft.Container(expand=True),
+                                self.prioridad_field
                             ], spacing=15),
-                            ft.Container(
-                                content=ft.Column([
-                                    self.progress_bar,
-                                    self.status_text
-                                ], spacing=10),
-                                margin=ft.Margin(0, 20, 0, 0)
-                            )
+                            self.status_text
                         ], spacing=20),
                         padding=ft.Padding(30, 30, 30, 30),
                         bgcolor=ft.Colors.SURFACE,
                         border_radius=16
+                    ),
+                    ft.Container(
+                        content=ft.Column([
+                            ft.Row([
+                                ft.Text("Cola de descargas", size=20, weight=ft.FontWeight.BOLD),
+                                ft.Container(expand=True),
+                                ft.TextButton(
+                                    "Quitar terminadas",
+                                    icon=ft.Icons.CLEAR_ALL,
+                                    on_click=self.quitar_trabajos_terminados
+                                )
+                            ]),
+                            self.resumen_cola_text,
+                            self.ancho_cola_text,
+                            self.lista_trabajos
+                        ], spacing=15),
+                        padding=ft.Padding(30, 30, 30, 30),
+                        bgcolor=ft.Colors.SURFACE,
+                        border_radius=16
                     )
-                ], spacing=20),
+                ], spacing=20, scroll=ft.ScrollMode.AUTO),
                 padding=ft.Padding(30, 20, 30, 20),
                 expand=True
             )
@@ -332,7 +580,7 @@ class VideoDownloader:
                         ft.ElevatedButton(
                             text="Actualizar Videos", # Changed button text
                             icon=ft.Icons.REFRESH, # Changed button icon
-                            on_click=lambda e: self.actualizar_videos_async(),
+                            on_click=lambda e: self.actualizar_videos_async(forzar=True),
                             style=ft.ButtonStyle(
                                 bgcolor=ft.Colors.RED_600,
                                 color=ft.Colors.WHITE,
@@ -364,6 +612,13 @@ class VideoDownloader:
         self.page.update()
 
     def mostrar_vista_configuracion(self):
+        self.arranque_text.value = perfil_arranque.resumen() or "Midiendo..."
+        self.actualizar_ajuste()
+        self.actualizar_formato_automatico()
+        self.actualizar_limite_ancho()
+        self.actualizar_estadisticas_ui()
+        self.actualizar_estadisticas_cache()
+        self.actualizar_telemetria()
         vista = ft.Column([
             self.crear_barra_superior(),
             ft.Container(
@@ -381,6 +636,117 @@ class VideoDownloader:
                                 )
                             ),
                             ft.Divider(),
+                            ft.ListTile(
+                                leading=ft.Icon(ft.Icons.DOWNLOADING, size=30),
+                                title=ft.Text("Descargas simultáneas", size=16, weight=ft.FontWeight.W_500),
+                                subtitle=ft.Text("Número de descargas que se ejecutan en paralelo", size=14),
+                                trailing=ft.Dropdown(
+                                    value=str(self.cola.trabajadores),
+                                    options=[ft.dropdown.Option(str(n)) for n in range(1, MAX_TRABAJADORES + 1)],
+                                    width=90,
+                                    on_change=self.cambiar_trabajadores
+                                )
+                            ),
+                            ft.Divider(),
+                            ft.ListTile(
+                                leading=ft.Icon(ft.Icons.SPEED, size=30),
+                                title=ft.Text("Frecuencia de refresco del progreso", size=16, weight=ft.FontWeight.W_500),
+                                subtitle=self.estadisticas_ui_text,
+                                trailing=ft.Dropdown(
+                                    value=str(self.agregador.hz),
+                                    options=[ft.dropdown.Option(str(hz), f"{hz} Hz") for hz in FRECUENCIAS_DISPONIBLES],
+                                    width=110,
+                                    on_change=self.cambiar_frecuencia
+                                )
+                            ),
+                            ft.Divider(),
+                            ft.ListTile(
+                                leading=ft.Icon(ft.Icons.TUNE, size=30),
+                                title=ft.Text("Ajuste automático de transferencia", size=16, weight=ft.FontWeight.W_500),
+                                subtitle=self.ajuste_text
+                            ),
+                            ft.Divider(),
+                            ft.ListTile(
+                                leading=ft.Icon(ft.Icons.HIGH_QUALITY, size=30),
+                                title=ft.Text("Calidad automática", size=16, weight=ft.FontWeight.W_500),
+                                subtitle=self.formato_automatico_text
+                            ),
+                            ft.Container(
+                                content=ft.Row([
+                                    self.crear_limite_formato("Resolución máxima", 'altura_maxima',
+                                                              [(h, f"{h}p") for h in ALTURAS_MAXIMAS]),
+                                    self.crear_limite_formato("Códec", 'codec', [(c, c.upper()) for c in CODECS_VIDEO]),
+                                    self.crear_limite_formato("Contenedor", 'contenedor',
+                                                              [(c, c.upper()) for c in CONTENEDORES]),
+                                    self.crear_limite_formato("Tiempo máximo", 'tiempo_maximo',
+                                                              [(t, self.formatear_duracion(t)) for t in TIEMPOS_MAXIMOS]),
+                                    self.crear_limite_formato("Tamaño máximo", 'tamaño_maximo',
+                                                              [(t, self.formatear_tamaño(t)) for t in TAMAÑOS_MAXIMOS]),
+                                ], wrap=True, spacing=10, run_spacing=10),
+                                padding=ft.Padding(70, 0, 20, 10)
+                            ),
+                            ft.Divider(),
+                            ft.ListTile(
+                                leading=ft.Icon(ft.Icons.NETWORK_CHECK, size=30),
+                                title=ft.Text("Límite de ancho de banda", size=16, weight=ft.FontWeight.W_500),
+                                subtitle=self.limite_ancho_text,
+                                trailing=self.crear_limite_ancho(None, self.ancho.limite, 'limite')
+                            ),
+                            ft.Container(
+                                content=ft.Row([
+                                    self.crear_hora_franja("Franja desde", 0),
+                                    self.crear_hora_franja("Hasta", 1),
+                                    self.crear_limite_ancho("Límite en la franja", self.franja[2], 'franja'),
+                                ], wrap=True, spacing=10, run_spacing=10),
+                                padding=ft.Padding(70, 0, 20, 10)
+                            ),
+                            ft.Divider(),
+                            ft.ListTile(
+                                leading=ft.Icon(ft.Icons.STORAGE, size=30),
+                                title=ft.Text("Guardar metadatos en disco", size=16, weight=ft.FontWeight.W_500),
+                                subtitle=self.estadisticas_cache_text,
+                                trailing=ft.Switch(
+                                    value=self.cache_metadatos.en_disco,
+                                    on_change=self.cambiar_cache_disco
+                                )
+                            ),
+                            ft.Divider(),
+                            ft.ListTile(
+                                leading=ft.Icon(ft.Icons.CONTENT_COPY, size=30),
+                                title=ft.Text("Archivos duplicados", size=16, weight=ft.FontWeight.W_500),
+                                subtitle=self.duplicados_text,
+                                trailing=ft.IconButton(
+                                    icon=ft.Icons.SEARCH,
+                                    tooltip="Buscar duplicados",
+                                    on_click=self.buscar_duplicados
+                                )
+                            ),
+                            ft.Container(
+                                content=self.lista_duplicados,
+                                padding=ft.Padding(70, 0, 20, 10)
+                            ),
+                            ft.Divider(),
+                            ft.ListTile(
+                                leading=ft.Icon(ft.Icons.QUERY_STATS, size=30),
+                                title=ft.Text("Rendimiento de descargas", size=16, weight=ft.FontWeight.W_500),
+                                subtitle=self.telemetria_text,
+                                trailing=ft.IconButton(
+                                    icon=ft.Icons.OPEN_IN_NEW,
+                                    tooltip="Abrir registro y métricas",
+                                    on_click=lambda e: self.abrir_carpeta(self.telemetria.ruta_log)
+                                )
+                            ),
+                            ft.Container(
+                                content=self.historial_telemetria,
+                                padding=ft.Padding(70, 0, 20, 10)
+                            ),
+                            ft.Divider(),
+                            ft.ListTile(
+                                leading=ft.Icon(ft.Icons.TIMER, size=30),
+                                title=ft.Text("Tiempos de arranque", size=16, weight=ft.FontWeight.W_500),
+                                subtitle=self.arranque_text
+                            ),
+                            ft.Divider(),
                             ft.ListTile(
                                 leading=ft.Icon(ft.Icons.PALETTE, size=30),
                                 title=ft.Text("Tema de la aplicación", size=16, weight=ft.FontWeight.W_500),
@@ -420,19 +786,81 @@ class VideoDownloader:
         self.contenido_principal.content = contenido
         self.page.update()
 
-    def actualizar_videos_async(self):
-        def tarea():
-            archivos = self.listar_videos()
-            self.videos_filtrados = self.filtrar_videos(archivos)
-            self.actualizar_lista_videos()
+    def actualizar_videos_async(self, forzar: bool = False):
+        generacion = self.generacion_busqueda
         
-        self.page.run_thread(tarea)
+        def reconciliar(tarea):
+            # Only files whose size/mtime changed are written back to the index
+            self.indice.reconciliar(forzar)
+            if tarea.cancelada:
+                return
+            # Reload as many rows as were already loaded so the scroll position survives
+            self.cargar_resultados(generacion, max(TAMAÑO_PAGINA, len(self.videos_filtrados)))
+        
+        # A newer refresh supersedes one that has not finished
+        self.planificador.programar(reconciliar, carril="biblioteca", clave="refresco")
 
-    def actualizar_lista_videos(self):
-        self.lista_videos.controls.clear()
+    def al_cambiar_biblioteca(self, videos, rutas_eliminadas):
+        # Index subscriber, called on the thread that changed the index
+        self.en_ui(self.aplicar_cambios_biblioteca, videos, rutas_eliminadas, self.indice.contar())
+
+    def aplicar_cambios_biblioteca(self, videos, rutas_eliminadas, total: int):
+        if self.search_query or len(videos) > TAMAÑO_PAGINA or (not self.videos_filtrados and total > len(videos)):
+            # Search ranking, too many changes to merge here, or rows never
+            # loaded: reload the loaded rows
+            generacion = self.generacion_busqueda
+            cargados = max(TAMAÑO_PAGINA, len(self.videos_filtrados))
+            self.planificador.programar(lambda tarea: self.cargar_resultados(generacion, cargados),
+                                        carril="biblioteca", clave="refresco")
+            return
+        cambiados = {video.ruta: video for video in videos}
+        quitados = cambiados.keys() | set(rutas_eliminadas)
+        conservados = [video for video in self.videos_filtrados if video.ruta not in quitados]
+        # Changes older than the last loaded row belong to pages not loaded yet
+        limite = None
+        if self.videos_filtrados and len(self.videos_filtrados) < self.total_videos:
+            limite = self.videos_filtrados[-1].mtime
+        nuevos = [video for video in cambiados.values() if limite is None or video.mtime >= limite]
+        self.videos_filtrados = sorted(conservados + nuevos, key=lambda video: video.mtime, reverse=True)
+        self.total_videos = total
+        # The keyed diff only rebuilds the cards of these videos
+        self.actualizar_lista_videos()
+
+    def scroll_lista_videos(self, e: ft.OnScrollEvent):
+        # Fetch the next page when the viewport gets close to the end of the loaded rows
+        if e.max_scroll_extent - e.pixels < ALTURA_CARD * TAMAÑO_PAGINA / 4:
+            self.cargar_mas_videos()
+
+    def cargar_mas_videos(self):
+        if self.cargando_videos or len(self.videos_filtrados) >= self.total_videos:
+            return
+        self.cargando_videos = True
+        generacion = self.generacion_busqueda
+        desplazamiento = len(self.videos_filtrados)
+        
+        def cargar(tarea):
+            videos = None
+            try:
+                videos = self.listar_videos(desplazamiento)
+            finally:
+                self.en_ui(self.anexar_videos, generacion, desplazamiento, videos)
         
+        self.planificador.programar(cargar, carril="biblioteca", clave="pagina")
+
+    def anexar_videos(self, generacion: int, desplazamiento: int, videos):
+        self.cargando_videos = False
+        # The list was replaced (new search or refresh) while the page loaded
+        if videos is None or generacion != self.generacion_busqueda or len(self.videos_filtrados) != desplazamiento:
+            return
+        self.videos_filtrados = self.videos_filtrados + videos
+        self.actualizar_lista_videos()
+
+    def actualizar_lista_videos(self):
+        # The empty-state placeholder is taller than a card row
+        self.lista_videos.item_extent = ALTURA_CARD if self.videos_filtrados else None
         if not self.videos_filtrados:
-            self.lista_videos.controls.append(
+            self.cards_videos = {}
+            self.lista_videos.controls = [
                 ft.Container(
                     content=ft.Column([
                         ft.Icon(ft.Icons.VIDEO_LIBRARY_OUTLINED, size=80, color=ft.Colors.GREY_400),
@@ -442,41 +870,22 @@ class VideoDownloader:
                     alignment=ft.alignment.center,
                     height=200
                 )
-            )
+            ]
         else:
-            for archivo in self.videos_filtrados:
-                self.lista_videos.controls.append(self.crear_card_video(archivo))
+            # Keyed diff: cards whose index row is unchanged are reused as-is, so
+            # Flet only sends the rows that were added, removed or modified
+            cards = {}
+            for video in self.videos_filtrados:
+                anterior = self.cards_videos.get(video.ruta)
+                if anterior and anterior[0] == video:
+                    cards[video.ruta] = anterior
+                else:
+                    cards[video.ruta] = (video, self.crear_card_video(video))
+            self.cards_videos = cards
+            self.lista_videos.controls = [card for _, card in cards.values()]
         
         self.page.update()
 
-    def opciones_yt_dlp(self, ruta_salida: Path) -> dict:
-        return {
-            'format': 'bv*+ba/b',
-            'outtmpl': str(ruta_salida),
-            'noplaylist': True,
-            'progress_hooks': [self.progreso_descarga],
-        }
-
-    def progreso_descarga(self, d):
-        if d['status'] == 'finished':
-            self.status_text.value = "✅ Descarga completada exitosamente"
-            self.progress_bar.value = 1.0
-            self.progress_bar.color = ft.Colors.GREEN_500
-        elif d['status'] == 'downloading':
-            percent = d.get('_percent_str', '0%').replace('%', '')
-            try:
-                percent_float = float(percent)
-                speed = d.get('_speed_str', '...')
-                eta = d.get('_eta_str', '...')
-                self.status_text.value = f"Descargando: {percent}% • Velocidad: {speed} • ETA: {eta}"
-                self.progress_bar.value = percent_float / 100
-                self.progress_bar.color = ft.Colors.RED_500
-            except ValueError: # Catch ValueError if percent is not a valid float
-                self.status_text.value = "Descargando..."
-                
-        self.progress_bar.visible = True
-        self.page.update()
-
     def iniciar_descarga(self, e):
         url = self.url_field.value.strip()
         nombre = self.name_field.value.strip()
@@ -484,67 +893,719 @@ class VideoDownloader:
         if not url:
             self.mostrar_error("Por favor, ingresa una URL válida")
             return
+        if self.modo_lista.value:
+            self.encolar_lista(url)
+            return
         if not nombre:
             self.mostrar_error("Por favor, ingresa un nombre para el archivo")
             return
 
-        ruta = self.carpeta_descargas / f"{nombre}.%(ext)s"
-        opciones = self.opciones_yt_dlp(ruta)
+        # Same video already downloaded, possibly from another form of the URL.
+        # Identifying the URL loads the extractor list, so it runs off the UI thread.
+        prioridad = self.prioridad_field.value
+        
+        def comprobar(tarea):
+            existente = self.motor.buscar_duplicado(url)
+            if existente:
+                self.en_ui(self.mostrar_dialogo_duplicado, url, nombre, existente)
+                return
+            # A different video (or one not in the archive) saved under the same name
+            ocupado = self.motor.archivo_con_nombre(nombre)
+            if ocupado:
+                self.en_ui(self.mostrar_dialogo_nombre, url, nombre, ocupado, self.motor.nombre_libre(nombre))
+                return
+            self.agregar_en_fondo(url, nombre, prioridad)
+        
+        self.planificador.programar(comprobar, carril="cola")
+
+    def encolar_descarga(self, url: str, nombre: str, forzar: bool = False):
+        prioridad = self.prioridad_field.value
+        self.planificador.programar(lambda tarea: self.agregar_en_fondo(url, nombre, prioridad, forzar), carril="cola")
+
+    def agregar_en_fondo(self, url: str, nombre: str, prioridad: str, forzar: bool = False):
+        # Runs on the planner; MotorDescargas.agregar identifies the URL too
+        try:
+            trabajo = self.motor.agregar(url, nombre, forzar=forzar, prioridad=prioridad)
+        except Exception as ex:
+            logging.error(f"No se pudo agregar {url} a la cola: {ex}")
+            self.en_ui(self.mostrar_error, f"No se pudo agregar a la cola: {ex}")
+            return
+        self.en_ui(self.confirmar_encolado, url, nombre, trabajo)
+
+    def confirmar_encolado(self, url: str, nombre: str, trabajo: TrabajoDescarga):
+        # Fields are freed so the next URL can be pasted, unless one already was
+        if self.url_field.value.strip() == url:
+            self.url_field.value = ""
+            self.name_field.value = ""
+        if trabajo.solicitudes > 1:
+            self.mostrar_mensaje(f"🔗 Ya se estaba descargando como \"{trabajo.nombre}\"; se comparte esa descarga")
+        else:
+            self.mostrar_mensaje(f"📥 \"{nombre}\" agregado a la cola")
+
+    def encolar_lista(self, url: str):
+        lista = self.motor.agregar_lista(
+            url,
+            rango=self.rango_field.value.strip() or None,
+            filtro=self.filtro_field.value.strip() or None,
+            prioridad=self.prioridad_field.value
+        )
+        self.actualizar_fila_lista(lista)
+        self.url_field.value = ""
+        self.mostrar_mensaje("📥 Leyendo la lista; los videos se agregan a la cola a medida que aparecen")
+
+    def cambiar_modo_lista(self, e):
+        # Entries are named after their titles, so the name field does not apply
+        lista = bool(e.control.value)
+        self.name_field.visible = not lista
+        self.rango_field.visible = lista
+        self.filtro_field.visible = lista
+        self.page.update()
+
+    def mostrar_dialogo_duplicado(self, url: str, nombre: str, existente: VideoIndexado):
+        def cerrar(e=None):
+            self.page.close(dialogo)
+        
+        def abrir(e):
+            cerrar()
+            self.abrir_reproductor(Path(existente.ruta))
+        
+        def descargar_de_nuevo(e):
+            cerrar()
+            self.encolar_descarga(url, nombre, forzar=True)
+        
+        dialogo = ft.AlertDialog(
+            modal=True,
+            title=ft.Text("Este video ya está descargado"),
+            content=ft.Text(
+                f"{existente.titulo or existente.nombre}\n"
+                f"{existente.ruta} ({self.formatear_tamaño(existente.tamaño)})"
+            ),
+            actions=[
+                ft.TextButton("Cancelar", on_click=cerrar),
+                ft.TextButton("Descargar de nuevo", on_click=descargar_de_nuevo),
+                ft.ElevatedButton("Abrir el existente", on_click=abrir),
+            ],
+            actions_alignment=ft.MainAxisAlignment.END
+        )
+        self.page.open(dialogo)
 
-        def tarea():
+    def mostrar_dialogo_nombre(self, url: str, nombre: str, ocupado: str, libre: str):
+        def cerrar(e=None):
+            self.page.close(dialogo)
+        
+        def reemplazar(e):
+            cerrar()
+            self.encolar_descarga(url, nombre, forzar=True)
+        
+        def renombrar(e):
+            cerrar()
+            self.encolar_descarga(url, libre)
+        
+        dialogo = ft.AlertDialog(
+            modal=True,
+            title=ft.Text("Ya existe un archivo con este nombre"),
+            content=ft.Text(f"{ocupado}\n¿Guardar el video como \"{libre}\" o reemplazar el archivo?"),
+            actions=[
+                ft.TextButton("Cancelar", on_click=cerrar),
+                ft.TextButton("Reemplazar", on_click=reemplazar),
+                ft.ElevatedButton(f"Guardar como \"{libre}\"", on_click=renombrar),
+            ],
+            actions_alignment=ft.MainAxisAlignment.END
+        )
+        self.page.open(dialogo)
+
+    def prefetch_metadatos(self, e):
+        # Start extract_info in the background as soon as a URL is pasted;
+        # editing the URL again supersedes the pending lookup
+        url = self.url_field.value.strip()
+        if not re.match(r"https?://\S+$", url):
+            self.planificador.cancelar("prefetch")
+            return
+        
+        def extraer(tarea):
+            self.en_ui(self.mostrar_mensaje, "🔎 Obteniendo información del video...")
             try:
-                self.estado_controles(False)
-                self.status_text.value = "Iniciando descarga..."
-                self.progress_bar.visible = True
-                self.page.update()
-                
-                with YoutubeDL(opciones) as ydl:
-                    ydl.download([url])
-                    
-                self.status_text.value = "🎉 ¡Descarga completada exitosamente!"
-                self.progress_bar.value = 1.0
-                self.progress_bar.color = ft.Colors.GREEN_500
-                
-                # Clear fields after successful download
-                self.page.run_task(self.limpiar_tras_descarga)
-                
-            except DownloadError as e:
-                self.status_text.value = f"❌ Error de descarga: {str(e)[:100]}..."
-                self.progress_bar.value = 0
-                self.progress_bar.color = ft.Colors.RED_500
+                info, _ = self.cache_metadatos.obtener(url, lambda: self.motor.extraer_info(url))
             except Exception as ex:
-                self.status_text.value = f"❌ Error inesperado: {str(ex)[:100]}..."
-                self.progress_bar.value = 0
-                self.progress_bar.color = ft.Colors.RED_500
-            finally:
-                self.estado_controles(True)
-                self.page.update()
+                logging.info(f"No se pudo obtener información de {url}: {ex}")
+                if not tarea.cancelada:
+                    self.en_ui(self.mostrar_mensaje, "")
+                return
+            if not tarea.cancelada:
+                self.en_ui(self.mostrar_metadatos, url, info)
+        
+        self.planificador.programar(extraer, carril="metadatos", clave="prefetch", retardo=RETARDO_PREFETCH)
 
-        self.page.run_thread(tarea)
+    def mostrar_metadatos(self, url: str, info: dict):
+        # The URL changed or the job was queued meanwhile
+        if self.url_field.value.strip() != url:
+            return
+        titulo = info.get('title') or ""
+        if titulo and not self.name_field.value.strip():
+            self.name_field.value = cargar_yt_dlp().utils.sanitize_filename(titulo)
+        detalles = [titulo]
+        if info.get('duration'):
+            detalles.append(self.formatear_duracion(info['duration']))
+        if info.get('channel') or info.get('uploader'):
+            detalles.append(info.get('channel') or info.get('uploader'))
+        # Format the download would fetch, with its estimated size and time
+        eleccion = self.selector.estimar(info, self.ajuste.velocidad)
+        if eleccion:
+            detalles.append(resumir_eleccion(eleccion))
+        self.mostrar_mensaje(f"ℹ️ {' • '.join(detalles)}")
 
-    async def limpiar_tras_descarga(self):
-        await asyncio.sleep(3)  # Wait 3 seconds
-        self.url_field.value = ""
-        self.name_field.value = ""
+    def precargar_en_segundo_plano(self):
+        def cargar_biblioteca(tarea):
+            inicio = time.perf_counter()
+            self.indice.reconciliar()
+            if not self.indice_busqueda.cargado:
+                self.indice_busqueda.cargar(self.indice.todos)
+            perfil_arranque.registrar("carga_biblioteca", time.perf_counter() - inicio)
+        
+        def cargar_yt_dlp_en_fondo(tarea):
+            perfil_arranque.registrar("yt_dlp", precargar_yt_dlp())
+        
+        self.planificador.programar(cargar_biblioteca, carril="biblioteca")
+        self.planificador.programar(cargar_yt_dlp_en_fondo, carril="yt_dlp")
+
+    def en_ui(self, funcion, *args):
+        # Hands a control update to the Flet event loop; background threads
+        # never mutate controls themselves
+        return self.page.run_task(self._ejecutar_en_ui, funcion, args)
+
+    async def _ejecutar_en_ui(self, funcion, args):
+        funcion(*args)
+
+    def ejecutar_frame(self, frame):
+        # The aggregator waits for each frame, so a slow UI lowers the frame
+        # rate instead of piling up updates
+        self.en_ui(frame).result(TIEMPO_CIERRE)
+
+    def actualizar_ajuste(self):
+        parametros = self.ajuste.parametros()
+        velocidad = f"{self.formatear_tamaño(self.ajuste.velocidad)}/s" if self.ajuste.velocidad else "sin medir"
+        self.ajuste_text.value = (
+            f"Fragmentos simultáneos: {parametros['concurrent_fragment_downloads']} • "
+            f"Bloque HTTP: {self.formatear_tamaño(parametros['http_chunk_size'])} • "
+            f"Búfer: {self.formatear_tamaño(parametros['buffersize'])} • "
+            f"Velocidad medida: {velocidad}"
+        )
+
+    def actualizar_formato_automatico(self):
+        velocidad = f"{self.formatear_tamaño(self.ajuste.velocidad)}/s" if self.ajuste.velocidad else "sin medir"
+        modo = ("Se elige el mejor formato que cumpla los límites" if self.selector.activo
+                else "Se descarga la mejor calidad disponible")
+        self.formato_automatico_text.value = f"{modo} • Velocidad estimada: {velocidad}"
+
+    def crear_limite_formato(self, etiqueta: str, clave: str, opciones: list) -> ft.Dropdown:
+        # "-" stands for no limit
+        valor = self.selector.configuracion()[clave]
+        return ft.Dropdown(
+            label=etiqueta,
+            value="-" if valor is None else str(valor),
+            options=[ft.dropdown.Option("-", "Sin límite")] + [ft.dropdown.Option(str(v), texto) for v, texto in opciones],
+            width=170,
+            dense=True,
+            on_change=lambda e: self.cambiar_formato_automatico(clave, e.control.value)
+        )
+
+    def actualizar_estadisticas_cache(self):
+        cache = self.cache_metadatos
+        self.estadisticas_cache_text.value = (
+            f"Aciertos de caché: {cache.tasa_aciertos:.0%} "
+            f"({cache.aciertos} de {cache.aciertos + cache.fallos} consultas)"
+        )
+
+    def actualizar_telemetria(self):
+        self.version_telemetria = self.telemetria.version
+        sitios = self.telemetria.resumen_por_sitio()
+        if not sitios:
+            self.telemetria_text.value = "Sin descargas registradas"
+            self.historial_telemetria.controls = []
+            return
+        lineas = []
+        for sitio in sitios[:5]:
+            partes = [f"{sitio['sitio']}: {sitio['intentos']} intentos ({sitio['fallos']} fallidos)"]
+            if 'velocidad_media' in sitio:
+                partes.append(f"{self.formatear_tamaño(sitio['velocidad_media'])}/s")
+            if 'segundos_primer_byte' in sitio:
+                partes.append(f"primer byte {sitio['segundos_primer_byte']:.1f} s")
+            partes.append(f"extracción {sitio['segundos_extraccion']:.1f} s")
+            partes.append(f"postproceso {sitio['segundos_postproceso']:.1f} s")
+            lineas.append(" • ".join(partes))
+        self.telemetria_text.value = "\n".join(lineas)
+        
+        filas = []
+        for registro in self.telemetria.historial(10):
+            icono = "✅" if registro['resultado'] == 'completado' else "❌"
+            velocidad = registro.get('velocidad_maxima')
+            filas.append(ft.Text(
+                f"{icono} {registro['sitio']} {registro.get('formato') or ''} • "
+                f"{registro['segundos_total']:.1f} s • {self.formatear_tamaño(registro['bytes'])} • "
+                f"pico {self.formatear_tamaño(velocidad) + '/s' if velocidad else '-'} • "
+                f"reintentos {registro['reintentos_fragmento']}",
+                size=12, color=ft.Colors.GREY_600, max_lines=1, overflow=ft.TextOverflow.ELLIPSIS
+            ))
+        self.historial_telemetria.controls = filas
+
+    def buscar_duplicados(self, e):
+        self.duplicados_text.value = "Buscando..."
+        self.page.update()
+        
+        def buscar(tarea):
+            self.indice.reconciliar()
+            self.en_ui(self.mostrar_duplicados, self.indice.buscar_duplicados())
+        
+        self.planificador.programar(buscar, carril="biblioteca", clave="duplicados")
+
+    def mostrar_duplicados(self, grupos):
+        copias = sum(len(grupo) - 1 for grupo in grupos)
+        self.duplicados_text.value = (
+            f"{len(grupos)} grupos • {copias} copias sobrantes • "
+            f"{self.formatear_tamaño(sum(grupo[0].tamaño * (len(grupo) - 1) for grupo in grupos))} recuperables"
+            if grupos else "No hay archivos duplicados"
+        )
+        filas = []
+        for grupo in grupos:
+            filas.append(ft.Text(f"{self.formatear_tamaño(grupo[0].tamaño)} • {len(grupo)} copias",
+                                 size=12, weight=ft.FontWeight.W_500))
+            for video in grupo:
+                filas.append(ft.Row([
+                    ft.Text(video.nombre, size=12, color=ft.Colors.GREY_600, max_lines=1,
+                            overflow=ft.TextOverflow.ELLIPSIS, expand=True),
+                    ft.IconButton(
+                        icon=ft.Icons.FOLDER_OPEN,
+                        icon_size=16,
+                        tooltip="Mostrar en la carpeta",
+                        on_click=lambda e, ruta=video.ruta: self.abrir_carpeta(Path(ruta))
+                    ),
+                ], spacing=4))
+        self.lista_duplicados.controls = filas
         self.page.update()
 
+    def leer_cache_disco(self) -> bool:
+        try:
+            return bool(self.page.client_storage.get("cache_metadatos_disco"))
+        except Exception:
+            return False
+
+    def cambiar_cache_disco(self, e):
+        if e.control.value:
+            self.cache_metadatos.activar_disco(self.motor.carpeta_datos / "metadatos.db")
+        else:
+            self.cache_metadatos.desactivar_disco()
+        try:
+            self.page.client_storage.set("cache_metadatos_disco", bool(e.control.value))
+        except Exception as ex:
+            logging.warning(f"No se pudo guardar la configuración: {ex}")
+
+    def crear_fila_trabajo(self, trabajo: TrabajoDescarga):
+        fila = {
+            'trabajo': trabajo,
+            'titulo': ft.Text(trabajo.nombre, size=16, weight=ft.FontWeight.W_500, max_lines=1,
+                              overflow=ft.TextOverflow.ELLIPSIS, expand=True),
+            'estado': ft.Text(size=12, weight=ft.FontWeight.W_500),
+            'detalle': ft.Text(size=12, color=ft.Colors.GREY_600, max_lines=2, overflow=ft.TextOverflow.ELLIPSIS),
+            'barra': ft.ProgressBar(value=0, height=6, color=ft.Colors.RED_500,
+                                    bgcolor=ft.Colors.RED_100, border_radius=3),
+            'reintentar': ft.IconButton(
+                icon=ft.Icons.REPLAY,
+                tooltip="Reintentar",
+                visible=False,
+                on_click=lambda e, t=trabajo: self.cola.reintentar(t)
+            ),
+            'pausar': ft.IconButton(
+                icon=ft.Icons.PAUSE,
+                tooltip="Pausar",
+                on_click=lambda e, t=trabajo: self.alternar_pausa(t)
+            ),
+            'cancelar': ft.IconButton(
+                icon=ft.Icons.CLOSE,
+                tooltip="Cancelar",
+                on_click=lambda e, t=trabajo: self.motor.cancelar(t)
+            ),
+            'prioridad': ft.PopupMenuButton(
+                items=[
+                    ft.PopupMenuItem(text=f"Prioridad {nombre.lower()}", icon=ICONOS_PRIORIDAD[p],
+                                     on_click=lambda e, t=trabajo, p=p: self.cola.priorizar(t, p))
+                    for p, nombre in NOMBRES_PRIORIDAD.items()
+                ]
+            ),
+        }
+        fila['control'] = ft.Container(
+            content=ft.Column([
+                ft.Row([fila['titulo'], fila['estado'], fila['prioridad'], fila['pausar'], fila['cancelar'],
+                        fila['reintentar']], spacing=10),
+                fila['barra'],
+                fila['detalle']
+            ], spacing=6),
+            padding=ft.Padding(15, 10, 15, 10),
+            border_radius=12,
+            border=ft.border.all(1, ft.Colors.OUTLINE_VARIANT)
+        )
+        self.filas_trabajos[trabajo.id] = fila
+        self.lista_trabajos.controls.insert(0, fila['control'])
+        return fila
+
+    def alternar_pausa(self, trabajo: TrabajoDescarga):
+        if trabajo.estado == ESTADO_PAUSADO:
+            self.cola.reanudar(trabajo)
+        else:
+            self.cola.pausar(trabajo)
+
+    def actualizar_fila_trabajo(self, trabajo: TrabajoDescarga):
+        # Called from yt-dlp hooks and queue workers; the row is redrawn on the next frame
+        self.agregador.marcar(trabajo.id, trabajo)
+        if trabajo.lista:
+            self.agregador.marcar(("lista", trabajo.lista.id), trabajo.lista)
+
+    def actualizar_fila_lista(self, lista: ListaDescarga):
+        self.agregador.marcar(("lista", lista.id), lista)
+
+    def renderizar_fila(self, valor):
+        if isinstance(valor, ListaDescarga):
+            self.renderizar_fila_lista(valor)
+        else:
+            self.renderizar_fila_trabajo(valor)
+
+    def crear_fila_lista(self, lista: ListaDescarga):
+        fila = {
+            'lista': lista,
+            'titulo': ft.Text(lista.url, size=16, weight=ft.FontWeight.BOLD, max_lines=1,
+                              overflow=ft.TextOverflow.ELLIPSIS, expand=True),
+            'estado': ft.Text(size=12, weight=ft.FontWeight.W_500),
+            'detalle': ft.Text(size=12, color=ft.Colors.GREY_600, max_lines=2, overflow=ft.TextOverflow.ELLIPSIS),
+            'barra': ft.ProgressBar(value=0, height=8, color=ft.Colors.RED_500,
+                                    bgcolor=ft.Colors.RED_100, border_radius=4),
+            'cancelar': ft.IconButton(
+                icon=ft.Icons.CLOSE,
+                tooltip="Cancelar la lista",
+                on_click=lambda e, l=lista: self.motor.cancelar_lista(l)
+            ),
+        }
+        fila['control'] = ft.Container(
+            content=ft.Column([
+                ft.Row([ft.Icon(ft.Icons.PLAYLIST_PLAY), fila['titulo'], fila['estado'], fila['cancelar']],
+                       spacing=10),
+                fila['barra'],
+                fila['detalle']
+            ], spacing=6),
+            padding=ft.Padding(15, 10, 15, 10),
+            border_radius=12,
+            border=ft.border.all(2, ft.Colors.OUTLINE_VARIANT)
+        )
+        self.filas_listas[lista.id] = fila
+        self.lista_trabajos.controls.insert(0, fila['control'])
+        return fila
+
+    def renderizar_fila_lista(self, lista: ListaDescarga):
+        fila = self.filas_listas.get(lista.id) or self.crear_fila_lista(lista)
+        conteo = lista.resumen()
+        encontrados = len(lista.trabajos)
+        if lista.error:
+            estado, color = "❌ Error al leer la lista", ft.Colors.RED_500
+        elif lista.cancelada:
+            estado, color = "Cancelada", ft.Colors.GREY_600
+        elif lista.enumerando:
+            estado, color = "Leyendo lista...", ft.Colors.BLUE_500
+        elif self.lista_activa(conteo):
+            estado, color = "Descargando", ft.Colors.BLUE_500
+        else:
+            estado, color = "✅ Terminada", ft.Colors.GREEN_500
+        
+        partes = [f"{encontrados} videos" + (f" de {lista.total}" if lista.total else "")]
+        partes.append(f"{conteo[ESTADO_COMPLETADO]} completados")
+        if conteo[ESTADO_DESCARGANDO]:
+            partes.append(f"{conteo[ESTADO_DESCARGANDO]} descargando")
+        if conteo[ESTADO_PROCESANDO]:
+            partes.append(f"{conteo[ESTADO_PROCESANDO]} procesando")
+        if conteo[ESTADO_PAUSADO]:
+            partes.append(f"{conteo[ESTADO_PAUSADO]} en pausa")
+        if conteo[ESTADO_FALLIDO]:
+            partes.append(f"{conteo[ESTADO_FALLIDO]} fallidos")
+        if conteo[ESTADO_CANCELADO]:
+            partes.append(f"{conteo[ESTADO_CANCELADO]} cancelados")
+        if lista.omitidos:
+            partes.append(f"{lista.omitidos} ya descargados o en la cola")
+        if lista.error:
+            partes.append(str(lista.error)[:100])
+        
+        progreso = lista.progreso()
+        fila['titulo'].value = lista.titulo or lista.url
+        fila['estado'].value = f"{estado} • {progreso:.0%}"
+        fila['estado'].color = color
+        fila['detalle'].value = " • ".join(partes)
+        fila['barra'].value = progreso
+        fila['cancelar'].visible = not lista.cancelada and (lista.enumerando or self.lista_activa(conteo))
+
+    def lista_activa(self, conteo: dict) -> bool:
+        return any(conteo[estado] for estado in (ESTADO_EN_COLA, ESTADO_DESCARGANDO, ESTADO_PROCESANDO, ESTADO_PAUSADO))
+
+    def renderizar_fila_trabajo(self, trabajo: TrabajoDescarga):
+        if trabajo.id in self.ocultos:
+            if trabajo.estado in ESTADOS_TERMINADOS:
+                return
+            # Retried from another session: shown again
+            self.ocultos.discard(trabajo.id)
+        fila = self.filas_trabajos.get(trabajo.id) or self.crear_fila_trabajo(trabajo)
+        
+        # Built here: `detalle` belongs to the engine, shared by every session
+        detalle = trabajo.detalle
+        if trabajo.estado == ESTADO_EN_COLA:
+            estado, color = "En cola", ft.Colors.GREY_600
+            if trabajo.reintentos:
+                estado = f"En cola (reintento {trabajo.reintentos}/{self.cola.max_reintentos})"
+        elif trabajo.estado == ESTADO_DESCARGANDO:
+            estado, color = "Descargando", ft.Colors.BLUE_500
+        elif trabajo.estado == ESTADO_PROCESANDO:
+            estado, color = "Procesando", ft.Colors.PURPLE_500
+        elif trabajo.estado == ESTADO_PAUSADO:
+            estado, color = "En pausa", ft.Colors.AMBER_700
+            detalle = f"En pausa • {trabajo.progreso:.0%} descargado"
+        elif trabajo.estado == ESTADO_CANCELADO:
+            estado, color = "Cancelada", ft.Colors.GREY_600
+            detalle = "Descarga cancelada"
+        elif trabajo.estado == ESTADO_COMPLETADO and trabajo.conflicto_nombre:
+            estado, color = "⚠️ Nombre en uso", ft.Colors.AMBER_700
+            detalle = (f"Ya existe {Path(trabajo.duplicado).name}; no se descargó. "
+                       "Usa otro nombre o descárgalo de nuevo para reemplazarlo")
+        elif trabajo.estado == ESTADO_COMPLETADO and trabajo.duplicado:
+            estado, color = "✅ Ya descargado", ft.Colors.GREEN_500
+            detalle = f"Ya estaba en la biblioteca: {Path(trabajo.duplicado).name}"
+        elif trabajo.estado == ESTADO_COMPLETADO:
+            estado, color = "✅ Completada", ft.Colors.GREEN_500
+            detalle = f"Guardado en {self.carpeta_descargas}"
+        else:
+            estado, color = "❌ Fallida", ft.Colors.RED_500
+            prefijo = "Error de descarga" if es_error_descarga(trabajo.error) else "Error inesperado"
+            detalle = f"{prefijo}: {str(trabajo.error)[:100]}"
+        
+        fila['estado'].value = estado
+        fila['estado'].color = color
+        fila['detalle'].value = detalle
+        cuota = self.ancho.reparto().get(trabajo.id) if trabajo.estado == ESTADO_DESCARGANDO else None
+        if cuota:
+            fila['detalle'].value += f" • Cuota: {self.formatear_tamaño(cuota)}/s"
+        if trabajo.solicitudes > 1 and trabajo.estado not in ESTADOS_TERMINADOS:
+            fila['detalle'].value += f" • Pedida {trabajo.solicitudes} veces"
+        fila['prioridad'].icon = ICONOS_PRIORIDAD[trabajo.prioridad]
+        fila['prioridad'].tooltip = f"Prioridad {NOMBRES_PRIORIDAD[trabajo.prioridad].lower()}"
+        fila['prioridad'].visible = trabajo.estado not in ESTADOS_TERMINADOS
+        # ffmpeg reports no progress: indeterminate bar while a merge runs
+        procesando = trabajo.estado == ESTADO_PROCESANDO and trabajo.inicio_postproceso is not None
+        fila['barra'].value = None if procesando else trabajo.progreso
+        fila['barra'].color = ft.Colors.GREEN_500 if trabajo.estado == ESTADO_COMPLETADO else ft.Colors.RED_500
+        fila['reintentar'].visible = trabajo.estado in (ESTADO_FALLIDO, ESTADO_CANCELADO)
+        # Merges already handed to ffmpeg can be cancelled but not paused
+        fila['pausar'].visible = trabajo.estado in (ESTADO_EN_COLA, ESTADO_DESCARGANDO, ESTADO_PAUSADO)
+        fila['pausar'].icon = ft.Icons.PLAY_ARROW if trabajo.estado == ESTADO_PAUSADO else ft.Icons.PAUSE
+        fila['pausar'].tooltip = "Reanudar" if trabajo.estado == ESTADO_PAUSADO else "Pausar"
+        fila['cancelar'].visible = trabajo.estado not in ESTADOS_TERMINADOS
+
+    def publicar_progreso(self):
+        self.actualizar_resumen_cola()
+        self.actualizar_estadisticas_ui()
+        if self.telemetria.version != self.version_telemetria:
+            self.actualizar_telemetria()
+        self.page.update()
+
+    def actualizar_estadisticas_ui(self):
+        self.estadisticas_ui_text.value = (
+            f"Actualizaciones recibidas: {self.agregador.marcas} • "
+            f"Enviadas: {self.agregador.frames} • Agrupadas: {self.agregador.agrupadas}"
+        )
+
+    def actualizar_resumen_cola(self):
+        conteo = dict.fromkeys(ESTADOS, 0)
+        for trabajo in list(self.cola.trabajos):
+            if trabajo.id not in self.ocultos:
+                conteo[trabajo.estado] += 1
+        self.resumen_cola_text.value = (
+            f"En cola: {conteo[ESTADO_EN_COLA]} • Descargando: {conteo[ESTADO_DESCARGANDO]} • "
+            f"Procesando: {conteo[ESTADO_PROCESANDO]} • En pausa: {conteo[ESTADO_PAUSADO]} • "
+            f"Completadas: {conteo[ESTADO_COMPLETADO]} • Fallidas: {conteo[ESTADO_FALLIDO]} • "
+            f"Canceladas: {conteo[ESTADO_CANCELADO]}"
+        )
+        limite = self.ancho.limite_actual()
+        if limite is None:
+            self.ancho_cola_text.value = "Ancho de banda: sin límite"
+            return
+        # Share of one download of each priority currently transferring
+        reparto = self.ancho.reparto()
+        cuotas = {t.prioridad: reparto[t.id] for t in list(self.cola.trabajos) if t.id in reparto}
+        partes = [f"Ancho de banda: {self.formatear_tamaño(limite)}/s"]
+        if reparto:
+            partes.append(f"{len(reparto)} descargas activas")
+            partes += [f"{nombre}: {self.formatear_tamaño(cuotas[p])}/s c/u"
+                       for p, nombre in NOMBRES_PRIORIDAD.items() if p in cuotas]
+        self.ancho_cola_text.value = " • ".join(partes)
+
+    def quitar_trabajos_terminados(self, e):
+        # Only from this session's view: the queue is shared with other sessions
+        # and drops old finished jobs by itself (HISTORIAL_TERMINADOS)
+        terminados = [fila['trabajo'] for fila in self.filas_trabajos.values()
+                      if fila['trabajo'].estado in ESTADOS_TERMINADOS]
+        en_cola = {t.id for t in list(self.cola.trabajos)}
+        self.ocultos = (self.ocultos | {t.id for t in terminados}) & en_cola
+        self.agregador.descartar([t.id for t in terminados])
+        for trabajo in terminados:
+            fila = self.filas_trabajos.pop(trabajo.id, None)
+            if fila:
+                self.lista_trabajos.controls.remove(fila['control'])
+        for fila in list(self.filas_listas.values()):
+            lista = fila['lista']
+            conteo = lista.resumen()
+            if lista.enumerando or self.lista_activa(conteo):
+                continue
+            self.agregador.descartar([("lista", lista.id)])
+            del self.filas_listas[lista.id]
+            self.lista_trabajos.controls.remove(fila['control'])
+        self.actualizar_resumen_cola()
+        self.page.update()
+
+    def leer_formato_automatico(self, selector):
+        try:
+            selector.configurar(self.page.client_storage.get("formato_automatico") or {})
+        except Exception as ex:
+            logging.warning(f"No se pudo leer la configuración de calidad: {ex}")
+
+    def cambiar_formato_automatico(self, clave: str, valor: str):
+        if valor == "-":
+            valor = None
+        elif clave not in ('codec', 'contenedor'):
+            valor = int(valor)
+        self.selector.configurar({clave: valor})
+        self.actualizar_formato_automatico()
+        self.page.update()
+        try:
+            self.page.client_storage.set("formato_automatico", self.selector.configuracion())
+        except Exception as ex:
+            logging.warning(f"No se pudo guardar la configuración: {ex}")
+
+    def leer_limite_ancho(self, ancho):
+        try:
+            ancho.configurar(self.page.client_storage.get("limite_ancho") or {})
+        except Exception as ex:
+            logging.warning(f"No se pudo leer el límite de ancho de banda: {ex}")
+
+    def actualizar_limite_ancho(self):
+        limite = self.ancho.limite_actual()
+        partes = [f"Ahora: {self.formatear_tamaño(limite) + '/s' if limite else 'sin límite'}"]
+        for desde, hasta, limite_franja in self.ancho.franjas:
+            valor = f"{self.formatear_tamaño(limite_franja)}/s" if limite_franja else "sin límite"
+            partes.append(f"De {desde:02d}:00 a {hasta:02d}:00: {valor}")
+        partes.append("Se reparte entre las descargas activas según su prioridad")
+        self.limite_ancho_text.value = " • ".join(partes)
+
+    def crear_limite_ancho(self, etiqueta: str, valor: int, clave: str) -> ft.Dropdown:
+        # "-" stands for no limit
+        return ft.Dropdown(
+            label=etiqueta,
+            value="-" if valor is None else str(valor),
+            options=[ft.dropdown.Option("-", "Sin límite")] +
+                    [ft.dropdown.Option(str(v), f"{self.formatear_tamaño(v)}/s") for v in LIMITES_ANCHO],
+            width=170,
+            dense=True,
+            on_change=lambda e: self.cambiar_limite_ancho(clave, e.control.value)
+        )
+
+    def crear_hora_franja(self, etiqueta: str, indice: int) -> ft.Dropdown:
+        valor = self.franja[indice]
+        horas = range(24) if indice == 0 else range(1, 25)
+        return ft.Dropdown(
+            label=etiqueta,
+            value="-" if valor is None else str(valor),
+            options=[ft.dropdown.Option("-", "Sin franja")] +
+                    [ft.dropdown.Option(str(h), f"{h:02d}:00") for h in horas],
+            width=150,
+            dense=True,
+            on_change=lambda e: self.cambiar_franja_ancho(indice, e.control.value)
+        )
+
+    def cambiar_limite_ancho(self, clave: str, valor: str):
+        valor = None if valor == "-" else int(valor)
+        if clave == 'limite':
+            self.ancho.configurar({'limite': valor})
+            self.guardar_limite_ancho()
+        else:
+            self.cambiar_franja_ancho(2, valor)
+
+    def cambiar_franja_ancho(self, indice: int, valor):
+        self.franja[indice] = None if valor in (None, "-") else int(valor)
+        desde, hasta, limite = self.franja
+        # Applied once both hours are chosen
+        completa = desde is not None and hasta is not None and desde != hasta
+        self.ancho.configurar({'franjas': [(desde, hasta, limite)] if completa else []})
+        self.guardar_limite_ancho()
+
+    def guardar_limite_ancho(self):
+        self.actualizar_limite_ancho()
+        self.actualizar_resumen_cola()
+        self.page.update()
+        try:
+            self.page.client_storage.set("limite_ancho", self.ancho.configuracion())
+        except Exception as ex:
+            logging.warning(f"No se pudo guardar la configuración: {ex}")
+
+    def leer_trabajadores(self) -> int:
+        try:
+            valor = int(self.page.client_storage.get("descargas_simultaneas") or TRABAJADORES_POR_DEFECTO)
+        except Exception:
+            valor = TRABAJADORES_POR_DEFECTO
+        return min(max(valor, 1), MAX_TRABAJADORES)
+
+    def cambiar_trabajadores(self, e):
+        n = int(e.control.value)
+        self.cola.set_trabajadores(n)
+        try:
+            self.page.client_storage.set("descargas_simultaneas", n)
+        except Exception as ex:
+            logging.warning(f"No se pudo guardar la configuración: {ex}")
+
+    def leer_frecuencia(self) -> int:
+        try:
+            valor = int(self.page.client_storage.get("frecuencia_progreso") or FRECUENCIA_POR_DEFECTO)
+        except Exception:
+            valor = FRECUENCIA_POR_DEFECTO
+        return valor if valor in FRECUENCIAS_DISPONIBLES else FRECUENCIA_POR_DEFECTO
+
+    def cambiar_frecuencia(self, e):
+        hz = int(e.control.value)
+        self.agregador.set_hz(hz)
+        try:
+            self.page.client_storage.set("frecuencia_progreso", hz)
+        except Exception as ex:
+            logging.warning(f"No se pudo guardar la configuración: {ex}")
+
     def mostrar_error(self, mensaje):
         self.status_text.value = f"❌ {mensaje}"
         self.status_text.color = ft.Colors.RED_500
         self.page.update()
 
+    def mostrar_mensaje(self, mensaje):
+        self.status_text.value = mensaje
+        self.status_text.color = None
+        self.page.update()
+
     def limpiar_campos(self, e):
         self.url_field.value = ""
         self.name_field.value = ""
+        self.rango_field.value = ""
+        self.filtro_field.value = ""
         self.status_text.value = ""
-        self.progress_bar.visible = False
         self.page.update()
 
-    def estado_controles(self, habilitar: bool):
-        self.url_field.disabled = not habilitar
-        self.name_field.disabled = not habilitar
-        self.download_button.disabled = not habilitar
-        self.page.update()
+    def cerrar(self, detener_descargas: bool = True):
+        # Stop refreshing the UI and drop background work. Closing the window
+        # also stops the downloads (unfinished ones are resumed on the next
+        # start); a closed web session leaves them running for the others.
+        self.motor.desuscribir(self.suscripcion)
+        self.indice.desuscribir(self.al_cambiar_biblioteca)
+        self.agregador.detener()
+        self.agregador_miniaturas.detener()
+        self.planificador.cerrar(TIEMPO_CIERRE)
+        if not self.compartido.soltar(detener_descargas, TIEMPO_CIERRE):
+            logging.warning("Algunas descargas no terminaron de detenerse al cerrar")
 
     def crear_layout_principal(self):
         # Main content that will change based on navigation
@@ -558,6 +1619,7 @@ class VideoDownloader:
         return layout
 
 async def main(page: ft.Page):
+    perfil_arranque.marcar("inicio_flet")
     page.title = "YouTube Download"
     page.theme_mode = ft.ThemeMode.SYSTEM
     page.scroll = ft.ScrollMode.ADAPTIVE
@@ -575,6 +1637,19 @@ async def main(page: ft.Page):
 
     downloader = VideoDownloader(page)
     
+    if page.web:
+        # One session per browser tab, all on the same engine
+        page.on_close = lambda e: downloader.cerrar(detener_descargas=False)
+    else:
+        # Downloads are stopped cleanly before the window goes away
+        def al_evento_ventana(e: ft.WindowEvent):
+            if e.type == ft.WindowEventType.CLOSE:
+                downloader.cerrar()
+                page.window.destroy()
+        
+        page.window.prevent_close = True
+        page.window.on_event = al_evento_ventana
+    
     # Assign the navigation bar to the page's navigation_bar property
     page.navigation_bar = downloader.navigation_bar
 
@@ -584,5 +1659,11 @@ async def main(page: ft.Page):
     
     # Show initial view (download)
     downloader.mostrar_vista_descarga()
+    perfil_arranque.marcar("vista_inicial")
+    
+    # Heavy work starts only after the first view is on screen
+    downloader.precargar_en_segundo_plano()
 
-ft.app(target=main)
+if __name__ == "__main__":
+    perfil_arranque.marcar("importaciones")
+    ft.app(target=main)
@@ -0,0 +1,3147 @@
+import logging
+from pathlib import Path
+import os
+import time
+import platform # Import platform to detect OS
+import subprocess
+import threading
+import itertools
+import functools
+import contextlib
+import sqlite3
+import re
+import unicodedata
+import json
+import copy
+import hashlib
+import glob
+import heapq
+import base64
+import ctypes
+import select
+import struct
+import stat
+import shutil
+import urllib.request
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque, namedtuple, defaultdict, OrderedDict
+
+# Download engine shared by the Flet app (main.py) and the headless CLI (cli.py).
+# Nothing in this module may import flet, and yt-dlp is only imported on first
+# use (see cargar_yt_dlp) because loading its extractors dominates cold start.
+
+_yt_dlp = None
+_yt_dlp_lock = threading.Lock()
+
+def cargar_yt_dlp():
+    # Imports yt-dlp once, on first download/extraction or from a warm-up thread
+    global _yt_dlp
+    with _yt_dlp_lock:
+        if _yt_dlp is None:
+            import yt_dlp
+            import yt_dlp.utils
+            _yt_dlp = yt_dlp
+    return _yt_dlp
+
+def precargar_yt_dlp() -> float:
+    # Imports yt-dlp and its extractor registry; returns the seconds it took
+    inicio = time.perf_counter()
+    yt_dlp = cargar_yt_dlp()
+    yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}).close()
+    return time.perf_counter() - inicio
+
+class TrabajoRetenido(Exception):
+    # Raised by `ejecutar` when a job cannot run yet (e.g. not enough disk
+    # space); the queue holds it back without counting a retry
+    pass
+
+def es_error_descarga(error) -> bool:
+    # DownloadError check that does not force yt-dlp to load
+    return _yt_dlp is not None and isinstance(error, _yt_dlp.utils.DownloadError)
+
+class PostprocesoDiferido:
+    # YoutubeDL mixin that records post_process calls (merges, remuxes, fixups
+    # and moves) instead of running them, so they can be replayed later with
+    # `post_process_diferido` from another thread
+    def post_process(self, filename, info, files_to_move=None):
+        self.diferidos.append((filename, info, files_to_move))
+        return info
+
+    def post_process_diferido(self):
+        while self.diferidos:
+            filename, info, files_to_move = self.diferidos.pop(0)
+            resultado = super().post_process(filename, info, files_to_move)
+            if resultado is not info:
+                # requested_downloads holds this same dict
+                info.clear()
+                info.update(resultado)
+
+_clase_youtubedl_diferido = None
+
+def crear_youtubedl_diferido(opciones: dict):
+    global _clase_youtubedl_diferido
+    if _clase_youtubedl_diferido is None:
+        _clase_youtubedl_diferido = type('YoutubeDLDiferido', (PostprocesoDiferido, cargar_yt_dlp().YoutubeDL), {})
+    ydl = _clase_youtubedl_diferido(opciones)
+    ydl.diferidos = []
+    return ydl
+
+# Warm YoutubeDL sessions
+SESION_INICIAL = {'quiet': True, 'no_warnings': True}  # Only while a session is built
+SESIONES_INACTIVAS = 8
+TTL_SESIONES = 5 * 60
+# Read once by YoutubeDL.__init__ or by the network objects it caches
+# (request director, proxies, cookie jar, output streams); a job setting one
+# of them to something else than the pooled sessions gets its own YoutubeDL
+OPCIONES_DE_CONSTRUCCION = frozenset((
+    'http_headers', 'proxy', 'geo_verification_proxy', 'source_address', 'socket_timeout',
+    'nocheckcertificate', 'legacyserverconnect', 'enable_file_urls', 'impersonate',
+    'client_certificate', 'client_certificate_key', 'client_certificate_password',
+    'cookiefile', 'cookiesfrombrowser', 'debug_printtraffic', 'compat_opts', 'js_runtimes',
+    'remote_components', 'quiet', 'logtostderr', 'no_color', 'color', 'bidi_workaround',
+    'restrictfilenames', 'forceprint', 'print_to_file', 'simulate', 'listformats',
+    'listsubtitles', 'list_thumbnails', 'download_archive', 'allow_unplayable_formats',
+))
+# YoutubeDL internals a session is reset through; without them every job gets its own YoutubeDL
+ATRIBUTOS_SESION = (
+    '_pps', '_progress_hooks', '_postprocessor_hooks', '_post_hooks', '_printed_messages',
+    '_download_retcode', '_num_downloads', '_num_videos', '_playlist_level', '_playlist_urls',
+    '_parse_outtmpl', 'format_selector', 'build_format_selector',
+)
+
+class PoolSesiones:
+    # Reusable YoutubeDLDiferido instances. Building a YoutubeDL loads the
+    # extractor registry and a request director, and a new one starts with
+    # cold extractors and no open connections. A borrowed session gets the
+    # caller's options layered over the ones it was built with, and is given
+    # back when the job is done. Up to SESIONES_INACTIVAS idle sessions are
+    # kept, for TTL_SESIONES seconds. All of them share one cookie jar, and a
+    # job gets the session that last served its host when there is one, so
+    # keep-alive connections and extractor state carry over between jobs.
+    def __init__(self, maximo: int = SESIONES_INACTIVAS, ttl: float = TTL_SESIONES):
+        self.maximo = maximo
+        self.ttl = ttl
+        self.creadas = 0
+        self.reutilizadas = 0
+        self._inactivas = []  # (instante, host, sesión), oldest first
+        self._cookies = None
+        self._compatible = True  # Until a session shows the yt-dlp internals changed
+        self._cerrado = False
+        self._lock = threading.Lock()
+
+    def prestar(self, opciones: dict, url: str = None):
+        if not self.admite(opciones):
+            return self._crear_unica(opciones)
+        host = urllib.parse.urlsplit(url).hostname if url else None
+        with self._lock:
+            cerrar = self._expirar()
+            sesion = None
+            if self._inactivas:
+                mismo_host = [i for i, (_, h, _) in enumerate(self._inactivas) if h == host]
+                sesion = self._inactivas.pop(mismo_host[-1] if mismo_host else -1)[2]
+                self.reutilizadas += 1
+            else:
+                self.creadas += 1
+        for vieja in cerrar:
+            vieja.close()
+        if sesion is None:
+            sesion = self._crear()
+            if not self._compatible:
+                sesion.close()
+                return self._crear_unica(opciones)
+        sesion.host = host
+        self._preparar(sesion, opciones)
+        return sesion
+
+    def devolver(self, sesion):
+        with self._lock:
+            if sesion.unica or self._cerrado:
+                cerrar = [sesion]
+            else:
+                self._inactivas.append((time.monotonic(), sesion.host, sesion))
+                cerrar = self._expirar()
+        for vieja in cerrar:
+            vieja.close()
+
+    @contextlib.contextmanager
+    def sesion(self, opciones: dict, url: str = None):
+        sesion = self.prestar(opciones, url)
+        try:
+            yield sesion
+        finally:
+            self.devolver(sesion)
+
+    def cerrar(self):
+        # Sessions still lent out are closed when they come back
+        with self._lock:
+            self._cerrado = True
+            cerrar = [sesion for _, _, sesion in self._inactivas]
+            self._inactivas = []
+        for sesion in cerrar:
+            sesion.close()
+
+    def _expirar(self) -> list:
+        # Called with the lock held; the caller closes what is returned
+        # The list is in return order, so expired and surplus sessions are at the front
+        limite = time.monotonic() - self.ttl
+        vigentes = min(sum(1 for instante, _, _ in self._inactivas if instante >= limite), self.maximo)
+        corte = len(self._inactivas) - vigentes
+        quitadas = [sesion for _, _, sesion in self._inactivas[:corte]]
+        del self._inactivas[:corte]
+        return quitadas
+
+    def admite(self, opciones: dict) -> bool:
+        # Whether a pooled session can be prepared with these options
+        return self._compatible and all(
+            opciones[clave] == SESION_INICIAL.get(clave) for clave in OPCIONES_DE_CONSTRUCCION & opciones.keys()
+        )
+
+    def _crear_unica(self, opciones: dict):
+        # Built for one job from all of its options, and closed when given back
+        with self._lock:
+            self.creadas += 1
+        sesion = crear_youtubedl_diferido(dict(opciones))
+        sesion.host = None
+        sesion.unica = True
+        return sesion
+
+    def _crear(self):
+        # YoutubeDL keeps and fills in the dict it is given
+        sesion = crear_youtubedl_diferido(dict(SESION_INICIAL))
+        sesion.unica = False
+        if not all(hasattr(sesion, atributo) for atributo in ATRIBUTOS_SESION):
+            logging.warning("Esta versión de yt-dlp no permite reutilizar sesiones; se crea una por descarga")
+            self._compatible = False
+            return sesion
+        # What YoutubeDL.__init__ normalized (headers, compat options...), as the base for every job
+        sesion.params_base = {clave: valor for clave, valor in sesion.params.items() if clave not in SESION_INICIAL}
+        with self._lock:
+            if self._cookies is None:
+                self._cookies = sesion.cookiejar
+        # Replaces the cached property before the request director is built from it
+        sesion.__dict__['cookiejar'] = self._cookies
+        return sesion
+
+    def _preparar(self, sesion, opciones: dict):
+        # The per-job part of YoutubeDL.__init__, on a session built once
+        opciones = dict(opciones)
+        ganchos = {clave: opciones.pop(clave, []) for clave in ('progress_hooks', 'postprocessor_hooks', 'post_hooks')}
+        params = copy.deepcopy(sesion.params_base)
+        params.update(opciones)
+        if params.get('overwrites') is not None:
+            params['nooverwrites'] = not params['overwrites']
+        sesion.params = params
+        sesion._parse_outtmpl()
+        formato = params.get('format')
+        sesion.format_selector = (formato if formato in (None, '-') or callable(formato)
+                                  else sesion.build_format_selector(formato))
+        sesion._progress_hooks = list(ganchos['progress_hooks'])
+        sesion._postprocessor_hooks = list(ganchos['postprocessor_hooks'])
+        sesion._post_hooks = list(ganchos['post_hooks'])
+        sesion._pps = {clave: [] for clave in sesion._pps}
+        for definicion in params.get('postprocessors', []):
+            definicion = dict(definicion)
+            when = definicion.pop('when', 'post_process')
+            postprocesador = cargar_yt_dlp().postprocessor.get_postprocessor(definicion.pop('key'))
+            sesion.add_post_processor(postprocesador(sesion, **definicion), when=when)
+        sesion._printed_messages = set()
+        sesion._download_retcode = 0
+        sesion._num_downloads = 0
+        sesion._num_videos = 0
+        sesion._playlist_level = 0
+        sesion._playlist_urls = set()
+        sesion.diferidos = []
+
+def crear_postprocesador(funcion):
+    # yt-dlp PostProcessor that calls `funcion(info)` at the stage it is added to
+    class Llamada(cargar_yt_dlp().postprocessor.PostProcessor):
+        def run(self, info):
+            funcion(info)
+            return [], info
+    return Llamada()
+
+@functools.lru_cache(maxsize=256)
+def identificar_url(url: str):
+    # (extractor, video id) from the URL alone, without network access, the same
+    # way yt-dlp checks its download archive; short links and unknown sites
+    # (handled by the generic extractor) return None
+    for extractor in cargar_yt_dlp().extractor.gen_extractor_classes():
+        if extractor.ie_key() == 'Generic' or not extractor.suitable(url):
+            continue
+        video_id = extractor.get_temp_id(url)
+        return (extractor.ie_key(), video_id) if video_id else None
+    return None
+
+class PerfilArranque:
+    # Startup timing report. Sequential stages are closed with `marcar`
+    # (time since the previous mark), background ones with `registrar`. Once
+    # every expected stage is in, the report is logged and appended to a
+    # JSON-lines history so regressions show up across runs.
+    def __init__(self, etapas, inicio: float = None):
+        self.esperadas = list(etapas)
+        self.inicio = inicio if inicio is not None else time.perf_counter()
+        self.etapas = OrderedDict()
+        self.ruta = None
+        self._ultimo = self.inicio
+        self._guardado = False
+        self._lock = threading.Lock()
+
+    @property
+    def completo(self) -> bool:
+        return all(etapa in self.etapas for etapa in self.esperadas)
+
+    def marcar(self, etapa: str):
+        ahora = time.perf_counter()
+        with self._lock:
+            if etapa in self.etapas:
+                return
+            self.etapas[etapa] = ahora - self._ultimo
+            self._ultimo = ahora
+        self._finalizar()
+
+    def registrar(self, etapa: str, segundos: float):
+        with self._lock:
+            if etapa in self.etapas:
+                return
+            self.etapas[etapa] = segundos
+        self._finalizar()
+
+    def resumen(self) -> str:
+        with self._lock:
+            return " • ".join(f"{etapa}: {segundos * 1000:.0f} ms" for etapa, segundos in self.etapas.items())
+
+    def _finalizar(self):
+        if not self.completo:
+            return
+        with self._lock:
+            if self._guardado:
+                return
+            self._guardado = True
+            datos = {'instante': time.time(), **{e: round(s, 4) for e, s in self.etapas.items()}}
+        logging.info(f"Arranque: {self.resumen()}")
+        if self.ruta:
+            try:
+                with open(self.ruta, "a", encoding="utf-8") as archivo:
+                    archivo.write(json.dumps(datos) + "\n")
+            except OSError as ex:
+                logging.warning(f"No se pudo guardar el perfil de arranque: {ex}")
+
+# Download job states
+ESTADO_EN_COLA = "en_cola"
+ESTADO_DESCARGANDO = "descargando"
+ESTADO_PROCESANDO = "procesando"  # Waiting for or running merge/remux/fixups
+ESTADO_PAUSADO = "pausado"        # Stopped by the user; .part files are kept for resuming
+ESTADO_COMPLETADO = "completado"
+ESTADO_FALLIDO = "fallido"
+ESTADO_CANCELADO = "cancelado"
+ESTADOS_TERMINADOS = (ESTADO_COMPLETADO, ESTADO_FALLIDO, ESTADO_CANCELADO)
+ESTADOS = (ESTADO_EN_COLA, ESTADO_DESCARGANDO, ESTADO_PROCESANDO, ESTADO_PAUSADO) + ESTADOS_TERMINADOS
+
+# Job priorities: queued jobs start in priority order, and running ones split
+# the bandwidth limit by these weights (see LimitadorAncho)
+PRIORIDAD_ALTA = "alta"
+PRIORIDAD_NORMAL = "normal"
+PRIORIDAD_BAJA = "baja"
+PRIORIDADES = {PRIORIDAD_ALTA: 4, PRIORIDAD_NORMAL: 2, PRIORIDAD_BAJA: 1}
+
+TRABAJADORES_POR_DEFECTO = 3
+MAX_TRABAJADORES = 8
+POSTPROCESADORES = os.cpu_count() or 1  # ffmpeg merges run on their own pool
+
+# Playlist mode: entries queued ahead of the running downloads (this also
+# bounds metadata prefetching, which must stay within the metadata cache)
+ADELANTO_LISTA = 50
+RESOLUTORES_METADATOS = 4
+
+# Jobs held back for lack of resources are retried when another job ends,
+# or after this many seconds (space may have been freed by hand)
+REVISION_RETENIDOS = 30
+
+# Finished jobs kept in the queue (for the summary and for sessions that open
+# later); older ones are dropped as new ones finish
+HISTORIAL_TERMINADOS = 200
+
+# Without a folder watcher, files edited in place (which leaves the folder
+# mtime alone) are picked up by a full library scan this often
+REVISION_BIBLIOTECA = 2 * 60
+
+# Downloads are staged in this subfolder of the library (same filesystem, so
+# the final move is a rename) and the scheduler keeps this much space free
+CARPETA_TEMPORAL = ".descargando"
+MARGEN_ESPACIO = 256 << 20
+
+# Output templates end with the extension field; a clashing name gets " (n)" before it
+SUFIJO_PLANTILLA = ".%(ext)s"
+
+# UI refresh rate for download progress (frames per second)
+FRECUENCIA_POR_DEFECTO = 6
+FRECUENCIAS_DISPONIBLES = [2, 4, 6, 8, 10]
+
+class TrabajoDescarga:
+    _ids = itertools.count(1)
+
+    def __init__(self, url: str, nombre: str, opciones: dict = None, id: int = None):
+        self.id = id if id is not None else next(self._ids)
+        self.url = url
+        self.nombre = nombre
+        self.opciones = opciones or {}  # JSON-serializable yt-dlp options
+        self.reanudado = False
+        self.prioridad = PRIORIDAD_NORMAL
+        self.solicitudes = 1   # Identical requests attached to this job (see MotorDescargas.agregar)
+        # Transfer measurements collected from yt-dlp hooks and log messages
+        self.reiniciar_medidas()
+        self.metricas = None   # Telemetry record of the last attempt
+        self.estado = ESTADO_EN_COLA
+        self.reintentos = 0
+        self.progreso = 0.0
+        self.velocidad = None  # bytes/s reported by yt-dlp
+        self.eta = None
+        self.detalle = ""
+        self.error = None
+        self.archivos = []     # Final file paths once completed
+        self.duplicado = None  # Existing library file when the video was already downloaded
+        self.conflicto_nombre = False  # ...or when only its name was taken (see MotorDescargas.reservar_nombre)
+        self.lista = None      # ListaDescarga this job came from, if any
+        self.interrupcion = None  # State requested while running (paused, cancelled, back to the queue)
+        self.temporales = set()   # Partial and intermediate files, removed on cancel
+
+    def reiniciar_medidas(self):
+        # Measurements are per attempt; retries start from zero
+        self.bytes_descargados = 0     # Transferred in this attempt
+        self.bytes_escritos = 0        # On disk, including resumed .part data and the stream still downloading
+        self.flujos = {}               # Stream file -> (bytes it had when first reported, bytes now)
+        self.segundos_descarga = 0.0
+        self.fragmentos = 0
+        self.errores_red = 0
+        self.reintentos_fragmento = 0
+        self.segundos_extraccion = 0.0
+        self.segundos_primer_byte = None
+        self.segundos_limitado = 0.0   # Held back by the bandwidth limit
+        self.segundos_postproceso = 0.0
+        self.segundos_total = 0.0
+        self.velocidad_maxima = None
+        self.metadatos_en_cache = False
+        self.inicio_descarga = None
+        self.inicio_postproceso = None
+
+class ListaDescarga:
+    # A playlist or channel whose entries are streamed into the queue while
+    # it is still being enumerated
+    _ids = itertools.count(1)
+
+    def __init__(self, url: str, rango: str = None, filtro: str = None, prioridad: str = PRIORIDAD_NORMAL):
+        self.id = next(self._ids)
+        self.url = url
+        self.rango = rango     # yt-dlp playlist_items syntax, e.g. "1-50,60"
+        self.filtro = filtro   # yt-dlp match filter, e.g. "duration > 60"
+        self.prioridad = prioridad  # Given to every entry
+        self.titulo = None
+        self.total = None      # playlist_count, when the site reports it
+        self.trabajos = []
+        self.omitidos = 0      # Entries already in the download archive or in the queue
+        self.enumerando = True
+        self.cancelada = False
+        self.error = None
+        self._tareas = 0       # Enumerations still running (root plus nested playlists)
+        self._cond = threading.Condition()
+
+    def agregar(self, trabajo: TrabajoDescarga):
+        with self._cond:
+            self.trabajos.append(trabajo)
+
+    def progreso(self) -> float:
+        # Over the entries found so far; finished ones (failed too) count as done
+        with self._cond:
+            trabajos = list(self.trabajos)
+        if not trabajos:
+            return 0.0
+        hechos = sum(1.0 if t.estado in ESTADOS_TERMINADOS else t.progreso for t in trabajos)
+        return hechos / len(trabajos)
+
+    def resumen(self) -> dict:
+        with self._cond:
+            conteo = dict.fromkeys(ESTADOS, 0)
+            for t in self.trabajos:
+                conteo[t.estado] += 1
+        return conteo
+
+    @property
+    def activa(self) -> bool:
+        # Still being enumerated or with entries left to finish
+        conteo = self.resumen()
+        return self.enumerando or any(conteo[estado] for estado in ESTADOS if estado not in ESTADOS_TERMINADOS)
+
+    def esperar_hueco(self) -> bool:
+        # Backpressure for the enumerator: keep at most ADELANTO_LISTA entries
+        # waiting. False once the list has been cancelled.
+        with self._cond:
+            self._cond.wait_for(lambda: self.cancelada or
+                                sum(1 for t in self.trabajos if t.estado == ESTADO_EN_COLA) < ADELANTO_LISTA)
+            return not self.cancelada
+
+    def cancelar(self):
+        with self._cond:
+            self.cancelada = True
+            self._cond.notify_all()
+
+    def notificar(self):
+        with self._cond:
+            self._cond.notify_all()
+
+class ColaDescargas:
+    # Download queue served by a bounded pool of worker threads, and the single
+    # supervisor of every job: pausing, cancelling and shutting down all go
+    # through it. `ejecutar(trabajo)` performs the download and raises on
+    # failure; `on_cambio(trabajo)` is called from the worker threads on every
+    # state change.
+    def __init__(self, ejecutar, trabajadores: int = TRABAJADORES_POR_DEFECTO, max_reintentos: int = 2,
+                 on_cambio=None, diario=None, postprocesadores: int = POSTPROCESADORES):
+        # `ejecutar(trabajo)` may return a callable with CPU-bound work left
+        # (merges, remuxes); it runs on a separate pool so the download worker
+        # can start the next job right away
+        self.ejecutar = ejecutar
+        self.max_reintentos = max_reintentos
+        self.on_cambio = on_cambio
+        self.diario = diario
+        self._ids = diario.ids if diario else itertools.count(1)
+        self.trabajos = []
+        self._pendientes = deque()
+        self._retenidos = []   # Jobs that raised TrabajoRetenido, waiting for a re-check
+        self._revision = time.monotonic()
+        self._cond = threading.Condition()
+        self._en_ejecucion = 0
+        self._en_postproceso = 0
+        self._postproceso = ThreadPoolExecutor(postprocesadores, thread_name_prefix="postproceso")
+        self._vivos = 0
+        self._objetivo = 0
+        self._cerrada = False
+        self.set_trabajadores(trabajadores)
+
+    @property
+    def trabajadores(self) -> int:
+        return self._objetivo
+
+    def set_trabajadores(self, n: int):
+        # Grow the pool right away; surplus workers exit once they go idle
+        with self._cond:
+            self._objetivo = max(1, int(n))
+            while self._vivos < self._objetivo and not self._cerrada:
+                self._vivos += 1
+                threading.Thread(target=self._bucle, daemon=True).start()
+            self._cond.notify_all()
+
+    def agregar(self, url: str, nombre: str, opciones: dict = None, lista: ListaDescarga = None,
+                prioridad: str = PRIORIDAD_NORMAL) -> TrabajoDescarga:
+        trabajo = TrabajoDescarga(url, nombre, opciones, id=next(self._ids))
+        trabajo.prioridad = prioridad
+        if lista:
+            trabajo.lista = lista
+            lista.agregar(trabajo)
+        if self.diario:
+            self.diario.registrar(trabajo)
+        return self._encolar(trabajo)
+
+    def restaurar(self, trabajo: TrabajoDescarga) -> TrabajoDescarga:
+        # Re-queue a job recovered from the journal after a restart; paused
+        # jobs come back paused
+        trabajo.reanudado = True
+        if trabajo.estado == ESTADO_PAUSADO:
+            with self._cond:
+                self.trabajos.append(trabajo)
+            self._notificar(trabajo)
+            return trabajo
+        trabajo.estado = ESTADO_EN_COLA
+        return self._encolar(trabajo)
+
+    def _encolar(self, trabajo: TrabajoDescarga) -> TrabajoDescarga:
+        with self._cond:
+            self.trabajos.append(trabajo)
+            self._pendientes.append(trabajo)
+            self._cond.notify()
+        self._notificar(trabajo)
+        return trabajo
+
+    def reintentar(self, trabajo: TrabajoDescarga):
+        with self._cond:
+            if trabajo.estado not in (ESTADO_FALLIDO, ESTADO_CANCELADO):
+                return
+            trabajo.estado = ESTADO_EN_COLA
+            trabajo.error = None
+            trabajo.progreso = 0.0
+            trabajo.reintentos = 0
+            if trabajo not in self.trabajos:
+                # Dropped from the finished history meanwhile
+                self.trabajos.append(trabajo)
+            self._pendientes.append(trabajo)
+            self._cond.notify()
+        self._notificar(trabajo)
+
+    def pausar(self, trabajo: TrabajoDescarga):
+        # A running download is stopped from its next progress hook; merges
+        # already handed to the post-processing pool are left to finish
+        with self._cond:
+            if trabajo.estado == ESTADO_DESCARGANDO:
+                trabajo.interrupcion = ESTADO_PAUSADO
+                return
+            if trabajo.estado != ESTADO_EN_COLA:
+                return
+            self._quitar_de_espera(trabajo)
+            trabajo.estado = ESTADO_PAUSADO
+        self._notificar(trabajo)
+
+    def reanudar(self, trabajo: TrabajoDescarga):
+        with self._cond:
+            if trabajo.estado != ESTADO_PAUSADO:
+                return
+            trabajo.estado = ESTADO_EN_COLA
+            self._pendientes.append(trabajo)
+            self._cond.notify()
+        self._notificar(trabajo)
+
+    def priorizar(self, trabajo: TrabajoDescarga, prioridad: str):
+        # Takes effect on the queue order and, for running jobs, on their
+        # bandwidth share from the next block on
+        if prioridad not in PRIORIDADES:
+            raise ValueError(f"Prioridad desconocida: {prioridad}")
+        with self._cond:
+            trabajo.prioridad = prioridad
+        if self.diario:
+            try:
+                self.diario.priorizar(trabajo)
+            except Exception as ex:
+                logging.error(f"No se pudo registrar el trabajo {trabajo.id} en el diario: {ex}")
+        if self.on_cambio:
+            self.on_cambio(trabajo)
+
+    def cancelar(self, trabajo: TrabajoDescarga) -> bool:
+        # True when the job was cancelled right away; running ones are
+        # cancelled by their worker, which also removes their partial files
+        with self._cond:
+            if trabajo.estado in (ESTADO_DESCARGANDO, ESTADO_PROCESANDO):
+                trabajo.interrupcion = ESTADO_CANCELADO
+                return False
+            if trabajo.estado not in (ESTADO_EN_COLA, ESTADO_PAUSADO):
+                return False
+            self._quitar_de_espera(trabajo)
+            trabajo.estado = ESTADO_CANCELADO
+        self._notificar(trabajo)
+        return True
+
+    def _quitar_de_espera(self, trabajo: TrabajoDescarga):
+        if trabajo in self._pendientes:
+            self._pendientes.remove(trabajo)
+        elif trabajo in self._retenidos:
+            self._retenidos.remove(trabajo)
+
+    def _revisar_retenidos(self, forzar: bool = False):
+        # Called with the lock held: held-back jobs go back to the queue once
+        # another job has ended or REVISION_RETENIDOS has elapsed
+        if self._retenidos and (forzar or time.monotonic() - self._revision >= REVISION_RETENIDOS):
+            self._pendientes.extend(self._retenidos)
+            self._retenidos.clear()
+            self._cond.notify_all()
+        if forzar or not self._retenidos:
+            self._revision = time.monotonic()
+
+    def quitar_terminados(self):
+        with self._cond:
+            terminados = [t for t in self.trabajos if t.estado in ESTADOS_TERMINADOS]
+            self.trabajos = [t for t in self.trabajos if t not in terminados]
+        return terminados
+
+    def _podar(self):
+        # Keeps the last HISTORIAL_TERMINADOS finished jobs; the engine is
+        # shared by every session and lives as long as the process
+        with self._cond:
+            terminados = [t for t in self.trabajos if t.estado in ESTADOS_TERMINADOS]
+            if len(terminados) > HISTORIAL_TERMINADOS:
+                sobrantes = set(map(id, terminados[:-HISTORIAL_TERMINADOS]))
+                self.trabajos = [t for t in self.trabajos if id(t) not in sobrantes]
+
+    def resumen(self) -> dict:
+        with self._cond:
+            conteo = dict.fromkeys(ESTADOS, 0)
+            for t in self.trabajos:
+                conteo[t.estado] += 1
+        return conteo
+
+    def _siguiente(self):
+        with self._cond:
+            while not self._pendientes and self._vivos <= self._objetivo and not self._cerrada:
+                self._cond.wait(REVISION_RETENIDOS if self._retenidos else None)
+                self._revisar_retenidos()
+            if self._vivos > self._objetivo or self._cerrada:
+                self._vivos -= 1
+                return None
+            # Highest priority first, in arrival order within a priority
+            trabajo = max(self._pendientes, key=lambda t: PRIORIDADES[t.prioridad])
+            self._pendientes.remove(trabajo)
+            trabajo.estado = ESTADO_DESCARGANDO
+            self._en_ejecucion += 1
+            return trabajo
+
+    def _bucle(self):
+        while True:
+            trabajo = self._siguiente()
+            if trabajo is None:
+                return
+            self._notificar(trabajo)
+            try:
+                continuacion = self.ejecutar(trabajo)
+            except Exception as ex:
+                self._fallo(trabajo, ex)
+            else:
+                if continuacion is None:
+                    self._completar(trabajo)
+                else:
+                    with self._cond:
+                        trabajo.estado = ESTADO_PROCESANDO
+                        if trabajo.interrupcion == ESTADO_PAUSADO:
+                            # Too late to pause: the streams are already downloaded
+                            trabajo.interrupcion = None
+                        self._en_postproceso += 1
+                    self._postproceso.submit(self._postprocesar, trabajo, continuacion)
+            self._notificar(trabajo)
+            with self._cond:
+                self._en_ejecucion -= 1
+                self._cond.notify_all()
+
+    def _postprocesar(self, trabajo: TrabajoDescarga, continuacion):
+        try:
+            continuacion()
+        except Exception as ex:
+            self._fallo(trabajo, ex)
+        else:
+            self._completar(trabajo)
+        self._notificar(trabajo)
+        with self._cond:
+            self._en_postproceso -= 1
+            self._cond.notify_all()
+
+    def _completar(self, trabajo: TrabajoDescarga):
+        # A pause or cancel that arrived after the last byte is dropped
+        trabajo.interrupcion = None
+        trabajo.estado = ESTADO_COMPLETADO
+        trabajo.progreso = 1.0
+        with self._cond:
+            self._revisar_retenidos(forzar=True)
+
+    def _fallo(self, trabajo: TrabajoDescarga, ex: Exception):
+        with self._cond:
+            if isinstance(ex, TrabajoRetenido) and not trabajo.interrupcion and not self._cerrada:
+                trabajo.estado = ESTADO_EN_COLA
+                trabajo.detalle = str(ex)
+                self._retenidos.append(trabajo)
+                return
+            # Whatever stopped this job may have freed resources for held-back ones
+            self._revisar_retenidos(forzar=True)
+            if trabajo.interrupcion:
+                # Stopped on request: no retry, and not an error
+                trabajo.estado = trabajo.interrupcion
+                trabajo.interrupcion = None
+                return
+        logging.warning(f"Descarga {trabajo.id} falló (intento {trabajo.reintentos + 1}): {ex}")
+        with self._cond:
+            trabajo.error = ex
+            if trabajo.reintentos < self.max_reintentos and not self._cerrada:
+                trabajo.reintentos += 1
+                trabajo.estado = ESTADO_EN_COLA
+                self._pendientes.append(trabajo)
+                self._cond.notify()
+            else:
+                trabajo.estado = ESTADO_FALLIDO
+
+    def esperar(self, timeout: float = None) -> bool:
+        # Blocks until nothing is queued, running or post-processing; False on timeout
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: (self._cerrada or not (self._pendientes or self._retenidos))
+                and not self._en_ejecucion and not self._en_postproceso,
+                timeout)
+
+    def cerrar(self, timeout: float = None) -> bool:
+        # Clean shutdown: no new job starts, running downloads are stopped and
+        # go back to the queue state, so the journal resumes them from their
+        # .part files on the next start. Merges already running are waited for.
+        # False if some worker was still busy when the timeout expired.
+        with self._cond:
+            self._cerrada = True
+            for trabajo in self.trabajos:
+                if trabajo.estado in (ESTADO_DESCARGANDO, ESTADO_PROCESANDO) and not trabajo.interrupcion:
+                    trabajo.interrupcion = ESTADO_EN_COLA
+            self._cond.notify_all()
+        terminado = self.esperar(timeout)
+        self._postproceso.shutdown(wait=False, cancel_futures=True)
+        return terminado
+
+    def _notificar(self, trabajo: TrabajoDescarga):
+        # Every call is a state transition; persist it before telling the UI
+        if self.diario:
+            try:
+                self.diario.transicion(trabajo)
+            except Exception as ex:
+                logging.error(f"No se pudo registrar el trabajo {trabajo.id} en el diario: {ex}")
+        if self.on_cambio:
+            try:
+                self.on_cambio(trabajo)
+            except Exception as ex:
+                logging.error(f"Error al notificar el trabajo {trabajo.id}: {ex}")
+        if trabajo.estado in ESTADOS_TERMINADOS:
+            self._podar()
+
+class DiarioDescargas:
+    # Persistent journal of download jobs and their state transitions. Jobs
+    # still queued or running when the app exits are returned by `pendientes`
+    # so they can be resumed from their .part files on the next start.
+    DIAS_HISTORIAL = 30
+
+    def __init__(self, ruta_db: Path):
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(str(ruta_db), check_same_thread=False)
+        # WAL + NORMAL survives an application crash without an fsync per transition
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute("PRAGMA synchronous=NORMAL")
+        with self._conexion:
+            self._conexion.executescript("""
+                CREATE TABLE IF NOT EXISTS trabajos (
+                    id INTEGER PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    nombre TEXT NOT NULL,
+                    plantilla TEXT,
+                    opciones TEXT NOT NULL,
+                    estado TEXT NOT NULL,
+                    reintentos INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    creado REAL NOT NULL,
+                    actualizado REAL NOT NULL,
+                    prioridad TEXT NOT NULL DEFAULT 'normal'
+                );
+                CREATE TABLE IF NOT EXISTS transiciones (
+                    trabajo_id INTEGER NOT NULL REFERENCES trabajos (id) ON DELETE CASCADE,
+                    estado TEXT NOT NULL,
+                    instante REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS transiciones_trabajo ON transiciones (trabajo_id);
+            """)
+            self._conexion.execute("PRAGMA foreign_keys = ON")
+            # Journals created before job priorities existed
+            columnas = {fila[1] for fila in self._conexion.execute("PRAGMA table_info(trabajos)")}
+            if 'prioridad' not in columnas:
+                self._conexion.execute("ALTER TABLE trabajos ADD COLUMN prioridad TEXT NOT NULL DEFAULT 'normal'")
+            limite = time.time() - self.DIAS_HISTORIAL * 86400
+            self._conexion.execute(
+                "DELETE FROM trabajos WHERE estado IN (?, ?, ?) AND actualizado < ?",
+                ESTADOS_TERMINADOS + (limite,)
+            )
+        # Job ids stay unique across restarts; ColaDescargas numbers its jobs from here
+        ultimo = self._conexion.execute("SELECT MAX(id) FROM trabajos").fetchone()[0] or 0
+        self.ids = itertools.count(ultimo + 1)
+
+    def registrar(self, trabajo: TrabajoDescarga):
+        ahora = time.time()
+        with self._lock, self._conexion:
+            self._conexion.execute(
+                """INSERT INTO trabajos (id, url, nombre, plantilla, opciones, estado, prioridad, creado, actualizado)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (trabajo.id, trabajo.url, trabajo.nombre, trabajo.opciones.get('outtmpl'),
+                 json.dumps(trabajo.opciones), trabajo.estado, trabajo.prioridad, ahora, ahora)
+            )
+
+    def guardar_opciones(self, trabajo: TrabajoDescarga):
+        with self._lock, self._conexion:
+            self._conexion.execute(
+                "UPDATE trabajos SET plantilla = ?, opciones = ? WHERE id = ?",
+                (trabajo.opciones.get('outtmpl'), json.dumps(trabajo.opciones), trabajo.id)
+            )
+
+    def priorizar(self, trabajo: TrabajoDescarga):
+        with self._lock, self._conexion:
+            self._conexion.execute("UPDATE trabajos SET prioridad = ? WHERE id = ?", (trabajo.prioridad, trabajo.id))
+
+    def transicion(self, trabajo: TrabajoDescarga):
+        ahora = time.time()
+        error = str(trabajo.error) if trabajo.error else None
+        with self._lock, self._conexion:
+            self._conexion.execute(
+                "UPDATE trabajos SET estado = ?, reintentos = ?, error = ?, actualizado = ? WHERE id = ?",
+                (trabajo.estado, trabajo.reintentos, error, ahora, trabajo.id)
+            )
+            self._conexion.execute(
+                "INSERT INTO transiciones (trabajo_id, estado, instante) VALUES (?, ?, ?)",
+                (trabajo.id, trabajo.estado, ahora)
+            )
+
+    def pendientes(self):
+        # Jobs interrupted by a crash or by closing the app, and paused ones, oldest first
+        with self._lock:
+            filas = self._conexion.execute(
+                "SELECT id, url, nombre, opciones, estado, reintentos, prioridad FROM trabajos "
+                "WHERE estado IN (?, ?, ?, ?) ORDER BY id",
+                (ESTADO_EN_COLA, ESTADO_DESCARGANDO, ESTADO_PROCESANDO, ESTADO_PAUSADO)
+            ).fetchall()
+        trabajos = []
+        for id, url, nombre, opciones, estado, reintentos, prioridad in filas:
+            trabajo = TrabajoDescarga(url, nombre, json.loads(opciones), id=id)
+            trabajo.estado = estado
+            trabajo.reintentos = reintentos
+            trabajo.prioridad = prioridad if prioridad in PRIORIDADES else PRIORIDAD_NORMAL
+            trabajos.append(trabajo)
+        return trabajos
+
+class AjusteDescargas:
+    # Chooses per-job transfer parameters (concurrent fragment downloads, HTTP
+    # chunk size, read buffer) and adapts them from measured throughput and
+    # error rates: fragment concurrency hill-climbs while throughput keeps up
+    # and is halved when fragments start failing.
+    MIN_FRAGMENTOS = 1
+    MAX_FRAGMENTOS = 16
+    MIN_CHUNK = 1 << 20
+    MAX_CHUNK = 64 << 20
+    MIN_BUFFER = 16 << 10
+    MAX_BUFFER = 1 << 20
+    TASA_ERRORES_MAXIMA = 0.05  # Failed fragment attempts per fragment
+    SEGUNDOS_POR_CHUNK = 5
+
+    def __init__(self, ruta: Path = None):
+        self.ruta = ruta
+        self.fragmentos = 4
+        self.chunk = 10 << 20
+        self.buffer = 64 << 10
+        self.velocidad = None     # EWMA of observed throughput (bytes/s)
+        self.referencia = None    # Throughput of the last fragmented job
+        self._lock = threading.Lock()
+        self._cargar()
+
+    def parametros(self) -> dict:
+        with self._lock:
+            return {
+                'concurrent_fragment_downloads': self.fragmentos,
+                'http_chunk_size': self.chunk,
+                'buffersize': self.buffer,
+            }
+
+    def registrar(self, bytes_descargados: int, segundos: float, fragmentos: int, errores: int):
+        # Called after every job, including failed ones (their errors still count)
+        velocidad = bytes_descargados / segundos if segundos > 0 and bytes_descargados > 0 else None
+        if velocidad is None and not fragmentos:
+            return
+        with self._lock:
+            if velocidad is not None:
+                self.velocidad = velocidad if self.velocidad is None else 0.7 * self.velocidad + 0.3 * velocidad
+                # A few seconds of data per HTTP range request, rounded to whole MiB
+                chunk = int(self.velocidad * self.SEGUNDOS_POR_CHUNK) & ~((1 << 20) - 1)
+                self.chunk = min(max(chunk, self.MIN_CHUNK), self.MAX_CHUNK)
+                # About 1/16 s of data per read, as a power of two
+                buffer = 1 << max(int(self.velocidad / 16).bit_length() - 1, 0)
+                self.buffer = min(max(buffer, self.MIN_BUFFER), self.MAX_BUFFER)
+            if fragmentos:
+                if errores / fragmentos > self.TASA_ERRORES_MAXIMA:
+                    self.fragmentos = max(self.MIN_FRAGMENTOS, self.fragmentos // 2)
+                elif velocidad is None:
+                    pass
+                elif self.referencia is None or velocidad >= self.referencia * 0.9:
+                    self.fragmentos = min(self.MAX_FRAGMENTOS, self.fragmentos + 1)
+                else:
+                    # The last step up did not pay off
+                    self.fragmentos = max(self.MIN_FRAGMENTOS, self.fragmentos - 1)
+                if velocidad is not None:
+                    self.referencia = velocidad
+        logging.info(f"Ajuste de descargas: {self.parametros()}")
+        self._guardar()
+
+    def _cargar(self):
+        if not self.ruta or not self.ruta.exists():
+            return
+        try:
+            datos = json.loads(self.ruta.read_text())
+            self.fragmentos = int(datos['fragmentos'])
+            self.chunk = int(datos['chunk'])
+            self.buffer = int(datos['buffer'])
+            self.velocidad = datos.get('velocidad')
+        except (ValueError, KeyError, TypeError) as ex:
+            logging.warning(f"No se pudo leer el ajuste de descargas: {ex}")
+
+    def _guardar(self):
+        if not self.ruta:
+            return
+        with self._lock:
+            datos = {'fragmentos': self.fragmentos, 'chunk': self.chunk,
+                     'buffer': self.buffer, 'velocidad': self.velocidad}
+        try:
+            self.ruta.write_text(json.dumps(datos))
+        except OSError as ex:
+            logging.warning(f"No se pudo guardar el ajuste de descargas: {ex}")
+
+class RegistroYtDlp:
+    # yt-dlp logger for a single job: routes output to logging and counts
+    # the network errors yt-dlp retries ("Got error: ... Retrying")
+    def __init__(self, trabajo: TrabajoDescarga):
+        self.trabajo = trabajo
+
+    def debug(self, mensaje):
+        if mensaje.startswith('[download] Got error'):
+            self.trabajo.errores_red += 1
+            if 'Retrying fragment' in mensaje:
+                self.trabajo.reintentos_fragmento += 1
+        logging.debug(mensaje)
+
+    def info(self, mensaje):
+        logging.info(mensaje)
+
+    def warning(self, mensaje):
+        logging.debug(mensaje) if self.trabajo.interrupcion else logging.warning(mensaje)
+
+    def error(self, mensaje):
+        # Fragment threads still running when a download is stopped report
+        # the interruption as errors
+        logging.debug(mensaje) if self.trabajo.interrupcion else logging.error(mensaje)
+
+# Per-download telemetry
+HISTORIAL_TELEMETRIA = 500
+LIMITE_TELEMETRIA = 10 << 20  # The JSON-lines log is rotated past this size
+
+def _etiquetas_prometheus(**etiquetas) -> str:
+    valores = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in etiquetas.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(etiquetas, valores)) + "}"
+
+class TelemetriaDescargas:
+    # Records one structured entry per download attempt (phase timings,
+    # throughput, retries, site and format), appends it to a JSON-lines log
+    # and rewrites a Prometheus textfile with per site/protocol totals. The
+    # in-memory history behind the Configuración panel is seeded lazily from
+    # the tail of the log.
+    FASES = ['extraccion', 'primer_byte', 'descarga', 'postproceso', 'total']
+
+    def __init__(self, ruta_log: Path = None, ruta_prometheus: Path = None, historial: int = HISTORIAL_TELEMETRIA):
+        self.ruta_log = ruta_log
+        self.ruta_prometheus = ruta_prometheus
+        self.version = 0  # Bumped on every record so views know when to redraw
+        self._capacidad = historial
+        self._historial = None
+        self._totales = defaultdict(lambda: defaultdict(float))  # (sitio, protocolo) -> metric -> value
+        self._lock = threading.Lock()
+
+    def registrar(self, trabajo: TrabajoDescarga, info: dict = None, error: Exception = None) -> dict:
+        info = info or {}
+        velocidad_media = None
+        if trabajo.segundos_descarga > 0 and trabajo.bytes_descargados > 0:
+            velocidad_media = trabajo.bytes_descargados / trabajo.segundos_descarga
+        registro = {
+            'instante': round(time.time(), 3),
+            'id': trabajo.id,
+            'url': trabajo.url,
+            'dominio': urllib.parse.urlsplit(trabajo.url).hostname,
+            'sitio': info.get('extractor_key') or 'desconocido',
+            'formato': info.get('format_id'),
+            'protocolo': info.get('protocol'),
+            'ext': info.get('ext'),
+            'resultado': 'error' if error else 'duplicado' if trabajo.duplicado else 'completado',
+            'intento': trabajo.reintentos + 1,
+            'metadatos_en_cache': trabajo.metadatos_en_cache,
+            'segundos_extraccion': round(trabajo.segundos_extraccion, 4),
+            'segundos_primer_byte': None if trabajo.segundos_primer_byte is None else round(trabajo.segundos_primer_byte, 4),
+            'segundos_descarga': round(trabajo.segundos_descarga, 4),
+            'segundos_limitado': round(trabajo.segundos_limitado, 4),
+            'segundos_postproceso': round(trabajo.segundos_postproceso, 4),
+            'segundos_total': round(trabajo.segundos_total, 4),
+            'bytes': trabajo.bytes_descargados,
+            'velocidad_media': None if velocidad_media is None else round(velocidad_media),
+            'velocidad_maxima': None if trabajo.velocidad_maxima is None else round(trabajo.velocidad_maxima),
+            'fragmentos': trabajo.fragmentos,
+            'reintentos_fragmento': trabajo.reintentos_fragmento,
+            'errores_red': trabajo.errores_red,
+            'error': str(error)[:300] if error else None,
+        }
+        with self._lock:
+            self._cargar_historial()
+            self._historial.append(registro)
+            totales = self._totales[(registro['sitio'], registro['protocolo'] or 'desconocido')]
+            totales[registro['resultado']] += 1
+            totales['bytes'] += registro['bytes']
+            totales['reintentos_fragmento'] += registro['reintentos_fragmento']
+            for fase in self.FASES:
+                if registro[f'segundos_{fase}'] is not None:
+                    totales[f'{fase}_suma'] += registro[f'segundos_{fase}']
+                    totales[f'{fase}_cuenta'] += 1
+            if registro['velocidad_maxima']:
+                totales['velocidad_maxima'] = max(totales['velocidad_maxima'], registro['velocidad_maxima'])
+            self.version += 1
+            self._escribir_log(registro)
+            self._escribir_prometheus()
+        return registro
+
+    def historial(self, limite: int = None):
+        # Most recent attempts first
+        with self._lock:
+            self._cargar_historial()
+            registros = list(self._historial)
+        registros.reverse()
+        return registros[:limite] if limite else registros
+
+    def resumen_por_sitio(self):
+        # Averages over the in-memory history, busiest sites first
+        sitios = defaultdict(lambda: defaultdict(list))
+        for registro in self.historial():
+            datos = sitios[registro['sitio']]
+            datos['resultado'].append(registro['resultado'])
+            for clave in ('velocidad_media', 'segundos_primer_byte', 'segundos_extraccion',
+                          'segundos_postproceso', 'segundos_total'):
+                if registro.get(clave) is not None:
+                    datos[clave].append(registro[clave])
+        resumen = []
+        for sitio, datos in sitios.items():
+            fila = {
+                'sitio': sitio,
+                'intentos': len(datos['resultado']),
+                'fallos': datos['resultado'].count('error'),
+            }
+            for clave, valores in datos.items():
+                if clave != 'resultado':
+                    fila[clave] = sum(valores) / len(valores)
+            resumen.append(fila)
+        resumen.sort(key=lambda fila: fila['intentos'], reverse=True)
+        return resumen
+
+    def _cargar_historial(self):
+        if self._historial is not None:
+            return
+        self._historial = deque(maxlen=self._capacidad)
+        if not self.ruta_log or not self.ruta_log.exists():
+            return
+        try:
+            with open(self.ruta_log, encoding="utf-8") as archivo:
+                lineas = deque(archivo, maxlen=self._capacidad)
+        except OSError as ex:
+            logging.warning(f"No se pudo leer la telemetría: {ex}")
+            return
+        for linea in lineas:
+            try:
+                self._historial.append(json.loads(linea))
+            except ValueError:
+                continue
+
+    def _escribir_log(self, registro: dict):
+        if not self.ruta_log:
+            return
+        try:
+            if self.ruta_log.exists() and self.ruta_log.stat().st_size > LIMITE_TELEMETRIA:
+                os.replace(self.ruta_log, self.ruta_log.with_name(self.ruta_log.name + ".1"))
+            with open(self.ruta_log, "a", encoding="utf-8") as archivo:
+                archivo.write(json.dumps(registro, ensure_ascii=False) + "\n")
+        except OSError as ex:
+            logging.warning(f"No se pudo guardar la telemetría: {ex}")
+
+    def _escribir_prometheus(self):
+        # Textfile-collector format; written to a temp file and renamed so a
+        # scrape never sees a partial file. Counters restart with the process.
+        if not self.ruta_prometheus:
+            return
+        lineas = [
+            "# HELP ydexplorer_descargas_total Download attempts by site, protocol and result.",
+            "# TYPE ydexplorer_descargas_total counter",
+        ]
+        for (sitio, protocolo), totales in self._totales.items():
+            for resultado in ('completado', 'duplicado', 'error'):
+                etiquetas = _etiquetas_prometheus(sitio=sitio, protocolo=protocolo, resultado=resultado)
+                lineas.append(f"ydexplorer_descargas_total{etiquetas} {totales[resultado]:.0f}")
+        lineas += [
+            "# HELP ydexplorer_descarga_bytes_total Bytes downloaded.",
+            "# TYPE ydexplorer_descarga_bytes_total counter",
+        ]
+        for (sitio, protocolo), totales in self._totales.items():
+            etiquetas = _etiquetas_prometheus(sitio=sitio, protocolo=protocolo)
+            lineas.append(f"ydexplorer_descarga_bytes_total{etiquetas} {totales['bytes']:.0f}")
+        lineas += [
+            "# HELP ydexplorer_descarga_fase_segundos Time spent per download phase.",
+            "# TYPE ydexplorer_descarga_fase_segundos summary",
+        ]
+        for (sitio, protocolo), totales in self._totales.items():
+            for fase in self.FASES:
+                etiquetas = _etiquetas_prometheus(sitio=sitio, protocolo=protocolo, fase=fase)
+                lineas.append(f"ydexplorer_descarga_fase_segundos_sum{etiquetas} {totales[f'{fase}_suma']:.4f}")
+                lineas.append(f"ydexplorer_descarga_fase_segundos_count{etiquetas} {totales[f'{fase}_cuenta']:.0f}")
+        lineas += [
+            "# HELP ydexplorer_reintentos_fragmento_total Fragment retries reported by yt-dlp.",
+            "# TYPE ydexplorer_reintentos_fragmento_total counter",
+        ]
+        for (sitio, protocolo), totales in self._totales.items():
+            etiquetas = _etiquetas_prometheus(sitio=sitio, protocolo=protocolo)
+            lineas.append(f"ydexplorer_reintentos_fragmento_total{etiquetas} {totales['reintentos_fragmento']:.0f}")
+        lineas += [
+            "# HELP ydexplorer_velocidad_maxima_bytes Peak throughput seen (bytes/s).",
+            "# TYPE ydexplorer_velocidad_maxima_bytes gauge",
+        ]
+        for (sitio, protocolo), totales in self._totales.items():
+            etiquetas = _etiquetas_prometheus(sitio=sitio, protocolo=protocolo)
+            lineas.append(f"ydexplorer_velocidad_maxima_bytes{etiquetas} {totales['velocidad_maxima']:.0f}")
+        temporal = self.ruta_prometheus.with_name(self.ruta_prometheus.name + ".tmp")
+        try:
+            temporal.write_text("\n".join(lineas) + "\n", encoding="utf-8")
+            os.replace(temporal, self.ruta_prometheus)
+        except OSError as ex:
+            logging.warning(f"No se pudieron exportar las métricas: {ex}")
+
+class AgregadorProgreso:
+    # Coalesces progress notifications and flushes them at a fixed frame rate.
+    # `marcar(clave, valor)` only records the latest value per key; a single
+    # background thread calls `renderizar(valor)` for every changed key and then
+    # `publicar()` once per frame, so N concurrent downloads cost one page.update.
+    # With `ejecutar`, each frame is handed over as a callable (e.g. to the UI
+    # event loop) and the next one waits until it has run.
+    def __init__(self, renderizar, publicar, hz: int = FRECUENCIA_POR_DEFECTO, ejecutar=None):
+        self.renderizar = renderizar
+        self.publicar = publicar
+        self.ejecutar = ejecutar or (lambda frame: frame())
+        self.hz = hz
+        self.marcas = 0
+        self.renderizadas = 0
+        self.frames = 0
+        self._pendientes = {}
+        self._detenido = False
+        self._lock = threading.Lock()
+        self._evento = threading.Event()
+        threading.Thread(target=self._bucle, daemon=True).start()
+
+    @property
+    def agrupadas(self) -> int:
+        # Notifications that were overwritten before reaching the screen
+        with self._lock:
+            return self.marcas - self.renderizadas - len(self._pendientes)
+
+    def set_hz(self, hz: int):
+        self.hz = max(1, int(hz))
+
+    def marcar(self, clave, valor):
+        with self._lock:
+            self.marcas += 1
+            self._pendientes[clave] = valor
+        self._evento.set()
+
+    def descartar(self, claves):
+        with self._lock:
+            for clave in claves:
+                if self._pendientes.pop(clave, None) is not None:
+                    self.marcas -= 1
+
+    def detener(self):
+        # Pending notifications are dropped; nothing is rendered afterwards
+        with self._lock:
+            self._detenido = True
+            self._pendientes = {}
+        self._evento.set()
+
+    def _frame(self, lote):
+        for valor in lote.values():
+            self.renderizar(valor)
+        self.frames += 1
+        self.publicar()
+
+    def _bucle(self):
+        while True:
+            self._evento.wait()
+            inicio = time.monotonic()
+            with self._lock:
+                if self._detenido:
+                    return
+                self._evento.clear()
+                lote = self._pendientes
+                self._pendientes = {}
+                self.renderizadas += len(lote)
+            try:
+                self.ejecutar(functools.partial(self._frame, lote))
+            except Exception as ex:
+                logging.error(f"Error al refrescar el progreso: {ex}")
+            # Hold the next flush until the frame interval has elapsed
+            restante = 1.0 / self.hz - (time.monotonic() - inicio)
+            if restante > 0:
+                time.sleep(restante)
+
+class TareaPlanificada:
+    def __init__(self, funcion, carril: str, clave, instante: float):
+        self.funcion = funcion
+        self.carril = carril
+        self.clave = clave
+        self.instante = instante
+        self.cancelada = False
+
+    def cancelar(self):
+        # Dropped if it has not started; a running task polls `cancelada`
+        self.cancelada = True
+
+class Planificador:
+    # Single scheduler for background work outside the download queue (library
+    # refreshes, searches, metadata lookups). Tasks run on named lanes, one at a
+    # time per lane and in due order, so work sharing state never overlaps.
+    # A task scheduled with a `clave` supersedes the previous one with the same
+    # key: stale work is dropped before it starts and can check
+    # `tarea.cancelada` to stop early. `funcion(tarea)` runs on the lane thread.
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._carriles = {}   # carril -> heap of (instante, orden, tarea)
+        self._hilos = []
+        self._claves = {}     # clave -> latest TareaPlanificada
+        self._orden = itertools.count()
+        self._cerrado = False
+
+    def programar(self, funcion, carril: str = "general", clave=None, retardo: float = 0.0) -> TareaPlanificada:
+        tarea = TareaPlanificada(funcion, carril, clave, time.monotonic() + retardo)
+        with self._cond:
+            if self._cerrado:
+                tarea.cancelar()
+                return tarea
+            if clave is not None:
+                anterior = self._claves.get(clave)
+                if anterior:
+                    anterior.cancelar()
+                self._claves[clave] = tarea
+            if carril not in self._carriles:
+                self._carriles[carril] = []
+                hilo = threading.Thread(target=self._bucle, args=(carril,), name=f"planificador-{carril}", daemon=True)
+                self._hilos.append(hilo)
+                hilo.start()
+            heapq.heappush(self._carriles[carril], (tarea.instante, next(self._orden), tarea))
+            self._cond.notify_all()
+        return tarea
+
+    def cancelar(self, clave):
+        with self._cond:
+            tarea = self._claves.pop(clave, None)
+        if tarea:
+            tarea.cancelar()
+
+    def cerrar(self, timeout: float = None):
+        # Pending tasks are dropped and running ones are asked to stop
+        with self._cond:
+            self._cerrado = True
+            for cola in self._carriles.values():
+                for _, _, tarea in cola:
+                    tarea.cancelar()
+                cola.clear()
+            for tarea in self._claves.values():
+                tarea.cancelar()
+            self._cond.notify_all()
+        limite = None if timeout is None else time.monotonic() + timeout
+        for hilo in self._hilos:
+            hilo.join(None if limite is None else max(0.0, limite - time.monotonic()))
+
+    def _siguiente(self, carril: str):
+        with self._cond:
+            cola = self._carriles[carril]
+            while not self._cerrado:
+                if not cola:
+                    self._cond.wait()
+                    continue
+                espera = cola[0][0] - time.monotonic()
+                if espera > 0:
+                    # Debounced task not due yet
+                    self._cond.wait(espera)
+                    continue
+                tarea = heapq.heappop(cola)[2]
+                if not tarea.cancelada:
+                    return tarea
+            return None
+
+    def _bucle(self, carril: str):
+        while True:
+            tarea = self._siguiente(carril)
+            if tarea is None:
+                return
+            try:
+                tarea.funcion(tarea)
+            except Exception as ex:
+                logging.error(f"Error en una tarea en segundo plano ({carril}): {ex}")
+            finally:
+                with self._cond:
+                    if tarea.clave is not None and self._claves.get(tarea.clave) is tarea:
+                        del self._claves[tarea.clave]
+
+EXTENSIONES_VIDEO = {'.mp4', '.mkv', '.webm', '.mov', '.avi', '.flv'}
+TAMAÑO_PAGINA = 100
+
+# Folder watcher: changes are applied once events stop for RETARDO_VIGILANCIA
+# seconds, and at least every ESPERA_MAXIMA_VIGILANCIA during a long burst
+RETARDO_VIGILANCIA = 0.5
+ESPERA_MAXIMA_VIGILANCIA = 3
+
+# extract_info cache; format URLs expire, so entries are short-lived
+CAPACIDAD_METADATOS = 200
+TTL_METADATOS = 30 * 60
+
+# On-disk thumbnail cache
+LIMITE_MINIATURAS = 200 << 20
+ANCHO_MINIATURA = 160
+
+def obtener_carpeta_datos() -> Path:
+    # Flet sets FLET_APP_STORAGE_DATA for packaged apps
+    if os.getenv("FLET_APP_STORAGE_DATA"):
+        carpeta = Path(os.environ["FLET_APP_STORAGE_DATA"])
+    elif platform.system() == "Windows":
+        carpeta = Path(os.getenv("APPDATA", Path.home())) / "YDExplorer"
+    elif platform.system() == "Darwin":  # macOS
+        carpeta = Path.home() / "Library" / "Application Support" / "YDExplorer"
+    else:  # Linux
+        carpeta = Path(os.getenv("XDG_DATA_HOME", Path.home() / ".local" / "share")) / "YDExplorer"
+    carpeta.mkdir(parents=True, exist_ok=True)
+    return carpeta
+
+def obtener_carpeta_descargas() -> Path:
+    carpeta = Path.home() / "Videos"
+    if not carpeta.exists():
+        carpeta = Path.home() / "Downloads"
+    carpeta.mkdir(parents=True, exist_ok=True)
+    return carpeta
+
+BLOQUE_HUELLA = 64 << 10
+
+def huella_parcial(ruta: str, tamaño: int) -> str:
+    # Hash of the size plus three 64 KiB samples (start, middle, end), read
+    # in place; small files are hashed whole
+    huella = hashlib.blake2b(str(tamaño).encode(), digest_size=16)
+    with open(ruta, "rb") as archivo:
+        if tamaño <= 3 * BLOQUE_HUELLA:
+            for bloque in iter(lambda: archivo.read(BLOQUE_HUELLA), b""):
+                huella.update(bloque)
+        else:
+            for posicion in (0, tamaño // 2 - BLOQUE_HUELLA // 2, tamaño - BLOQUE_HUELLA):
+                archivo.seek(posicion)
+                huella.update(archivo.read(BLOQUE_HUELLA))
+    return huella.hexdigest()
+
+VideoIndexado = namedtuple(
+    'VideoIndexado',
+    ['ruta', 'nombre', 'tamaño', 'mtime', 'url', 'titulo', 'canal', 'duracion', 'resolucion']
+)
+
+class IndiceBiblioteca:
+    # Persistent SQLite index of the download folder. `reconciliar` only writes
+    # rows whose size/mtime changed, and the library view reads sorted pages
+    # straight from the index instead of globbing and stat()ing every file.
+    MIGRACIONES = [
+        """
+        CREATE TABLE videos (
+            ruta TEXT PRIMARY KEY,
+            nombre TEXT NOT NULL,
+            tamaño INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            url TEXT,
+            titulo TEXT,
+            canal TEXT,
+            duracion REAL,
+            resolucion TEXT
+        );
+        CREATE INDEX videos_mtime ON videos (mtime DESC);
+        CREATE TABLE meta (clave TEXT PRIMARY KEY, valor TEXT);
+        """,
+        # Download archive keyed by extractor + video id, and partial content
+        # hashes for finding duplicate files
+        """
+        CREATE TABLE archivo (
+            extractor TEXT NOT NULL,
+            video_id TEXT NOT NULL,
+            ruta TEXT NOT NULL,
+            url TEXT,
+            instante REAL NOT NULL,
+            PRIMARY KEY (extractor, video_id)
+        );
+        ALTER TABLE videos ADD COLUMN huella TEXT;
+        CREATE INDEX videos_tamaño ON videos (tamaño);
+        CREATE INDEX videos_url ON videos (url);
+        """,
+    ]
+
+    def __init__(self, ruta_db: Path, carpeta: Path):
+        self.carpeta = carpeta
+        self.suscriptores = []  # callables(videos_actualizados, rutas_eliminadas)
+        self._lock_suscriptores = threading.Lock()
+        self._lock = threading.RLock()
+        self._conexion = sqlite3.connect(str(ruta_db), check_same_thread=False)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute("PRAGMA synchronous=NORMAL")
+        self._migrar()
+
+    def _migrar(self):
+        with self._lock, self._conexion:
+            version = self._conexion.execute("PRAGMA user_version").fetchone()[0]
+            for i, script in enumerate(self.MIGRACIONES[version:], start=version + 1):
+                self._conexion.executescript(script)
+                self._conexion.execute(f"PRAGMA user_version = {i}")
+
+    def _meta(self, clave: str):
+        fila = self._conexion.execute("SELECT valor FROM meta WHERE clave = ?", (clave,)).fetchone()
+        return fila[0] if fila else None
+
+    def reconciliar(self, forzar: bool = False) -> int:
+        # Returns the number of rows added, updated or removed
+        try:
+            mtime_carpeta = str(self.carpeta.stat().st_mtime_ns)
+        except OSError:
+            return 0
+        with self._lock:
+            # Creating, deleting or renaming a file bumps the folder mtime;
+            # editing one in place does not (see REVISION_BIBLIOTECA)
+            if not forzar and self._meta("mtime_carpeta") == mtime_carpeta:
+                return 0
+            conocidos = {ruta: (tamaño, mtime) for ruta, tamaño, mtime in
+                         self._conexion.execute("SELECT ruta, tamaño, mtime FROM videos")}
+        
+        cambiados = []
+        vistos = set()
+        with os.scandir(self.carpeta) as entradas:
+            for entrada in entradas:
+                if os.path.splitext(entrada.name)[1].lower() not in EXTENSIONES_VIDEO:
+                    continue
+                try:
+                    if not entrada.is_file():
+                        continue
+                    stats = entrada.stat()
+                except OSError:
+                    continue
+                vistos.add(entrada.path)
+                if conocidos.get(entrada.path) != (stats.st_size, stats.st_mtime):
+                    cambiados.append((entrada.path, Path(entrada.name).stem, stats.st_size, stats.st_mtime))
+        eliminados = [(ruta,) for ruta in conocidos.keys() - vistos]
+        return self._aplicar(cambiados, eliminados, mtime_carpeta)
+
+    def actualizar_rutas(self, rutas) -> int:
+        # Incremental reconcile of the paths reported by VigilanteCarpeta. None
+        # means events were lost, so the whole folder is scanned again.
+        if rutas is None:
+            return self.reconciliar(forzar=True)
+        try:
+            # Read first: a change after this point leaves the folder marked as unseen
+            mtime_carpeta = str(self.carpeta.stat().st_mtime_ns)
+        except OSError:
+            return 0
+        rutas = [ruta for ruta in rutas if os.path.splitext(ruta)[1].lower() in EXTENSIONES_VIDEO]
+        conocidos = {}
+        with self._lock:
+            for i in range(0, len(rutas), 500):
+                lote = rutas[i:i + 500]
+                conocidos.update((ruta, (tamaño, mtime)) for ruta, tamaño, mtime in self._conexion.execute(
+                    f"SELECT ruta, tamaño, mtime FROM videos WHERE ruta IN ({','.join('?' * len(lote))})", lote))
+        
+        cambiados = []
+        eliminados = []
+        for ruta in rutas:
+            try:
+                stats = os.stat(ruta)
+            except OSError:
+                stats = None
+            if stats is None or not stat.S_ISREG(stats.st_mode):
+                if ruta in conocidos:
+                    eliminados.append((ruta,))
+            elif conocidos.get(ruta) != (stats.st_size, stats.st_mtime):
+                cambiados.append((ruta, Path(ruta).stem, stats.st_size, stats.st_mtime))
+        return self._aplicar(cambiados, eliminados, mtime_carpeta)
+
+    def _aplicar(self, cambiados, eliminados, mtime_carpeta: str) -> int:
+        with self._lock, self._conexion:
+            self._conexion.executemany(
+                """INSERT INTO videos (ruta, nombre, tamaño, mtime) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(ruta) DO UPDATE SET tamaño = excluded.tamaño, mtime = excluded.mtime, huella = NULL""",
+                cambiados
+            )
+            self._conexion.executemany("DELETE FROM videos WHERE ruta = ?", eliminados)
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO meta (clave, valor) VALUES ('mtime_carpeta', ?)", (mtime_carpeta,)
+            )
+        if cambiados or eliminados:
+            logging.info(f"Índice de biblioteca: {len(cambiados)} cambiados, {len(eliminados)} eliminados")
+            self._notificar([c[0] for c in cambiados], [e[0] for e in eliminados])
+        return len(cambiados) + len(eliminados)
+
+    def suscribir(self, callback):
+        with self._lock_suscriptores:
+            # Replaced, not mutated: notifications iterate without the lock
+            self.suscriptores = self.suscriptores + [callback]
+
+    def desuscribir(self, callback):
+        with self._lock_suscriptores:
+            # Compared by equality: bound methods are new objects on each access
+            self.suscriptores = [c for c in self.suscriptores if c != callback]
+
+    def _notificar(self, rutas_actualizadas, rutas_eliminadas):
+        suscriptores = self.suscriptores
+        videos = self.obtener(rutas_actualizadas) if suscriptores else []
+        for callback in suscriptores:
+            try:
+                callback(videos, rutas_eliminadas)
+            except Exception as ex:
+                logging.error(f"Error al notificar cambios del índice: {ex}")
+
+    def registrar(self, ruta: Path, url: str = None, titulo: str = None, canal: str = None,
+                  duracion: float = None, resolucion: str = None):
+        # Store a finished download together with the metadata yt-dlp extracted
+        try:
+            stats = ruta.stat()
+        except OSError:
+            return
+        with self._lock, self._conexion:
+            self._conexion.execute(
+                """INSERT INTO videos (ruta, nombre, tamaño, mtime, url, titulo, canal, duracion, resolucion)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(ruta) DO UPDATE SET
+                       tamaño = excluded.tamaño, mtime = excluded.mtime, huella = NULL, url = excluded.url,
+                       titulo = excluded.titulo, canal = excluded.canal,
+                       duracion = excluded.duracion, resolucion = excluded.resolucion""",
+                (str(ruta), ruta.stem, stats.st_size, stats.st_mtime, url, titulo, canal, duracion, resolucion)
+            )
+        self._notificar([str(ruta)], [])
+
+    def archivar(self, extractor: str, video_id: str, ruta: str, url: str = None):
+        with self._lock, self._conexion:
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO archivo (extractor, video_id, ruta, url, instante) VALUES (?, ?, ?, ?, ?)",
+                (extractor, video_id, ruta, url, time.time())
+            )
+
+    def en_archivo(self, extractor: str = None, video_id: str = None, url: str = None):
+        # Library entry of an already downloaded video, by extractor + id or,
+        # for downloads made before the archive existed, by exact URL
+        fila = None
+        with self._lock:
+            if extractor and video_id:
+                fila = self._conexion.execute(
+                    "SELECT v.ruta, v.nombre, v.tamaño, v.mtime, v.url, v.titulo, v.canal, v.duracion, v.resolucion "
+                    "FROM archivo a JOIN videos v ON v.ruta = a.ruta WHERE a.extractor = ? AND a.video_id = ?",
+                    (extractor, video_id)
+                ).fetchone()
+            if fila is None and url:
+                fila = self._conexion.execute(
+                    "SELECT ruta, nombre, tamaño, mtime, url, titulo, canal, duracion, resolucion "
+                    "FROM videos WHERE url = ? LIMIT 1", (url,)
+                ).fetchone()
+        # The file may have been deleted since the last reconcile
+        if fila is None or not os.path.exists(fila[0]):
+            return None
+        return VideoIndexado(*fila)
+
+    def buscar_duplicados(self):
+        # Groups of library files with the same content. Only files sharing a
+        # size are hashed, and their partial hashes are kept in the index
+        # until the file changes.
+        with self._lock:
+            candidatos = self._conexion.execute(
+                "SELECT ruta, tamaño, mtime, huella FROM videos WHERE tamaño IN "
+                "(SELECT tamaño FROM videos WHERE tamaño > 0 GROUP BY tamaño HAVING COUNT(*) > 1)"
+            ).fetchall()
+        grupos = defaultdict(list)
+        nuevas = []
+        for ruta, tamaño, mtime, huella in candidatos:
+            if huella is None:
+                try:
+                    huella = huella_parcial(ruta, tamaño)
+                except OSError:
+                    continue
+                nuevas.append((huella, ruta, mtime))
+            grupos[(tamaño, huella)].append(ruta)
+        if nuevas:
+            with self._lock, self._conexion:
+                self._conexion.executemany("UPDATE videos SET huella = ? WHERE ruta = ? AND mtime = ?", nuevas)
+        return [sorted(self.obtener(rutas), key=lambda v: v.mtime) for rutas in grupos.values() if len(rutas) > 1]
+
+    def obtener(self, rutas):
+        videos = []
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for i in range(0, len(rutas), 500):
+                lote = rutas[i:i + 500]
+                videos += [VideoIndexado(*fila) for fila in self._conexion.execute(
+                    "SELECT ruta, nombre, tamaño, mtime, url, titulo, canal, duracion, resolucion "
+                    f"FROM videos WHERE ruta IN ({','.join('?' * len(lote))})", lote)]
+        return videos
+
+    def todos(self):
+        with self._lock:
+            return [VideoIndexado(*fila) for fila in self._conexion.execute(
+                "SELECT ruta, nombre, tamaño, mtime, url, titulo, canal, duracion, resolucion FROM videos")]
+
+    def _filtro(self, busqueda: str):
+        if not busqueda:
+            return "", []
+        patron = busqueda.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return " WHERE nombre LIKE ? ESCAPE '\\'", [f"%{patron}%"]
+
+    def consultar(self, busqueda: str = "", limite: int = TAMAÑO_PAGINA, desplazamiento: int = 0):
+        where, parametros = self._filtro(busqueda)
+        sql = ("SELECT ruta, nombre, tamaño, mtime, url, titulo, canal, duracion, resolucion FROM videos"
+               f"{where} ORDER BY mtime DESC LIMIT ? OFFSET ?")
+        with self._lock:
+            return [VideoIndexado(*fila) for fila in
+                    self._conexion.execute(sql, parametros + [limite, desplazamiento])]
+
+    def contar(self, busqueda: str = "") -> int:
+        where, parametros = self._filtro(busqueda)
+        with self._lock:
+            return self._conexion.execute(f"SELECT COUNT(*) FROM videos{where}", parametros).fetchone()[0]
+
+class VigilanteCarpeta:
+    # Watches the download folder with inotify (Linux only, through libc) and
+    # calls `on_cambios(rutas)` from its own thread with the set of paths that
+    # were created, written, renamed or deleted, debounced. `on_cambios(None)`
+    # means the kernel dropped events and the folder has to be rescanned.
+    # Subfolders, such as the download staging folder, are not watched.
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ONLYDIR = 0x1000000
+    IN_ISDIR = 0x40000000
+    EVENTOS = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+    CABECERA = struct.Struct("iIII")  # wd, mask, cookie, len
+
+    def __init__(self, carpeta: Path, on_cambios):
+        self.carpeta = carpeta
+        self.on_cambios = on_cambios
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        if self._libc.inotify_add_watch(self._fd, os.fsencode(carpeta), self.EVENTOS | self.IN_ONLYDIR) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, f"inotify_add_watch {carpeta}")
+        # Written to by `cerrar` to wake the thread out of select()
+        self._despertar, self._aviso = os.pipe()
+        self._cerrado = False
+        self._hilo = threading.Thread(target=self._bucle, name="vigilante", daemon=True)
+        self._hilo.start()
+
+    @staticmethod
+    def disponible() -> bool:
+        return platform.system() == "Linux" and hasattr(ctypes.CDLL(None), "inotify_init1")
+
+    def cerrar(self):
+        if self._cerrado:
+            return
+        self._cerrado = True
+        if self._hilo.is_alive():
+            os.write(self._aviso, b"x")
+            self._hilo.join()
+        for fd in (self._fd, self._despertar, self._aviso):
+            os.close(fd)
+
+    def _bucle(self):
+        pendientes = set()
+        desbordado = False
+        primero = ultimo = 0.0
+        while True:
+            espera = None
+            if pendientes or desbordado:
+                ahora = time.monotonic()
+                espera = max(0.0, min(ultimo + RETARDO_VIGILANCIA, primero + ESPERA_MAXIMA_VIGILANCIA) - ahora)
+            listos, _, _ = select.select([self._fd, self._despertar], [], [], espera)
+            if self._despertar in listos:
+                return
+            if self._fd in listos:
+                ahora = time.monotonic()
+                if not (pendientes or desbordado):
+                    primero = ahora
+                ultimo = ahora
+                activo, desbordado = self._leer(pendientes, desbordado)
+                if not activo:
+                    logging.warning(f"Se dejó de vigilar {self.carpeta}: la carpeta se movió o eliminó")
+                    self._entregar(None)
+                    return
+                continue
+            self._entregar(None if desbordado else pendientes)
+            pendientes = set()
+            desbordado = False
+
+    def _leer(self, pendientes: set, desbordado: bool):
+        # Returns (folder still watched, events were lost)
+        try:
+            datos = os.read(self._fd, 64 << 10)
+        except BlockingIOError:
+            return True, desbordado
+        posicion = 0
+        while posicion < len(datos):
+            _, mascara, _, longitud = self.CABECERA.unpack_from(datos, posicion)
+            posicion += self.CABECERA.size
+            nombre = datos[posicion:posicion + longitud].rstrip(b"\0")
+            posicion += longitud
+            if mascara & (self.IN_DELETE_SELF | self.IN_MOVE_SELF | self.IN_IGNORED):
+                return False, desbordado
+            if mascara & self.IN_Q_OVERFLOW:
+                desbordado = True
+            elif nombre and not mascara & self.IN_ISDIR:
+                pendientes.add(os.path.join(self.carpeta, os.fsdecode(nombre)))
+        return True, desbordado
+
+    def _entregar(self, rutas):
+        try:
+            self.on_cambios(rutas)
+        except Exception as ex:
+            logging.error(f"Error al aplicar cambios de {self.carpeta}: {ex}")
+
+def normalizar_texto(texto: str) -> str:
+    # Case- and accent-insensitive form used for search ("Canción" -> "cancion")
+    if not texto or texto.isascii():
+        return (texto or "").casefold()
+    texto = unicodedata.normalize('NFKD', texto)
+    return "".join(c for c in texto if not unicodedata.combining(c)).casefold()
+
+def tokenizar(texto: str):
+    return re.findall(r"\w+", normalizar_texto(texto))
+
+class IndiceBusqueda:
+    # In-memory inverted index over the library metadata. Documents are split
+    # into normalized tokens; a trigram index over the token vocabulary resolves
+    # substring queries without scanning every document (queries shorter than
+    # three characters match token prefixes). Filename and title matches weigh
+    # more than channel and source URL matches.
+    PESO_PRINCIPAL = 2
+    PESO_SECUNDARIO = 1
+
+    def __init__(self):
+        self.cargado = False
+        self._lock = threading.Lock()
+        self._videos = {}                       # ruta -> VideoIndexado
+        self._mtimes = {}                       # ruta -> mtime, for C-level sort keys
+        self._tokens_doc = {}                   # ruta -> (principales, secundarios)
+        self._principal = defaultdict(set)      # token -> rutas (filename/title)
+        self._secundario = defaultdict(set)     # token -> rutas (channel/url)
+        self._ngramas = defaultdict(set)        # trigram or 1-2 char prefix -> tokens
+
+    def cargar(self, obtener_videos):
+        # `obtener_videos` runs under the lock so no concurrent update is lost
+        with self._lock:
+            for estructura in (self._videos, self._mtimes, self._tokens_doc,
+                               self._principal, self._secundario, self._ngramas):
+                estructura.clear()
+            for video in obtener_videos():
+                self._agregar(video)
+            self.cargado = True
+
+    def actualizar(self, videos, rutas_eliminadas):
+        with self._lock:
+            if not self.cargado:
+                return  # The initial load will pick these up
+            for ruta in rutas_eliminadas:
+                self._quitar(ruta)
+            for video in videos:
+                self._quitar(video.ruta)
+                self._agregar(video)
+
+    def _agregar(self, video: VideoIndexado):
+        principales = set(tokenizar(f"{video.nombre} {video.titulo or ''}"))
+        secundarios = set(tokenizar(f"{video.canal or ''} {video.url or ''}")) - principales
+        self._videos[video.ruta] = video
+        self._mtimes[video.ruta] = video.mtime
+        self._tokens_doc[video.ruta] = (principales, secundarios)
+        for tokens, postings in ((principales, self._principal), (secundarios, self._secundario)):
+            for token in tokens:
+                if token not in self._principal and token not in self._secundario:
+                    for ngrama in self._ngramas_de(token):
+                        self._ngramas[ngrama].add(token)
+                postings[token].add(video.ruta)
+
+    def _quitar(self, ruta: str):
+        if ruta not in self._tokens_doc:
+            return
+        del self._videos[ruta]
+        del self._mtimes[ruta]
+        principales, secundarios = self._tokens_doc.pop(ruta)
+        for tokens, postings in ((principales, self._principal), (secundarios, self._secundario)):
+            for token in tokens:
+                postings[token].discard(ruta)
+                if not postings[token]:
+                    del postings[token]
+                if token not in self._principal and token not in self._secundario:
+                    for ngrama in self._ngramas_de(token):
+                        self._ngramas[ngrama].discard(token)
+                        if not self._ngramas[ngrama]:
+                            del self._ngramas[ngrama]
+
+    @staticmethod
+    def _ngramas_de(token: str):
+        ngramas = {token[i:i + 3] for i in range(len(token) - 2)}
+        ngramas.add(token[:1])
+        if len(token) > 1:
+            ngramas.add(token[:2])
+        return ngramas
+
+    def _vocabulario(self, termino: str):
+        # Vocabulary tokens matching `termino`
+        if len(termino) < 3:
+            return self._ngramas.get(termino[:2], set())
+        candidatos = None
+        for trigrama in sorted(self._ngramas_de(termino) - {termino[:1], termino[:2]},
+                               key=lambda t: len(self._ngramas.get(t, ()))):
+            tokens = self._ngramas.get(trigrama)
+            if not tokens:
+                return set()
+            candidatos = set(tokens) if candidatos is None else candidatos & tokens
+        return {t for t in candidatos if termino in t}
+
+    def _niveles(self, termino: str):
+        # [(score, rutas)] for one term, each ruta only at its best score
+        niveles = defaultdict(set)
+        for token in self._vocabulario(termino):
+            peso = 3 if token == termino else 2 if token.startswith(termino) else 1
+            if token in self._principal:
+                niveles[peso * self.PESO_PRINCIPAL] |= self._principal[token]
+            if token in self._secundario:
+                niveles[peso * self.PESO_SECUNDARIO] |= self._secundario[token]
+        vistos = set()
+        resultado = []
+        for peso in sorted(niveles, reverse=True):
+            nuevas = niveles[peso] - vistos
+            vistos |= nuevas
+            resultado.append((peso, nuevas))
+        return resultado, vistos
+
+    def buscar(self, consulta: str):
+        # Returns matching videos ranked by relevance, then newest first
+        terminos = list(dict.fromkeys(tokenizar(consulta)))
+        if not terminos:
+            return []
+        with self._lock:
+            por_termino = [self._niveles(termino) for termino in terminos]
+            # Every term has to match
+            coincidencias = set.intersection(*(vistos for _, vistos in por_termino))
+            if len(por_termino) == 1:
+                grupos = por_termino[0][0]
+            else:
+                puntuacion = dict.fromkeys(coincidencias, 0)
+                for niveles, _ in por_termino:
+                    for peso, rutas in niveles:
+                        for ruta in rutas & coincidencias:
+                            puntuacion[ruta] += peso
+                agrupadas = defaultdict(set)
+                for ruta, peso in puntuacion.items():
+                    agrupadas[peso].add(ruta)
+                grupos = sorted(agrupadas.items(), reverse=True)
+            videos = self._videos
+            resultado = []
+            for _, rutas in grupos:
+                orden = sorted(rutas, key=self._mtimes.__getitem__, reverse=True)
+                resultado += map(videos.__getitem__, orden)
+            return resultado
+
+class CacheMetadatos:
+    # LRU + TTL cache of yt-dlp extract_info results keyed by URL, optionally
+    # backed by SQLite. Concurrent lookups of the same URL share one extraction.
+    def __init__(self, capacidad: int = CAPACIDAD_METADATOS, ttl: float = TTL_METADATOS, ruta_db: Path = None):
+        self.capacidad = capacidad
+        self.ttl = ttl
+        self.aciertos = 0
+        self.fallos = 0
+        self._datos = OrderedDict()  # url -> (expira, info)
+        self._en_curso = {}          # url -> threading.Event
+        self._lock = threading.Lock()
+        self._conexion = None
+        if ruta_db:
+            self.activar_disco(ruta_db)
+
+    @property
+    def en_disco(self) -> bool:
+        return self._conexion is not None
+
+    @property
+    def tasa_aciertos(self) -> float:
+        total = self.aciertos + self.fallos
+        return self.aciertos / total if total else 0.0
+
+    def activar_disco(self, ruta_db: Path):
+        with self._lock:
+            if self._conexion:
+                return
+            self._conexion = sqlite3.connect(str(ruta_db), check_same_thread=False)
+            with self._conexion:
+                self._conexion.execute(
+                    "CREATE TABLE IF NOT EXISTS metadatos (url TEXT PRIMARY KEY, expira REAL, info TEXT)"
+                )
+                self._conexion.execute("DELETE FROM metadatos WHERE expira < ?", (time.time(),))
+
+    def desactivar_disco(self):
+        with self._lock:
+            if self._conexion:
+                self._conexion.close()
+                self._conexion = None
+
+    def _leer(self, url: str):
+        ahora = time.time()
+        entrada = self._datos.get(url)
+        if entrada and entrada[0] > ahora:
+            self._datos.move_to_end(url)
+            return entrada[1]
+        self._datos.pop(url, None)
+        if self._conexion:
+            fila = self._conexion.execute(
+                "SELECT expira, info FROM metadatos WHERE url = ? AND expira > ?", (url, ahora)
+            ).fetchone()
+            if fila:
+                info = json.loads(fila[1])
+                self._guardar_memoria(url, fila[0], info)
+                return info
+        return None
+
+    def consultar(self, url: str):
+        # Cached info without extracting or counting a hit or miss; read-only
+        with self._lock:
+            return self._leer(url)
+
+    def _guardar_memoria(self, url: str, expira: float, info: dict):
+        self._datos[url] = (expira, info)
+        self._datos.move_to_end(url)
+        while len(self._datos) > self.capacidad:
+            self._datos.popitem(last=False)
+
+    def guardar(self, url: str, info: dict):
+        expira = time.time() + self.ttl
+        with self._lock:
+            claves = {url, info.get('webpage_url') or url}
+            for clave in claves:
+                self._guardar_memoria(clave, expira, info)
+            if self._conexion:
+                datos = json.dumps(info)
+                with self._conexion:
+                    self._conexion.executemany(
+                        "INSERT OR REPLACE INTO metadatos (url, expira, info) VALUES (?, ?, ?)",
+                        [(clave, expira, datos) for clave in claves]
+                    )
+
+    def invalidar(self, url: str):
+        with self._lock:
+            self._datos.pop(url, None)
+            if self._conexion:
+                with self._conexion:
+                    self._conexion.execute("DELETE FROM metadatos WHERE url = ?", (url,))
+
+    def obtener(self, url: str, extraer):
+        # Returns (info, desde_cache). `extraer()` runs at most once per URL at a time.
+        while True:
+            with self._lock:
+                info = self._leer(url)
+                if info is not None:
+                    self.aciertos += 1
+                    return copy.deepcopy(info), True
+                evento = self._en_curso.get(url)
+                if evento is None:
+                    evento = self._en_curso[url] = threading.Event()
+                    self.fallos += 1
+                    break
+            # Another thread is extracting this URL; wait and read its result
+            # (if that extraction failed, the next pass extracts it here)
+            evento.wait()
+        try:
+            info = extraer()
+            self.guardar(url, info)
+            return copy.deepcopy(info), False
+        finally:
+            with self._lock:
+                self._en_curso.pop(url, None)
+            evento.set()
+
+class CacheMiniaturas:
+    # Generates library thumbnails in the background and caches them on disk,
+    # keyed by video path + mtime and evicted least-recently-used past a size
+    # budget. The source is the yt-dlp thumbnail URL when known, otherwise a
+    # frame grabbed from the local file. The heavy lifting happens in ffmpeg
+    # child processes driven from a small thread pool, so callers never block.
+    def __init__(self, carpeta: Path, limite_bytes: int = LIMITE_MINIATURAS, trabajadores: int = None):
+        self.carpeta = carpeta
+        self.carpeta.mkdir(parents=True, exist_ok=True)
+        self.limite_bytes = limite_bytes
+        self.ffmpeg = shutil.which('ffmpeg')
+        self._en_curso = {}   # cache file -> callbacks waiting for it
+        # Cache files that could not be generated (no ffmpeg, no source URL,
+        # unreadable video); the key changes with the video's mtime
+        self._fallidas = set()
+        self._tamaño = None   # Total cache size, measured on first write
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(
+            max_workers=trabajadores or max(2, (os.cpu_count() or 2) // 2),
+            thread_name_prefix="miniaturas"
+        )
+
+    def ruta_cache(self, ruta_video: str, mtime: float) -> Path:
+        clave = hashlib.sha1(f"{ruta_video}\0{mtime}".encode()).hexdigest()
+        return self.carpeta / f"{clave}.jpg"
+
+    def solicitar(self, ruta_video: str, mtime: float, callback=None, url: str = None):
+        # `callback(base64 | None)` runs on a pool thread once the thumbnail is ready
+        destino = self.ruta_cache(ruta_video, mtime)
+        with self._lock:
+            fallida = destino in self._fallidas
+            if fallida:
+                pass
+            elif destino in self._en_curso:
+                if callback:
+                    self._en_curso[destino].append(callback)
+                return
+            else:
+                self._en_curso[destino] = [callback] if callback else []
+        if fallida:
+            # Known to fail until the video changes; answered right away
+            if callback:
+                callback(None)
+            return
+        self._pool.submit(self._procesar, destino, ruta_video, url)
+
+    def _procesar(self, destino: Path, ruta_video: str, url: str):
+        datos = None
+        try:
+            if destino.exists():
+                os.utime(destino)  # Mark as recently used
+            elif not self._generar(destino, ruta_video, url):
+                with self._lock:
+                    self._fallidas.add(destino)
+                return
+            datos = base64.b64encode(destino.read_bytes()).decode()
+        except Exception as ex:
+            logging.debug(f"No se pudo generar la miniatura de {ruta_video}: {ex}")
+        finally:
+            with self._lock:
+                callbacks = self._en_curso.pop(destino, [])
+            for callback in callbacks:
+                callback(datos)
+
+    def _generar(self, destino: Path, ruta_video: str, url: str) -> bool:
+        temporal = destino.with_suffix('.tmp.jpg')
+        escala = ['-vf', f'scale={ANCHO_MINIATURA}:-2', '-frames:v', '1', '-q:v', '5', str(temporal)]
+        intentos = []
+        if url and self.ffmpeg:
+            intentos.append([self.ffmpeg, '-y', '-loglevel', 'error', '-i', url] + escala)
+        if self.ffmpeg:
+            # Seek a few seconds in to skip black intro frames; fall back to the first frame
+            intentos.append([self.ffmpeg, '-y', '-loglevel', 'error', '-ss', '5', '-i', ruta_video] + escala)
+            intentos.append([self.ffmpeg, '-y', '-loglevel', 'error', '-i', ruta_video] + escala)
+        for comando in intentos:
+            resultado = subprocess.run(comando, capture_output=True, timeout=60)
+            if resultado.returncode == 0 and temporal.exists() and temporal.stat().st_size:
+                break
+        else:
+            if self.ffmpeg or not url:
+                return False
+            # Without ffmpeg the remote thumbnail is cached as-is
+            with urllib.request.urlopen(url, timeout=30) as respuesta:
+                temporal.write_bytes(respuesta.read())
+        os.replace(temporal, destino)
+        self._contabilizar(destino.stat().st_size)
+        return True
+
+    def cerrar(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _contabilizar(self, bytes_nuevos: int):
+        with self._lock:
+            if self._tamaño is None:
+                self._tamaño = sum(f.stat().st_size for f in self.carpeta.glob("*.jpg"))
+            else:
+                self._tamaño += bytes_nuevos
+            if self._tamaño <= self.limite_bytes:
+                return
+            # Evict least recently used files down to 80% of the budget
+            archivos = sorted(((f.stat().st_mtime, f.stat().st_size, f) for f in self.carpeta.glob("*.jpg")))
+            for _, tamaño, archivo in archivos:
+                if self._tamaño <= self.limite_bytes * 0.8:
+                    break
+                try:
+                    archivo.unlink()
+                    self._tamaño -= tamaño
+                except OSError:
+                    pass
+
+def tamaño_formato(formato: dict, duracion: float = None):
+    # Reported size of a format, or the approximate one, or bitrate x duration
+    tamaño = formato.get('filesize') or formato.get('filesize_approx')
+    if not tamaño and formato.get('tbr') and duracion:
+        tamaño = formato['tbr'] * 1000 / 8 * duracion
+    return int(tamaño) if tamaño else None
+
+def tamaño_total(formatos: list, duracion: float = None):
+    # None when any of the streams has no known size
+    tamaños = [tamaño_formato(formato, duracion) for formato in formatos]
+    return sum(tamaños) if all(tamaños) else None
+
+def estimar_tamaño(info: dict):
+    # Bytes a download will need on disk, from the selected formats, or None
+    # when the site reports no size. A merge writes the output while the
+    # streams still exist, so it needs room for both.
+    formatos = info.get('requested_formats') or [info]
+    total = tamaño_total(formatos, info.get('duration'))
+    if total is None:
+        return None
+    return total * 2 if len(formatos) > 1 else total
+
+# Automatic format selection
+FORMATO_POR_DEFECTO = 'bv*+ba/b'
+ALTURAS_MAXIMAS = [2160, 1440, 1080, 720, 480, 360]
+CODECS_VIDEO = {'h264': ('avc1', 'h264'), 'vp9': ('vp9', 'vp09'), 'av1': ('av01',)}  # vcodec prefixes
+CONTENEDORES = {'mp4': ('mp4', 'm4a'), 'webm': ('webm',), 'mkv': None}  # Stream extensions each one takes
+TIEMPOS_MAXIMOS = [5 * 60, 15 * 60, 30 * 60, 60 * 60, 2 * 60 * 60]
+TAMAÑOS_MAXIMOS = [100 << 20, 250 << 20, 500 << 20, 1 << 30, 2 << 30, 4 << 30]
+
+EleccionFormato = namedtuple('EleccionFormato', ['formato', 'descripcion', 'tamaño', 'segundos'])
+
+def resumir_eleccion(eleccion: EleccionFormato) -> str:
+    partes = [eleccion.descripcion]
+    if eleccion.tamaño:
+        partes.append(f"{eleccion.tamaño / (1 << 20):.0f} MB")
+    if eleccion.segundos:
+        partes.append(f"~{max(1, round(eleccion.segundos / 60))} min")
+    return " • ".join(partes)
+
+class SelectorFormatos:
+    # Picks the highest-quality format within the resolution, codec and
+    # container caps that finishes within the time or size budget at the
+    # throughput measured by AjusteDescargas. When nothing fits the budget the
+    # smallest candidate is used. With no caps and no budget yt-dlp keeps
+    # choosing on its own (FORMATO_POR_DEFECTO).
+    CLAVES = ('altura_maxima', 'codec', 'contenedor', 'tiempo_maximo', 'tamaño_maximo')
+
+    def __init__(self):
+        self.altura_maxima = None
+        self.codec = None
+        self.contenedor = None
+        self.tiempo_maximo = None   # Seconds
+        self.tamaño_maximo = None   # Bytes
+
+    @property
+    def activo(self) -> bool:
+        return any(getattr(self, clave) is not None for clave in self.CLAVES)
+
+    def configuracion(self) -> dict:
+        return {clave: getattr(self, clave) for clave in self.CLAVES}
+
+    def configurar(self, datos: dict):
+        if datos.get('codec') not in (None, *CODECS_VIDEO):
+            raise ValueError(f"Códec desconocido: {datos['codec']}")
+        if datos.get('contenedor') not in (None, *CONTENEDORES):
+            raise ValueError(f"Contenedor desconocido: {datos['contenedor']}")
+        for clave in self.CLAVES:
+            if clave in datos:
+                setattr(self, clave, datos[clave])
+
+    def elegir(self, info: dict, velocidad: float = None):
+        # None leaves the choice to yt-dlp
+        if not self.activo:
+            return None
+        candidatos = [self._eleccion(formatos, info.get('duration'), velocidad) for formatos in self.candidatos(info)]
+        for eleccion in candidatos:
+            if self._cabe(eleccion):
+                return eleccion
+        if not candidatos:
+            logging.info(f"Ningún formato de {info.get('webpage_url') or info.get('id')} cumple los límites")
+            return None
+        return min(candidatos, key=lambda eleccion: eleccion.tamaño or float('inf'))
+
+    def estimar(self, info: dict, velocidad: float = None):
+        # What downloading `info` would fetch: this selector's choice, or the
+        # formats yt-dlp already selected during extraction
+        eleccion = self.elegir(info, velocidad)
+        if eleccion or not info.get('format_id'):
+            return eleccion
+        return self._eleccion(info.get('requested_formats') or [info], info.get('duration'), velocidad)
+
+    def candidatos(self, info: dict) -> list:
+        # Stream combinations that pass the caps, best quality first. A codec
+        # of 'none' means the stream is missing; None means it is unknown.
+        formatos = [f for f in info.get('formats') or [] if f.get('format_id')]
+        videos = [f for f in formatos if f.get('acodec') == 'none' and f.get('vcodec') != 'none' and self._admite(f)]
+        audios = [f for f in formatos if f.get('vcodec') == 'none' and f.get('acodec') != 'none'
+                  and self._admite(f, video=False)]
+        completos = [f for f in formatos if 'none' not in (f.get('vcodec'), f.get('acodec')) and self._admite(f)]
+        candidatos = [(f,) for f in completos]
+        audio = max(audios, key=lambda f: f.get('abr') or f.get('tbr') or 0, default=None)
+        if audio:
+            candidatos += [(f, audio) for f in videos]
+        return sorted(candidatos, key=lambda formatos: (formatos[0].get('height') or 0,
+                                                        sum(f.get('tbr') or 0 for f in formatos)), reverse=True)
+
+    def _admite(self, formato: dict, video: bool = True) -> bool:
+        extensiones = CONTENEDORES.get(self.contenedor)
+        if extensiones and formato.get('ext') not in extensiones:
+            return False
+        if not video:
+            return True
+        if self.altura_maxima and (formato.get('height') or 0) > self.altura_maxima:
+            return False
+        return not self.codec or (formato.get('vcodec') or '').startswith(CODECS_VIDEO[self.codec])
+
+    def _cabe(self, eleccion: EleccionFormato) -> bool:
+        # Unknown sizes and an unmeasured link are given the benefit of the doubt
+        if self.tamaño_maximo and eleccion.tamaño and eleccion.tamaño > self.tamaño_maximo:
+            return False
+        return not (self.tiempo_maximo and eleccion.segundos and eleccion.segundos > self.tiempo_maximo)
+
+    def _eleccion(self, formatos, duracion: float, velocidad: float) -> EleccionFormato:
+        tamaño = tamaño_total(formatos, duracion)
+        video = formatos[0]
+        partes = [f"{video['height']}p" if video.get('height') else video.get('format_note') or video.get('format_id'),
+                  (video.get('vcodec') or '').split('.')[0] if video.get('vcodec') != 'none' else None,
+                  # Only merges honour the container setting; without one yt-dlp picks it
+                  video.get('ext') if len(formatos) == 1 else self.contenedor]
+        return EleccionFormato(
+            '+'.join(f['format_id'] for f in formatos if f.get('format_id')),
+            " ".join(parte for parte in partes if parte),
+            tamaño,
+            tamaño / velocidad if tamaño and velocidad else None
+        )
+
+# Global bandwidth limit
+LIMITES_ANCHO = [256 << 10, 512 << 10, 1 << 20, 2 << 20, 5 << 20, 10 << 20, 25 << 20]  # bytes/s
+RAFAGA_ANCHO = 0.5          # Seconds of traffic the bucket lets through at once
+ESPERA_MAXIMA_ANCHO = 0.5   # Throttled downloads re-check pause, cancel and limit changes this often
+
+class LimitadorAncho:
+    # Token bucket shared by every download. Bytes are charged from the
+    # progress hook once yt-dlp has written them, and a job over the limit
+    # waits there, which stalls its own transfer. Waiting jobs are served in
+    # weighted fair order (self-clocked fair queueing, weights from their
+    # priority), so the limit is split by priority while whatever a job does
+    # not use goes to the others. Time-of-day `franjas` override `limite`.
+    def __init__(self, limite: int = None, rafaga: float = RAFAGA_ANCHO):
+        self.limite = limite    # bytes/s, None for no limit
+        self.franjas = []       # (from hour, to hour, bytes/s or None); 22-6 wraps past midnight
+        self.rafaga = rafaga
+        self.segundos_espera = 0.0  # Time downloads have spent throttled
+        self._cond = threading.Condition()
+        self._fichas = 0.0
+        self._instante = time.monotonic()
+        self._reloj = 0.0       # Virtual time: tag of the last block let through
+        self._etiquetas = {}    # job id -> tag of its last block
+        self._vistos = {}       # job id -> {stream: bytes already charged}
+        self._activos = {}      # job id -> job, while it is transferring
+        self._espera = []       # Heap of (tag, turn) of the blocks waiting
+        self._turnos = itertools.count()
+
+    def configuracion(self) -> dict:
+        return {'limite': self.limite, 'franjas': [list(franja) for franja in self.franjas]}
+
+    def configurar(self, datos: dict):
+        franjas = [tuple(franja) for franja in datos.get('franjas', self.franjas)]
+        for desde, hasta, _ in franjas:
+            if not (0 <= desde < 24 and 0 <= hasta <= 24) or desde == hasta:
+                raise ValueError(f"Franja horaria no válida: {desde}-{hasta}")
+        with self._cond:
+            if 'limite' in datos:
+                self.limite = datos['limite']
+            self.franjas = franjas
+            # Throttled downloads pick up the new limit right away
+            self._cond.notify_all()
+
+    def limite_actual(self, hora: int = None):
+        hora = time.localtime().tm_hour if hora is None else hora
+        for desde, hasta, limite in self.franjas:
+            if desde <= hora < hasta or (desde > hasta and (hora >= desde or hora < hasta)):
+                return limite
+        return self.limite
+
+    def reparto(self) -> dict:
+        # job id -> share of the current limit (bytes/s) of the jobs transferring
+        with self._cond:
+            limite = self.limite_actual()
+            pesos = {id: PRIORIDADES[trabajo.prioridad] for id, trabajo in self._activos.items()}
+        if limite is None or not pesos:
+            return {}
+        total = sum(pesos.values())
+        return {id: limite * peso / total for id, peso in pesos.items()}
+
+    def consumir(self, trabajo: TrabajoDescarga, flujo: str, descargados: int):
+        # `descargados` is yt-dlp's running count for the stream `flujo`. Its
+        # first report only sets the baseline: bytes resumed from a .part file
+        # were not transferred now.
+        with self._cond:
+            self._activos[trabajo.id] = trabajo
+            vistos = self._vistos.setdefault(trabajo.id, {})
+            anteriores = vistos.get(flujo, descargados)
+            # Concurrent fragment threads may report slightly out of order
+            vistos[flujo] = max(anteriores, descargados)
+            bytes_nuevos = descargados - anteriores
+            if bytes_nuevos <= 0 or self.limite_actual() is None:
+                return
+            etiqueta = (max(self._etiquetas.get(trabajo.id, 0.0), self._reloj)
+                        + bytes_nuevos / PRIORIDADES[trabajo.prioridad])
+            self._etiquetas[trabajo.id] = etiqueta
+            turno = (etiqueta, next(self._turnos))
+            heapq.heappush(self._espera, turno)
+            inicio = time.monotonic()
+            try:
+                while not trabajo.interrupcion:
+                    limite = self.limite_actual()
+                    if limite is None:
+                        break
+                    self._reponer(limite)
+                    primero = self._espera[0] == turno
+                    if primero and self._fichas >= 0:
+                        # The bucket may go into debt by one block
+                        self._fichas -= bytes_nuevos
+                        self._reloj = etiqueta
+                        break
+                    espera = -self._fichas / limite if primero else ESPERA_MAXIMA_ANCHO
+                    self._cond.wait(min(max(espera, 0.01), ESPERA_MAXIMA_ANCHO))
+            finally:
+                self._espera.remove(turno)
+                heapq.heapify(self._espera)
+                esperado = time.monotonic() - inicio
+                trabajo.segundos_limitado += esperado
+                self.segundos_espera += esperado
+                self._cond.notify_all()
+
+    def liberar(self, trabajo: TrabajoDescarga):
+        # The job's transfer is over (finished, failed or stopped)
+        with self._cond:
+            self._activos.pop(trabajo.id, None)
+            self._vistos.pop(trabajo.id, None)
+            self._etiquetas.pop(trabajo.id, None)
+
+    def _reponer(self, limite: int):
+        ahora = time.monotonic()
+        self._fichas = min(self._fichas + (ahora - self._instante) * limite, limite * self.rafaga)
+        self._instante = ahora
+
+class MotorDescargas:
+    # Download engine: queue, journal, metadata cache, transfer tuning and
+    # library bookkeeping, with no UI. `on_cambio(trabajo)` is called from
+    # worker threads on every state change and progress hook.
+    def __init__(self, carpeta_descargas: Path, carpeta_datos: Path = None,
+                 trabajadores: int = TRABAJADORES_POR_DEFECTO, on_cambio=None,
+                 diario: bool = True, biblioteca: bool = True, miniaturas: bool = True,
+                 telemetria: bool = True, on_cambio_lista=None):
+        self.carpeta_descargas = carpeta_descargas
+        self.carpeta_datos = carpeta_datos or obtener_carpeta_datos()
+        
+        # Partial files stay out of the library until they are complete
+        self.carpeta_temporal = carpeta_descargas / CARPETA_TEMPORAL
+        self.carpeta_temporal.mkdir(parents=True, exist_ok=True)
+        self.reservas = {}  # job id -> (job, bytes it is expected to write)
+        self.nombres = {}   # Output path without extension -> job id writing it
+        self._nombres_trabajo = {}
+        self._lock_reservas = threading.Lock()
+        # Without explicit callbacks, changes go to every view attached with
+        # `suscribir` (one per session when the engine is shared)
+        self.on_cambio = on_cambio or self._difundir
+        self.on_cambio_lista = on_cambio_lista or self._difundir_lista
+        self.suscriptores = []
+        self._lock_suscriptores = threading.Lock()
+        
+        # Unfinished jobs by URL and by (extractor, video id): identical
+        # requests attach to the job already in the queue
+        self._en_curso = {}
+        self._lock_en_curso = threading.RLock()
+        
+        # Playlist entries: metadata prefetch and nested playlist enumeration
+        self.resolutores = ThreadPoolExecutor(RESOLUTORES_METADATOS, thread_name_prefix="resolutor")
+        
+        # Extraction, downloads and listings borrow warm YoutubeDL sessions
+        self.sesiones = PoolSesiones()
+        self.listas = []
+        
+        # Persistent library index (SQLite in the app data dir)
+        self.indice = None
+        self.vigilante = None
+        self._fin_revision = threading.Event()
+        if biblioteca:
+            self.indice = IndiceBiblioteca(self.carpeta_datos / "biblioteca.db", carpeta_descargas)
+            # Files added, replaced or removed by any program reach the index
+            # as they happen; elsewhere the library is reconciled on demand
+            # and rescanned every REVISION_BIBLIOTECA seconds
+            if VigilanteCarpeta.disponible():
+                try:
+                    self.vigilante = VigilanteCarpeta(carpeta_descargas, self.indice.actualizar_rutas)
+                except OSError as ex:
+                    logging.warning(f"No se puede vigilar la carpeta de descargas: {ex}")
+            if self.vigilante is None:
+                threading.Thread(target=self._revisar_biblioteca, name="revision-biblioteca", daemon=True).start()
+        
+        # extract_info results cached by URL
+        self.cache_metadatos = CacheMetadatos()
+        
+        # Fragment concurrency, chunk and buffer sizes tuned from past jobs
+        self.ajuste = AjusteDescargas(self.carpeta_datos / "ajuste_descargas.json")
+        self.selector = SelectorFormatos()
+        
+        # Bandwidth limit shared by all downloads, split by job priority
+        self.ancho = LimitadorAncho()
+        
+        # Per-attempt timings, exported as JSON lines and a Prometheus textfile
+        self.telemetria = None
+        if telemetria:
+            self.telemetria = TelemetriaDescargas(
+                self.carpeta_datos / "telemetria.jsonl",
+                self.carpeta_datos / "metricas.prom"
+            )
+        
+        # Library thumbnails
+        self.miniaturas = CacheMiniaturas(self.carpeta_datos / "miniaturas") if miniaturas else None
+        
+        # Download queue with a bounded worker pool, journaled for crash recovery
+        self.cola = ColaDescargas(
+            self.ejecutar_trabajo,
+            trabajadores=trabajadores,
+            on_cambio=self._cambio,
+            diario=DiarioDescargas(self.carpeta_datos / "trabajos.db") if diario else None
+        )
+
+    def _cambio(self, trabajo: TrabajoDescarga):
+        # Late-bound so on_cambio can be replaced after construction
+        with self._lock_en_curso:
+            if trabajo.estado in ESTADOS_TERMINADOS:
+                for clave in [clave for clave, t in self._en_curso.items() if t is trabajo]:
+                    del self._en_curso[clave]
+                if trabajo.estado != ESTADO_FALLIDO:
+                    # A failed job keeps its name: retrying it resumes its .part files
+                    self.liberar_nombre(trabajo)
+            else:
+                # Restored and retried jobs too
+                self._en_curso.setdefault(trabajo.url, trabajo)
+        if trabajo.lista:
+            trabajo.lista.notificar()
+        self.on_cambio(trabajo)
+
+    def suscribir(self, on_cambio, on_cambio_lista=None):
+        # Returns the handle for desuscribir. Callbacks run on worker threads.
+        suscripcion = (on_cambio, on_cambio_lista)
+        with self._lock_suscriptores:
+            # Replaced, not mutated: notifications iterate without the lock
+            self.suscriptores = self.suscriptores + [suscripcion]
+        return suscripcion
+
+    def desuscribir(self, suscripcion):
+        with self._lock_suscriptores:
+            self.suscriptores = [s for s in self.suscriptores if s is not suscripcion]
+
+    def _difundir(self, trabajo: TrabajoDescarga):
+        for on_cambio, _ in self.suscriptores:
+            try:
+                on_cambio(trabajo)
+            except Exception as ex:
+                logging.error(f"Error al notificar el trabajo {trabajo.id}: {ex}")
+
+    def _difundir_lista(self, lista: ListaDescarga):
+        for _, on_cambio_lista in self.suscriptores:
+            if on_cambio_lista:
+                try:
+                    on_cambio_lista(lista)
+                except Exception as ex:
+                    logging.error(f"Error al notificar la lista {lista.id}: {ex}")
+
+    def plantilla_salida(self, nombre: str = None) -> Path:
+        # Without an explicit name the video title (plus id, to avoid clashes) is used.
+        # Relative to the library folder; see opciones_yt_dlp.
+        if nombre:
+            return Path(f"{nombre}.%(ext)s")
+        return Path("%(title)s [%(id)s].%(ext)s")
+
+    def opciones_yt_dlp(self, ruta_salida: Path) -> dict:
+        # Kept JSON-serializable: they are stored in the job journal and reused on resume.
+        # yt-dlp downloads and post-processes in the staging folder and moves
+        # the finished file into the library with a rename.
+        return {
+            'format': FORMATO_POR_DEFECTO,
+            'outtmpl': str(ruta_salida),
+            'paths': {'home': str(self.carpeta_descargas), 'temp': str(self.carpeta_temporal)},
+            'noplaylist': True,
+            'continuedl': True,  # Resume from existing .part files
+        }
+
+    def opciones_extraccion(self) -> dict:
+        return {
+            'quiet': True,
+            'no_warnings': True,
+            'noplaylist': True,
+        }
+
+    def agregar(self, url: str, nombre: str = None, forzar: bool = False,
+                prioridad: str = PRIORIDAD_NORMAL) -> TrabajoDescarga:
+        # A request for a video that is already queued or downloading (from
+        # this or another session, by any form of its URL) returns that job
+        identidad = identificar_url(url)
+        claves = [url, identidad] if identidad else [url]
+        with self._lock_en_curso:
+            existente = next((self._en_curso[clave] for clave in claves if clave in self._en_curso), None)
+            if existente:
+                return self.adjuntar(existente, prioridad)
+            opciones = self.opciones_yt_dlp(self.plantilla_salida(nombre))
+            if forzar:
+                # Skips the archive check and replaces a file with the same name
+                opciones['overwrites'] = True
+            trabajo = self.cola.agregar(url, nombre or url, opciones, prioridad=prioridad)
+            for clave in claves:
+                self._en_curso.setdefault(clave, trabajo)
+        return trabajo
+
+    def adjuntar(self, trabajo: TrabajoDescarga, prioridad: str = PRIORIDAD_NORMAL) -> TrabajoDescarga:
+        # The job keeps its name and options; the highest priority asked for
+        # wins, and asking again for a paused job resumes it
+        trabajo.solicitudes += 1
+        if PRIORIDADES[prioridad] > PRIORIDADES[trabajo.prioridad]:
+            self.cola.priorizar(trabajo, prioridad)
+        if trabajo.estado == ESTADO_PAUSADO:
+            self.cola.reanudar(trabajo)
+        else:
+            self.on_cambio(trabajo)
+        return trabajo
+
+    def agregar_lista(self, url: str, rango: str = None, filtro: str = None,
+                      prioridad: str = PRIORIDAD_NORMAL) -> ListaDescarga:
+        # Entries are queued as the listing is paged in, so the first downloads
+        # start long before a big channel has been fully enumerated
+        with self._lock_en_curso:
+            # Finished listings are dropped; the same listing requested again
+            # while it is still running is returned as is
+            self.listas = [lista for lista in self.listas if lista.activa and not lista.cancelada]
+            for lista in self.listas:
+                if (lista.url, lista.rango, lista.filtro) == (url, rango, filtro):
+                    return lista
+            lista = ListaDescarga(url, rango, filtro, prioridad)
+            lista._tareas = 1
+            self.listas.append(lista)
+        threading.Thread(target=self.enumerar_lista, args=(lista, url, True), daemon=True).start()
+        return lista
+
+    def enumerar_lista(self, lista: ListaDescarga, url: str, raiz: bool = False, titulo: str = None):
+        # Flat, lazy extraction: yt-dlp yields one lightweight entry per item and
+        # only fetches the next page when the previous one has been consumed.
+        # Entries reach this engine through pre-processor hooks: flat entries at
+        # 'pre_process', fully extracted videos (a single-video URL, or an entry
+        # whose type was unknown) at 'after_filter', past the match filter.
+        yt_dlp = cargar_yt_dlp()
+        motor = self
+        
+        class EntradaLista(yt_dlp.postprocessor.PostProcessor):
+            def __init__(self, plano: bool):
+                super().__init__()
+                self.plano = plano
+            
+            def run(self, info):
+                # 'pre_process' also runs for full videos, before the match filter
+                if (info.get('_type') in ('url', 'url_transparent')) == self.plano:
+                    motor.entrada_lista(lista, self._downloader, info, raiz, self.plano, titulo)
+                return [], info
+        
+        opciones = dict(self.opciones_extraccion(), noplaylist=False, extract_flat='in_playlist', lazy_playlist=True)
+        if raiz and lista.rango:
+            opciones['playlist_items'] = lista.rango
+        if lista.filtro:
+            # yt-dlp applies it to flat entries known to be single videos, and
+            # to the others once they are fully extracted
+            opciones['match_filter'] = yt_dlp.utils.match_filter_func(lista.filtro)
+        try:
+            if lista.cancelada:
+                return
+            with self.sesiones.sesion(opciones, url) as ydl:
+                ydl.add_post_processor(EntradaLista(plano=True), when='pre_process')
+                ydl.add_post_processor(EntradaLista(plano=False), when='after_filter')
+                info = ydl.extract_info(url, download=False)
+                if raiz:
+                    lista.titulo = info.get('title') or lista.titulo
+        except Exception as ex:
+            if lista.cancelada:
+                return
+            logging.warning(f"No se pudo enumerar {url}: {ex}")
+            if raiz:
+                lista.error = ex
+        finally:
+            with lista._cond:
+                lista._tareas -= 1
+                lista.enumerando = lista._tareas > 0
+            self.on_cambio_lista(lista)
+
+    def entrada_lista(self, lista: ListaDescarga, ydl, info: dict, raiz: bool, plano: bool, titulo: str = None):
+        if lista.cancelada:
+            # Stops yt-dlp from paging in the rest of the listing
+            raise cargar_yt_dlp().utils.DownloadCancelled("Lista cancelada")
+        url = info.get('webpage_url') or info.get('url')
+        if raiz and lista.total is None:
+            lista.total = info.get('playlist_count')
+            lista.titulo = info.get('playlist_title') or info.get('playlist')
+        if plano:
+            extractor = ydl.get_info_extractor(info['ie_key']) if info.get('ie_key') else None
+            if not extractor or not extractor.is_single_video(url):
+                # Possibly a nested playlist (e.g. a channel tab): enumerate it in parallel
+                with lista._cond:
+                    lista._tareas += 1
+                self.resolutores.submit(self.enumerar_lista, lista, url, False, info.get('title'))
+                return
+        if url in self._en_curso or self.buscar_duplicado(url, None if plano else ydl.sanitize_info(info)):
+            with lista._cond:
+                lista.omitidos += 1
+            self.on_cambio_lista(lista)
+            return
+        if not lista.esperar_hueco():
+            raise cargar_yt_dlp().utils.DownloadCancelled("Lista cancelada")
+        opciones = self.opciones_yt_dlp(self.plantilla_salida())
+        # The listing's title for the entry is usually the better display name
+        self.cola.agregar(url, titulo or info.get('title') or url, opciones, lista=lista, prioridad=lista.prioridad)
+        if plano:
+            # Resolve full metadata ahead of the queue worker; concurrent lookups share one extraction
+            self.resolutores.submit(self.prefetch_metadatos, url)
+        else:
+            self.cache_metadatos.guardar(url, ydl.sanitize_info(info))
+
+    def cancelar(self, trabajo: TrabajoDescarga):
+        if self.cola.cancelar(trabajo):
+            # Paused jobs keep their .part files until now
+            self.limpiar_temporales(trabajo)
+
+    def cancelar_lista(self, lista: ListaDescarga):
+        lista.cancelar()
+        for trabajo in list(lista.trabajos):
+            self.cancelar(trabajo)
+        self.on_cambio_lista(lista)
+
+    def cerrar(self, timeout: float = None) -> bool:
+        # Stops enumerations and downloads; unfinished jobs stay in the journal
+        # and are resumed on the next start
+        for lista in self.listas:
+            lista.cancelar()
+        terminado = self.cola.cerrar(timeout)
+        self.resolutores.shutdown(wait=False, cancel_futures=True)
+        if self.miniaturas:
+            self.miniaturas.cerrar()
+        if self.vigilante:
+            self.vigilante.cerrar()
+        self._fin_revision.set()
+        self.sesiones.cerrar()
+        return terminado
+
+    def _revisar_biblioteca(self):
+        # Subscribers of the index get the changes as with the watcher
+        while not self._fin_revision.wait(REVISION_BIBLIOTECA):
+            try:
+                self.indice.reconciliar(forzar=True)
+            except Exception as ex:
+                logging.warning(f"No se pudo revisar la biblioteca: {ex}")
+
+    def reservar_espacio(self, trabajo: TrabajoDescarga, info: dict):
+        # Pre-flight check, run by yt-dlp once the formats are selected and
+        # before any transfer. Jobs that do not fit yet are held back by the queue.
+        necesarios = estimar_tamaño(info)
+        if not necesarios:
+            return
+        uso = shutil.disk_usage(self.carpeta_temporal)
+        if necesarios + MARGEN_ESPACIO > uso.total:
+            raise cargar_yt_dlp().utils.DownloadError(
+                f"El video ({necesarios >> 20} MB) no cabe en el disco de {self.carpeta_descargas}")
+        with self._lock_reservas:
+            # Free space already counts what the other downloads have written
+            pendientes = sum(max(0, reserva - t.bytes_escritos) for t, reserva in self.reservas.values())
+            libre = uso.free - pendientes - MARGEN_ESPACIO
+            if necesarios > libre:
+                raise TrabajoRetenido(
+                    f"Esperando espacio en disco: se necesitan {necesarios >> 20} MB, "
+                    f"hay {max(libre, 0) >> 20} MB disponibles")
+            self.reservas[trabajo.id] = (trabajo, necesarios)
+
+    def liberar_espacio(self, trabajo: TrabajoDescarga):
+        with self._lock_reservas:
+            self.reservas.pop(trabajo.id, None)
+
+    def ruta_salida(self, plantilla: str, ydl=None, info: dict = None):
+        # Final path without extension; None while it depends on metadata not extracted yet
+        base = plantilla[:-len(SUFIJO_PLANTILLA)] if plantilla.endswith(SUFIJO_PLANTILLA) else None
+        if base is not None and "%(" not in base:
+            return str(self.carpeta_descargas / base)
+        if ydl is None:
+            return None
+        return os.path.splitext(ydl.prepare_filename(info, outtmpl=plantilla))[0]
+
+    def nombre_en_uso(self, ruta: str, trabajo: TrabajoDescarga) -> bool:
+        # Whether `ruta` would write over a file this job does not own: one
+        # already in the library (unless it is meant to be replaced), or
+        # partial files left by a job this process no longer tracks. A job
+        # restored from the journal owns the partial files under its name.
+        if trabajo.reanudado:
+            return False
+        relativa = os.path.relpath(ruta, self.carpeta_descargas)
+        carpetas = [self.carpeta_temporal]
+        if not trabajo.opciones.get('overwrites'):
+            carpetas.append(self.carpeta_descargas)
+        return any(glob.glob(glob.escape(str(carpeta / relativa)) + ".*") for carpeta in carpetas)
+
+    def reservar_nombre(self, trabajo: TrabajoDescarga, ydl=None, info: dict = None):
+        # Two jobs writing the same file would resume each other's .part
+        # files. The output name is claimed until the job completes or is
+        # cancelled; a job whose name is taken gets "name (1)", "name (2)"...
+        # or, with a template that cannot be renamed, waits for the other job.
+        # A library file with the requested name is not replaced unless the
+        # job overwrites: its path is returned and the download is skipped.
+        plantilla = trabajo.opciones.get('outtmpl')
+        if not plantilla:
+            return
+        with self._lock_reservas:
+            if trabajo.id in self._nombres_trabajo:
+                # Later attempts keep the name of the first one
+                return
+            otro = None
+            for n in itertools.count():
+                if n == 0:
+                    candidata = plantilla
+                elif plantilla.endswith(SUFIJO_PLANTILLA):
+                    candidata = f"{plantilla[:-len(SUFIJO_PLANTILLA)]} ({n}){SUFIJO_PLANTILLA}"
+                elif otro is not None:
+                    raise TrabajoRetenido("Esperando a que termine otra descarga con el mismo nombre")
+                else:
+                    # Only a file on disk clashes: yt-dlp decides as it always did
+                    candidata = plantilla
+                    break
+                ruta = self.ruta_salida(candidata, ydl, info)
+                if ruta is None:
+                    return
+                if n == 0 and not trabajo.reanudado and not trabajo.opciones.get('overwrites'):
+                    existente = self.archivo_existente(ruta)
+                    if existente:
+                        return existente
+                otro = self.nombres.get(os.path.normcase(ruta))
+                if otro is None and not self.nombre_en_uso(ruta, trabajo):
+                    break
+            self.nombres[os.path.normcase(ruta)] = trabajo.id
+            self._nombres_trabajo[trabajo.id] = os.path.normcase(ruta)
+        if candidata == plantilla:
+            return
+        logging.info(f"Descarga {trabajo.id}: el nombre {plantilla} está en uso, se guarda como {candidata}")
+        trabajo.opciones['outtmpl'] = candidata
+        if ydl is not None:
+            ydl.params['outtmpl']['default'] = candidata
+        if self.cola.diario:
+            self.cola.diario.guardar_opciones(trabajo)
+
+    def archivo_existente(self, ruta: str):
+        # Library file saved under `ruta` (without extension), if any
+        return next((c for c in sorted(glob.glob(glob.escape(ruta) + ".*")) if os.path.isfile(c)), None)
+
+    def archivo_con_nombre(self, nombre: str):
+        # Library file a download named `nombre` would clash with, if any
+        ruta = self.ruta_salida(str(self.plantilla_salida(nombre)))
+        return ruta and self.archivo_existente(ruta)
+
+    def nombre_libre(self, nombre: str) -> str:
+        # "name (1)", "name (2)"...: the first one no library file uses
+        for n in itertools.count(1):
+            candidato = f"{nombre} ({n})"
+            if not self.archivo_con_nombre(candidato):
+                return candidato
+
+    def video_en_ruta(self, ruta: str) -> VideoIndexado:
+        # Library entry for a file; a bare one when it is not indexed (yet)
+        videos = self.indice.obtener([ruta]) if self.indice else []
+        return videos[0] if videos else VideoIndexado(ruta, os.path.basename(ruta), *[None] * 7)
+
+    def liberar_nombre(self, trabajo: TrabajoDescarga):
+        with self._lock_reservas:
+            ruta = self._nombres_trabajo.pop(trabajo.id, None)
+            if ruta is not None and self.nombres.get(ruta) == trabajo.id:
+                del self.nombres[ruta]
+
+    def comprobar_interrupcion(self, trabajo: TrabajoDescarga):
+        # yt-dlp lets DownloadCancelled through its retry and error handling
+        if trabajo.interrupcion:
+            raise cargar_yt_dlp().utils.DownloadCancelled(f"Descarga detenida ({trabajo.interrupcion})")
+
+    def limpiar_temporales(self, trabajo: TrabajoDescarga, completo: bool = True):
+        # Fragmented downloads leave one file per fragment besides the .part
+        # and .ytdl files. Without `completo` only the fragment files go: a
+        # fragment interrupted mid-transfer is fetched again on resume.
+        for ruta in trabajo.temporales:
+            ruta = Path(ruta)
+            candidatas = list(ruta.parent.glob(glob.escape(ruta.name) + "-Frag*"))
+            if completo:
+                candidatas += [ruta, ruta.with_name(ruta.name + ".ytdl")]
+            for candidata in candidatas:
+                try:
+                    os.remove(candidata)
+                except FileNotFoundError:
+                    pass
+                except OSError as ex:
+                    logging.warning(f"No se pudo borrar {candidata}: {ex}")
+        if completo:
+            trabajo.temporales.clear()
+
+    def prefetch_metadatos(self, url: str):
+        try:
+            self.cache_metadatos.obtener(url, lambda: self.extraer_info(url))
+        except Exception as ex:
+            # The queue worker retries the extraction and reports the error
+            logging.info(f"No se pudo obtener información de {url}: {ex}")
+
+    def buscar_duplicado(self, url: str, info: dict = None):
+        # Library entry already downloaded from this URL or any alternate form
+        # of it (same extractor and video id), or None
+        if not self.indice:
+            return None
+        info = info or self.cache_metadatos.consultar(url)
+        identidad = self.identidad(info) if info else identificar_url(url)
+        return self.indice.en_archivo(*(identidad or (None, None)), url=url)
+
+    def identidad(self, info: dict):
+        # Archive key of an extracted video. Ids from the generic extractor are
+        # derived from the file name and are not unique across sites.
+        if not info.get('id') or info.get('extractor_key') in (None, 'Generic'):
+            return None
+        return info['extractor_key'], info['id']
+
+    def reanudar_trabajos(self):
+        # Jobs left unfinished by a crash or by closing the app continue where they stopped
+        if not self.cola.diario:
+            return
+        for trabajo in self.cola.diario.pendientes():
+            if trabajo.estado == ESTADO_PAUSADO:
+                trabajo.detalle = "Descarga en pausa"
+            else:
+                trabajo.detalle = "Descarga interrumpida, en espera para reanudar"
+            # Before any new job can claim the name of its .part files
+            trabajo.reanudado = True
+            self.reservar_nombre(trabajo)
+            self.cola.restaurar(trabajo)
+            logging.info(f"Reanudando descarga {trabajo.id}: {trabajo.url}")
+
+    def extraer_info(self, url: str) -> dict:
+        with self.sesiones.sesion(self.opciones_extraccion(), url) as ydl:
+            return ydl.sanitize_info(ydl.extract_info(url, download=False))
+
+    def progreso_descarga(self, d, trabajo: TrabajoDescarga):
+        for clave in ('tmpfilename', 'filename'):
+            if d.get(clave):
+                trabajo.temporales.add(d[clave])
+        if d['status'] == 'downloading':
+            # Blocks while this job is over its share of the bandwidth limit
+            self.ancho.consumir(trabajo, d.get('tmpfilename') or d.get('filename'), d.get('downloaded_bytes') or 0)
+            # Never on 'finished': a fragment would be left complete but not renamed
+            self.comprobar_interrupcion(trabajo)
+        if d['status'] in ('downloading', 'finished'):
+            # yt-dlp's counts include what a .part file already had; the first
+            # report of each stream (video and audio are separate) sets the
+            # baseline, less the block it already reports as moved
+            descargados = d.get('downloaded_bytes') or 0
+            if d['status'] == 'finished':
+                descargados = d.get('total_bytes') or descargados
+            flujo = d.get('filename')
+            if flujo not in trabajo.flujos:
+                movidos = descargados if d.get('fragment_index') == 0 else (d.get('speed') or 0) * (d.get('elapsed') or 0)
+                trabajo.flujos[flujo] = (max(descargados - int(movidos), 0), descargados)
+            base, anteriores = trabajo.flujos[flujo]
+            trabajo.flujos[flujo] = (base, max(anteriores, descargados))
+            trabajo.bytes_descargados = sum(actual - base for base, actual in trabajo.flujos.values())
+            trabajo.bytes_escritos = sum(actual for _, actual in trabajo.flujos.values())
+        if d['status'] == 'finished':
+            trabajo.detalle = "Procesando archivo..."
+            trabajo.progreso = 1.0
+            trabajo.segundos_descarga += d.get('elapsed') or 0
+        elif d['status'] == 'downloading':
+            if d.get('fragment_count'):
+                trabajo.fragmentos = max(trabajo.fragmentos, d['fragment_count'])
+            if trabajo.segundos_primer_byte is None and d.get('downloaded_bytes') and trabajo.inicio_descarga:
+                trabajo.segundos_primer_byte = time.perf_counter() - trabajo.inicio_descarga
+            if d.get('speed') and (trabajo.velocidad_maxima is None or d['speed'] > trabajo.velocidad_maxima):
+                trabajo.velocidad_maxima = d['speed']
+            trabajo.velocidad = d.get('speed')
+            trabajo.eta = d.get('eta')
+            percent = d.get('_percent_str', '0%').replace('%', '').strip()
+            try:
+                percent_float = float(percent)
+                speed = d.get('_speed_str', '...')
+                eta = d.get('_eta_str', '...')
+                trabajo.detalle = f"{percent}% • Velocidad: {speed} • ETA: {eta}"
+                trabajo.progreso = percent_float / 100
+            except ValueError: # Catch ValueError if percent is not a valid float
+                trabajo.detalle = "Descargando..."
+                
+        self.on_cambio(trabajo)
+
+    def progreso_postproceso(self, d, trabajo: TrabajoDescarga):
+        # Merging and fixups run after the last 'finished' download hook
+        if d['status'] == 'started':
+            self.comprobar_interrupcion(trabajo)
+            trabajo.inicio_postproceso = time.perf_counter()
+            trabajo.detalle = f"Procesando archivo ({d.get('postprocessor')})..."
+            self.on_cambio(trabajo)
+        elif d['status'] == 'finished' and trabajo.inicio_postproceso is not None:
+            trabajo.segundos_postproceso += time.perf_counter() - trabajo.inicio_postproceso
+            trabajo.inicio_postproceso = None
+
+    def ejecutar_trabajo(self, trabajo: TrabajoDescarga):
+        # Runs inside a queue worker thread; errors are handled by ColaDescargas.
+        # When merges or fixups are pending it returns them as a continuation
+        # for the post-processing pool instead of running them here.
+        inicio = time.perf_counter()
+        parametros = self.ajuste.parametros()
+        limite = self.ancho.limite_actual()
+        if limite:
+            # Small fixed reads keep a throttled transfer smooth; yt-dlp would
+            # otherwise grow them to several MB
+            parametros['buffersize'] = min(parametros['buffersize'], max(16 << 10, int(limite * RAFAGA_ANCHO) // 4))
+            parametros['noresizebuffer'] = True
+        opciones = dict(
+            trabajo.opciones,
+            **parametros,
+            progress_hooks=[lambda d: self.progreso_descarga(d, trabajo)],
+            postprocessor_hooks=[lambda d: self.progreso_postproceso(d, trabajo)],
+            logger=RegistroYtDlp(trabajo)
+        )
+        trabajo.reiniciar_medidas()
+        trabajo.detalle = "Reanudando descarga interrumpida..." if trabajo.reanudado else "Iniciando descarga..."
+        self.on_cambio(trabajo)
+        
+        info = ydl = None
+        forzar = trabajo.opciones.get('overwrites', False)
+        try:
+            # Videos already in the archive are skipped before any transfer
+            existente = None if forzar else self.buscar_duplicado(trabajo.url)
+            if existente is None:
+                self.comprobar_interrupcion(trabajo)
+                ydl = self.sesiones.prestar(opciones, trabajo.url)
+                ydl.add_post_processor(crear_postprocesador(lambda info: self.reservar_espacio(trabajo, info)),
+                                       when='before_dl')
+                info, desde_cache = self.cache_metadatos.obtener(
+                    trabajo.url,
+                    lambda: ydl.sanitize_info(ydl.extract_info(trabajo.url, download=False))
+                )
+                trabajo.metadatos_en_cache = desde_cache
+                trabajo.inicio_descarga = time.perf_counter()
+                trabajo.segundos_extraccion = trabajo.inicio_descarga - inicio
+                # Short links are only identified once extracted
+                existente = None if forzar else self.buscar_duplicado(trabajo.url, info)
+                if existente is None:
+                    self.comprobar_interrupcion(trabajo)
+                    self.elegir_formato(ydl, trabajo, info)
+                    ocupado = self.reservar_nombre(trabajo, ydl, info)
+                    if ocupado:
+                        # Another video already saved under this name: skipped, as
+                        # yt-dlp would, and reported as a name clash
+                        logging.info(f"Descarga {trabajo.id}: ya existe {ocupado}, no se descarga")
+                        trabajo.conflicto_nombre = True
+                        existente = self.video_en_ruta(ocupado)
+                    else:
+                        info = self.descargar(ydl, trabajo, info, desde_cache)
+        except Exception as ex:
+            self.finalizar_intento(trabajo, info, inicio, ex)
+            if ydl:
+                self.sesiones.devolver(ydl)
+            if trabajo.interrupcion:
+                # yt-dlp's .ytdl index counts the fragments finished by concurrent
+                # threads, not only those appended to the .part file, so a stopped
+                # fragmented download is started over instead of resumed
+                self.limpiar_temporales(trabajo, completo=trabajo.interrupcion == ESTADO_CANCELADO or (
+                    trabajo.fragmentos and opciones.get('concurrent_fragment_downloads', 1) > 1))
+            raise
+        finally:
+            self.ancho.liberar(trabajo)
+            # Failed jobs feed their error rate back too. Time held back by the
+            # bandwidth limit says nothing about the link.
+            self.ajuste.registrar(trabajo.bytes_descargados,
+                                  max(trabajo.segundos_descarga - trabajo.segundos_limitado, 0),
+                                  trabajo.fragmentos, trabajo.errores_red)
+        
+        if existente is None and ydl.diferidos:
+            trabajo.detalle = "En espera de procesamiento..."
+            return lambda: self.postprocesar(trabajo, ydl, info, inicio)
+        if ydl:
+            self.sesiones.devolver(ydl)
+        self.completar_intento(trabajo, existente, info, inicio)
+
+    def postprocesar(self, trabajo: TrabajoDescarga, ydl, info: dict, inicio: float):
+        # Post-processing pool: merge/remux/fixups on the downloaded streams
+        try:
+            self.comprobar_interrupcion(trabajo)
+            ydl.post_process_diferido()
+        except Exception as ex:
+            self.finalizar_intento(trabajo, info, inicio, ex)
+            if trabajo.interrupcion == ESTADO_CANCELADO:
+                self.limpiar_temporales(trabajo)
+            raise
+        finally:
+            self.sesiones.devolver(ydl)
+        self.completar_intento(trabajo, None, info, inicio)
+
+    def completar_intento(self, trabajo: TrabajoDescarga, existente: VideoIndexado, info: dict, inicio: float):
+        try:
+            if existente:
+                self.omitir_duplicado(trabajo, existente)
+            else:
+                self.registrar_descarga(trabajo, cargar_yt_dlp().YoutubeDL.sanitize_info(info))
+        except Exception as ex:
+            self.finalizar_intento(trabajo, info, inicio, ex)
+            raise
+        self.finalizar_intento(trabajo, info, inicio)
+
+    def finalizar_intento(self, trabajo: TrabajoDescarga, info: dict, inicio: float, error: Exception = None):
+        self.liberar_espacio(trabajo)
+        if isinstance(error, TrabajoRetenido):
+            return
+        trabajo.segundos_total = time.perf_counter() - inicio
+        if trabajo.inicio_descarga is None:
+            # Extraction itself failed
+            trabajo.segundos_extraccion = trabajo.segundos_total
+        if self.telemetria and not trabajo.interrupcion:
+            # Attempts stopped by the user say nothing about the site
+            trabajo.metricas = self.telemetria.registrar(trabajo, info, error)
+
+    def elegir_formato(self, ydl, trabajo: TrabajoDescarga, info: dict):
+        # Jobs queued with an explicit format keep it
+        if trabajo.opciones.get('format') != FORMATO_POR_DEFECTO:
+            return
+        velocidad = self.ajuste.velocidad
+        limite = self.ancho.limite_actual()
+        if limite:
+            velocidad = min(velocidad or limite, limite)
+        eleccion = self.selector.elegir(info, velocidad)
+        if not eleccion:
+            return
+        # The fallback covers a re-extraction that returns other format ids
+        ydl.format_selector = ydl.build_format_selector(f"{eleccion.formato}/{FORMATO_POR_DEFECTO}")
+        if self.selector.contenedor:
+            ydl.params['merge_output_format'] = self.selector.contenedor
+        trabajo.detalle = f"Formato elegido: {resumir_eleccion(eleccion)}"
+        self.on_cambio(trabajo)
+
+    def descargar(self, ydl, trabajo: TrabajoDescarga, info: dict, desde_cache: bool) -> dict:
+        try:
+            return ydl.process_ie_result(info, download=True)
+        except cargar_yt_dlp().utils.DownloadError:
+            if not desde_cache:
+                raise
+            # Cached format URLs may have expired; extract again
+            logging.info(f"Metadatos en caché caducados para {trabajo.url}")
+            self.cache_metadatos.invalidar(trabajo.url)
+            # The new extraction is counted towards the time to first byte
+            trabajo.segundos_primer_byte = None
+            trabajo.inicio_descarga = time.perf_counter()
+            return ydl.extract_info(trabajo.url, download=True)
+
+    def omitir_duplicado(self, trabajo: TrabajoDescarga, existente: VideoIndexado):
+        logging.info(f"{trabajo.url} ya está descargado en {existente.ruta}")
+        trabajo.duplicado = existente.ruta
+        trabajo.archivos = [existente.ruta]
+        trabajo.progreso = 1.0
+
+    def registrar_descarga(self, trabajo: TrabajoDescarga, info: dict):
+        # Keep the extracted metadata so the library can show and search it
+        trabajo.archivos = []
+        for descarga in info.get('requested_downloads') or [info]:
+            ruta = descarga.get('filepath') or descarga.get('_filename')
+            if not ruta:
+                continue
+            trabajo.archivos.append(ruta)
+            if self.indice:
+                resolucion = info.get('resolution')
+                if not resolucion and info.get('width') and info.get('height'):
+                    resolucion = f"{info['width']}x{info['height']}"
+                self.indice.registrar(
+                    Path(ruta),
+                    url=trabajo.url,
+                    titulo=info.get('title'),
+                    canal=info.get('channel') or info.get('uploader'),
+                    duracion=info.get('duration'),
+                    resolucion=resolucion
+                )
+                identidad = self.identidad(info)
+                if identidad and len(trabajo.archivos) == 1:
+                    self.indice.archivar(*identidad, ruta, trabajo.url)
+            if self.miniaturas:
+                # Prefer the site's own thumbnail over a grabbed frame
+                try:
+                    mtime = Path(ruta).stat().st_mtime
+                except OSError:
+                    continue
+                self.miniaturas.solicitar(ruta, mtime, url=info.get('thumbnail'))